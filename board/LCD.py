@@ -14,6 +14,10 @@ class LCD:
         self.LCD_LINE_1 = 0x80 # LCD RAM addr for line one
         self.LCD_LINE_2 = 0xC0 # LCD RAM addr for line two
 
+        self.LCD_DDRAM_WIDTH = 40 # DDRAM columns per line (only LCD_WIDTH visible)
+        self.LCD_SHIFT_LEFT = 0x18 # Display shift left (both lines)
+        self.LCD_SHIFT_RIGHT = 0x1C # Display shift right (both lines)
+
         if backlight:
             # on
             self.LCD_BACKLIGHT  = 0x08
@@ -84,6 +88,27 @@ class LCD:
         for i in range(self.LCD_WIDTH):
             self.lcd_byte(ord(string[i]), self.LCD_CHR)
 
+    def load(self, string, line = 1):
+        # fill the whole 40 column DDRAM line, hidden part included,
+        # so it can be scrolled into view with shift()
+        if line == 1:
+            lcd_line = self.LCD_LINE_1
+        elif line == 2:
+            lcd_line = self.LCD_LINE_2
+        else:
+            raise ValueError('line number must be 1 or 2')
+
+        string = string[:self.LCD_DDRAM_WIDTH].ljust(self.LCD_DDRAM_WIDTH, " ")
+
+        self.lcd_byte(lcd_line, self.LCD_CMD)
+
+        for i in range(self.LCD_DDRAM_WIDTH):
+            self.lcd_byte(ord(string[i]), self.LCD_CHR)
+
+    def shift(self, left = True):
+        # move the visible window one column: one command byte, no data writes
+        self.lcd_byte(self.LCD_SHIFT_LEFT if left else self.LCD_SHIFT_RIGHT, self.LCD_CMD)
+
     def clear(self):
         # clear LCD display
         self.lcd_byte(0x01, self.LCD_CMD)
\ No newline at end of file
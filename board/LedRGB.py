@@ -1,6 +1,5 @@
 import os
 import time
-import json
 import threading
 
 try:
@@ -8,7 +7,13 @@ try:
 except Exception:
     GPIO = None
 
-import paho.mqtt.client as mqtt
+import codec
+import estadoPlaca
+import estadoPersistente
+import rpc
+import topicos
+import vigilante
+from conexionMqtt import MqttConnection, COMMAND_QOS
 
 class RGBLEDService:
     def __init__(self, red_pin=13, green_pin=12, blue_pin=18):
@@ -20,13 +25,21 @@ class RGBLEDService:
         self.mqtt_port = int(os.environ.get("MQTT_PORT", "8883"))
         self.mqtt_user = os.environ.get("MQTT_USERNAME", "isaac")
         self.mqtt_pass = os.environ.get("MQTT_PASSWORD", "ArquiGrupo4")
-        self.mqtt_client_id = os.environ.get("MQTT_CLIENT_ID", "raspberry-pi-rgb-led")
+        self.mqtt_client_id = topicos.client_id("raspberry-pi-rgb-led")
         
         self.client = None
+        self.conn = None
         self.current_color = {"red": 0, "green": 0, "blue": 0}
         self._stop = threading.Event()
         self._thread = None
         self.rgb_pwm = None
+        self.status_template = codec.StatusTemplate({
+            "type": "light",
+            "device": "rgb_led",
+            "pin_red": f"GPIO{red_pin}",
+            "pin_green": f"GPIO{green_pin}",
+            "pin_blue": f"GPIO{blue_pin}",
+        })
         
     def _setup_gpio(self):
         if GPIO is None:
@@ -53,52 +66,52 @@ class RGBLEDService:
             print(f"Error configurando GPIO: {e}")
 
     def _setup_mqtt(self):
-        self.client = mqtt.Client(client_id=self.mqtt_client_id)
-        self.client.username_pw_set(self.mqtt_user, self.mqtt_pass)
-        self.client.tls_set()
-        
-        self.client.on_message = self._on_message
-        self.client.on_connect = self._on_connect
-        
-        try:
-            self.client.connect(self.mqtt_host, self.mqtt_port, 60)
-            self.client.loop_start()
-        except Exception as e:
-            print(f"Error conectando a MQTT: {e}")
-
-    def _on_connect(self, client, userdata, flags, rc):
-        print(f"RGB LED conectado a MQTT con codigo: {rc}")
-        client.subscribe("/ilumination/control")
-        client.subscribe("/ilumination/room/+/control")
+        topics = ["/ilumination/control", "/ilumination/room/+/control"]
+        self.conn = MqttConnection(self.mqtt_client_id, self.mqtt_host, self.mqtt_port,
+                                   self.mqtt_user, self.mqtt_pass,
+                                   subscriptions=topicos.subscriptions(topics, COMMAND_QOS),
+                                   on_message=self._on_message)
+        self.client = self.conn.client
+        self.conn.start()
 
     def _on_message(self, client, userdata, msg):
+        started = time.perf_counter()
+        data = None
         try:
             topic = msg.topic
-            payload_str = msg.payload.decode()
-            print(f"RGB comando recibido en {topic}: {payload_str}")
-            
-            try:
-                data = json.loads(payload_str)
-            except json.JSONDecodeError as e:
-                print(f"Error parseando JSON: {e}")
-                data = {"color": payload_str.strip()}
+            data = codec.loads_or(msg.payload, "color")
+            print(f"RGB comando recibido en {topic}: {data}")
+            if data is None:
+                return
             
             if "color" in data:
+                command = "rgb.color"
                 self.set_color_from_payload(data)
             elif "rgb" in data:
+                command = "rgb.rgb"
                 self.set_rgb(data["rgb"])
             elif "hex" in data:
+                command = "rgb.hex"
                 self.set_hex_color(data["hex"])
+            else:
+                rpc.complete(client, data, "rgb", started, error="unknown command")
+                return
+            rpc.complete(client, data, command, started, rgb=self.current_color)
                 
         except Exception as e:
             print(f"Error procesando mensaje RGB: {e}")
+            rpc.complete(client, data, "rgb", started, error=e)
 
+    @vigilante.watched
     def set_rgb(self, rgb_values):
         """Establecer color RGB con valores 0-255"""
         if not self.rgb_pwm:
             print(f"Simulando RGB: R={rgb_values.get('r', 0)}, G={rgb_values.get('g', 0)}, B={rgb_values.get('b', 0)}")
-            self.current_color = {"red": rgb_values.get('r', 0), "green": rgb_values.get('g', 0), "blue": rgb_values.get('b', 0)}
-            self.publish_status()
+            color = {"red": rgb_values.get('r', 0), "green": rgb_values.get('g', 0), "blue": rgb_values.get('b', 0)}
+            if color != self.current_color:
+                self.current_color = color
+                self._save_color()
+                self.publish_status()
             return
             
         try:
@@ -114,23 +127,48 @@ class RGBLEDService:
             self.rgb_pwm['green'].ChangeDutyCycle(g_duty)
             self.rgb_pwm['blue'].ChangeDutyCycle(b_duty)
             
-            self.current_color = {"red": r, "green": g, "blue": b}
+            color = {"red": r, "green": g, "blue": b}
+            if color == self.current_color:
+                return
+            self.current_color = color
+            self._save_color()
             self.publish_status()
             print(f"Color RGB establecido: R={r}, G={g}, B={b}")
         except Exception as e:
             print(f"Error estableciendo RGB: {e}")
+            raise
+
+    def _save_color(self):
+        c = self.current_color
+        try:
+            estadoPersistente.save("rgb", (int(c["red"]) << 16) | (int(c["green"]) << 8) | int(c["blue"]))
+        except (TypeError, ValueError):
+            pass
+
+    def _restore(self):
+        # Volver al ultimo color comandado antes de conectarse al broker
+        if not estadoPersistente.restoring("rgb"):
+            return
+        value = estadoPersistente.load("rgb")
+        if value:
+            try:
+                self.set_rgb({"r": (value >> 16) & 0xFF, "g": (value >> 8) & 0xFF, "b": value & 0xFF})
+            except Exception:
+                pass
 
     def set_hex_color(self, hex_color):
         """Establecer color desde codigo hexadecimal"""
-        hex_color = hex_color.lstrip('#')
-        if len(hex_color) == 6:
-            try:
-                r = int(hex_color[0:2], 16)
-                g = int(hex_color[2:4], 16)
-                b = int(hex_color[4:6], 16)
-                self.set_rgb({"r": r, "g": g, "b": b})
-            except ValueError as e:
-                print(f"Error convirtiendo hex {hex_color}: {e}")
+        hex_color = str(hex_color).lstrip('#')
+        try:
+            if len(hex_color) != 6:
+                raise ValueError("se esperan 6 digitos")
+            r = int(hex_color[0:2], 16)
+            g = int(hex_color[2:4], 16)
+            b = int(hex_color[4:6], 16)
+        except ValueError as e:
+            print(f"Error convirtiendo hex {hex_color}: {e}")
+            raise ValueError(f"invalid hex color {hex_color}")
+        self.set_rgb({"r": r, "g": g, "b": b})
     def set_color_from_payload(self, payload):
         """Establecer color desde payload con diferentes formatos"""
         color = payload["color"].lower().strip()
@@ -152,37 +190,35 @@ class RGBLEDService:
             self.set_hex_color(color)
         else:
             print(f"Color no reconocido: {color}")
+            raise ValueError(f"unknown color {color}")
 
     def publish_status(self):
         """Publicar estado actual del LED"""
+        estadoPlaca.update("rgb", f"#{self.current_color['red']:02x}{self.current_color['green']:02x}{self.current_color['blue']:02x}")
         if not self.client:
             return
             
-        status_data = {
-            "type": "light",
-            "device": "rgb_led",
+        payload = self.status_template.encode({
             "status": "on" if any(self.current_color.values()) else "off",
             "color": f"#{self.current_color['red']:02x}{self.current_color['green']:02x}{self.current_color['blue']:02x}",
             "rgb": self.current_color,
-            "pin_red": f"GPIO{self.red_pin}",
-            "pin_green": f"GPIO{self.green_pin}",
-            "pin_blue": f"GPIO{self.blue_pin}",
             "timestamp": time.time()
-        }
+        })
         
         try:
-            self.client.publish("/ilumination", json.dumps(status_data))
+            self.client.publish(topicos.topic("/ilumination/rgb/status"), payload, qos=1, retain=True)
         except Exception as e:
             print(f"Error publicando estado RGB: {e}")
 
     def loop(self):
         """Loop principal del servicio RGB"""
         self._setup_gpio()
+        self._restore()
         self._setup_mqtt()
+        self.publish_status()
         
         try:
-            while not self._stop.is_set():
-                time.sleep(1)
+            self._stop.wait()
         finally:
             self.cleanup()
 
@@ -216,12 +252,8 @@ class RGBLEDService:
             except:
                 pass
         
-        if self.client:
-            try:
-                self.client.loop_stop()
-                self.client.disconnect()
-            except:
-                pass
+        if self.conn:
+            self.conn.stop()
 def main():
     import argparse
     
@@ -237,8 +269,7 @@ def main():
     try:
         service.start()
         print("RGB LED service iniciado. Presiona Ctrl+C para detener...")
-        while True:
-            time.sleep(1)
+        service._stop.wait()
     except KeyboardInterrupt:
         print("Deteniendo RGB LED service...")
     finally:
@@ -1,6 +1,5 @@
 import os
 import time
-import json
 import threading
 
 try:
@@ -8,7 +7,13 @@ try:
 except Exception:
     GPIO = None
 
-import paho.mqtt.client as mqtt
+import codec
+import estadoPlaca
+import estadoPersistente
+import rpc
+import topicos
+import vigilante
+from conexionMqtt import MqttConnection, COMMAND_QOS
 
 class RoomLEDService:
     def __init__(self, room_configs=None):
@@ -22,9 +27,15 @@ class RoomLEDService:
         self.mqtt_port = int(os.environ.get("MQTT_PORT", "8883"))
         self.mqtt_user = os.environ.get("MQTT_USERNAME", "isaac")
         self.mqtt_pass = os.environ.get("MQTT_PASSWORD", "ArquiGrupo4")
-        self.mqtt_client_id = os.environ.get("MQTT_CLIENT_ID", "raspberry-pi-room-leds")
+        self.mqtt_client_id = topicos.client_id("raspberry-pi-room-leds")
+        
+        self.status_templates = {
+            room: codec.StatusTemplate({"type": "light", "device": "room_led", "room": room, "pin": config["pin"]})
+            for room, config in self.room_configs.items()
+        }
         
         self.client = None
+        self.conn = None
         self._stop = threading.Event()
         self._thread = None
         
@@ -45,36 +56,28 @@ class RoomLEDService:
             print(f"Error configurando GPIO para LEDs: {e}")
 
     def _setup_mqtt(self):
-        self.client = mqtt.Client(client_id=self.mqtt_client_id)
-        self.client.username_pw_set(self.mqtt_user, self.mqtt_pass)
-        self.client.tls_set()
-        
-        self.client.on_message = self._on_message
-        self.client.on_connect = self._on_connect
-        
-        try:
-            self.client.connect(self.mqtt_host, self.mqtt_port, 60)
-            self.client.loop_start()
-        except Exception as e:
-            print(f"Error conectando LEDs a MQTT: {e}")
-
-    def _on_connect(self, client, userdata, flags, rc):
-        print(f"LEDs por habitacion conectados a MQTT con codigo: {rc}")
-        client.subscribe("/ilumination")
-        client.subscribe("/light")
-        client.subscribe("/actuators/light")
-        client.subscribe("/room/+/light")  # Para comandos especificos por habitacion
+        topics = [
+            "/ilumination",
+            "/light",
+            "/actuators/light",
+            "/room/+/light",  # Para comandos especificos por habitacion
+        ]
+        self.conn = MqttConnection(self.mqtt_client_id, self.mqtt_host, self.mqtt_port,
+                                   self.mqtt_user, self.mqtt_pass,
+                                   subscriptions=topicos.subscriptions(topics, COMMAND_QOS),
+                                   on_message=self._on_message)
+        self.client = self.conn.client
+        self.conn.start()
     def _on_message(self, client, userdata, msg):
+        started = time.perf_counter()
+        data = None
         try:
-            topic = msg.topic
-            payload_str = msg.payload.decode()
-            print(f"LED comando recibido en {topic}: {payload_str}")
-            
-            try:
-                data = json.loads(payload_str)
-            except json.JSONDecodeError:
-                # Si no es JSON, tratar como comando simple
-                data = {"state": payload_str.strip()}
+            topic = topicos.local(msg.topic)
+            # Si no es JSON, tratar como comando simple
+            data = codec.loads_or(msg.payload)
+            print(f"LED comando recibido en {topic}: {data}")
+            if data is None:
+                return
             
             # Procesar comando
             room = None
@@ -93,22 +96,37 @@ class RoomLEDService:
             if "state" in data:
                 state = data["state"].lower().strip()
             
+            if state in ["on", "encendido", "1", "true"]:
+                action = "on"
+            elif state in ["off", "apagado", "0", "false"]:
+                action = "off"
+            else:
+                rpc.complete(client, data, "room", started, error="unknown state")
+                return
+            
             # Si no se especifica habitacion, aplicar a todas
             if room is None:
-                if state in ["on", "encendido", "1", "true"]:
+                if action == "on":
                     self.turn_all_on()
-                elif state in ["off", "apagado", "0", "false"]:
+                else:
                     self.turn_all_off()
+                rpc.complete(client, data, "rooms." + action, started, rooms=self.get_status())
+            elif room not in self.room_configs:
+                rpc.complete(client, data, "room", started, error=f"unknown room {room}")
             else:
                 # Control especifico por habitacion
-                if state in ["on", "encendido", "1", "true"]:
+                if action == "on":
                     self.turn_on_room(room)
-                elif state in ["off", "apagado", "0", "false"]:
+                else:
                     self.turn_off_room(room)
+                rpc.complete(client, data, "room." + action, started, room=room,
+                             state="on" if self.room_configs[room]["state"] else "off")
                 
         except Exception as e:
             print(f"Error procesando mensaje LED: {e}")
+            rpc.complete(client, data, "room", started, error=e)
 
+    @vigilante.watched
     def turn_on_room(self, room):
         """Encender LED de una habitacion especifica"""
         room = room.lower()
@@ -119,19 +137,26 @@ class RoomLEDService:
         config = self.room_configs[room]
         pin = config["pin"]
         
+        changed = not config["state"]
         if GPIO is None:
             print(f"Simulando: LED {room} ENCENDIDO")
             config["state"] = True
-            self.publish_status(room)
+            estadoPersistente.save("room." + room, 1)
+            if changed:
+                self.publish_status(room)
             return
             
         try:
             GPIO.output(pin, GPIO.HIGH)
             config["state"] = True
-            self.publish_status(room)
+            estadoPersistente.save("room." + room, 1)
+            if changed:
+                self.publish_status(room)
             print(f"? LED {room} ENCENDIDO (GPIO {pin})")
         except Exception as e:
             print(f"Error encendiendo LED {room}: {e}")
+            raise
+    @vigilante.watched
     def turn_off_room(self, room):
         """Apagar LED de una habitacion especifica"""
         room = room.lower()
@@ -142,19 +167,25 @@ class RoomLEDService:
         config = self.room_configs[room]
         pin = config["pin"]
         
+        changed = config["state"]
         if GPIO is None:
             print(f"Simulando: LED {room} APAGADO")
             config["state"] = False
-            self.publish_status(room)
+            estadoPersistente.save("room." + room, 0)
+            if changed:
+                self.publish_status(room)
             return
             
         try:
             GPIO.output(pin, GPIO.LOW)
             config["state"] = False
-            self.publish_status(room)
+            estadoPersistente.save("room." + room, 0)
+            if changed:
+                self.publish_status(room)
             print(f"? LED {room} APAGADO (GPIO {pin})")
         except Exception as e:
             print(f"Error apagando LED {room}: {e}")
+            raise
 
     def turn_all_on(self):
         """Encender todos los LEDs"""
@@ -168,26 +199,32 @@ class RoomLEDService:
 
     def publish_status(self, room):
         """Publicar estado actual de un LED"""
+        config = self.room_configs[room]
+        estadoPlaca.update("rooms", config["state"], key=room)
         if not self.client:
             return
             
-        config = self.room_configs[room]
-        status_data = {
-            "type": "light",
-            "device": "room_led",
-            "room": room,
+        payload = self.status_templates[room].encode({
             "status": "on" if config["state"] else "off",
-            "pin": config["pin"],
             "timestamp": time.time()
-        }
+        })
         
         try:
-            # Publicar en tipico general y especifico
-            self.client.publish("/ilumination/status", json.dumps(status_data))
-            self.client.publish(f"/room/{room}/status", json.dumps(status_data))
+            self.client.publish(topicos.topic(f"/room/{room}/status"), payload, qos=1, retain=True)
         except Exception as e:
             print(f"Error publicando estado LED {room}: {e}")
 
+    def _restore(self):
+        # Volver a encender las habitaciones que estaban encendidas antes de conectarse al broker
+        if not estadoPersistente.restoring("rooms"):
+            return
+        for room in self.room_configs:
+            if estadoPersistente.load("room." + room):
+                try:
+                    self.turn_on_room(room)
+                except Exception:
+                    pass
+
     def get_status(self):
         """Obtener estado de todos los LEDs"""
         return {room: config["state"] for room, config in self.room_configs.items()}
@@ -195,11 +232,13 @@ class RoomLEDService:
     def loop(self):
         """Loop principal del servicio LEDs"""
         self._setup_gpio()
+        self._restore()
         self._setup_mqtt()
+        for room in self.room_configs:
+            self.publish_status(room)
         
         try:
-            while not self._stop.is_set():
-                time.sleep(1)
+            self._stop.wait()
         finally:
             self.cleanup()
     def start(self):
@@ -228,12 +267,8 @@ class RoomLEDService:
             except:
                 pass
         
-        if self.client:
-            try:
-                self.client.loop_stop()
-                self.client.disconnect()
-            except:
-                pass
+        if self.conn:
+            self.conn.stop()
 
 def main():
     import argparse
@@ -263,8 +298,7 @@ def main():
         print("\nComandos MQTT:")
         print("  - Habitacion especifica: {\"room\": \"sala\", \"state\": \"on\"}")
         print("  - Todas las luces: {\"state\": \"on\"}")
-        while True:
-            time.sleep(1)
+        service._stop.wait()
     except KeyboardInterrupt:
         print("Deteniendo LEDs service...")
     finally:
@@ -5,6 +5,10 @@ import logging
 import requests
 from datetime import datetime
 
+import estadoPlaca
+import historialSensores
+import planificador
+
 try:
     import RPi.GPIO as GPIO
 except Exception:
@@ -15,14 +19,26 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 class MotionSensorService:
-    def __init__(self, trig_pin=23, echo_pin=24, led_pin=25, distance_threshold=30):
+    def __init__(self, trig_pin=23, echo_pin=24, led_pin=25, distance_threshold=30,
+                 distance_reader=None, poll_interval=0.1, location="entrada", state_key=None):
         """
         Sensor ultrasónico con LED de movimiento - Sin MQTT
+
+        distance_reader() -> cm reemplaza al HC-SR04 (simulación / carga)
+        state_key: clave dentro de la sección "motion" del estado de la placa
+        (None = un solo sensor, "motion" es un booleano)
         """
         self.trig_pin = trig_pin
         self.echo_pin = echo_pin
         self.led_pin = led_pin
         self.distance_threshold = distance_threshold
+        self.distance_reader = distance_reader
+        self.poll_interval = poll_interval
+        self.location = location
+        self.state_key = state_key
+        self.history_channel = "distance"
+        # Registrar en el backend en otro hilo para no frenar la medicion
+        self.async_register = False
         
         # Configuración del backend
         self.backend_url = os.environ.get("BACKEND_URL", "http://localhost:3001")
@@ -64,6 +80,8 @@ class MotionSensorService:
 
     def measure_distance(self):
         """Medir distancia con sensor ultrasónico"""
+        if self.distance_reader is not None:
+            return self.distance_reader()
         if GPIO is None:
             # Simulación: generar distancia aleatoria
             import random
@@ -138,7 +156,7 @@ class MotionSensorService:
                 "value": "motion_detected",
                 "description": "Movimiento detectado por sensor ultrasónico",
                 "status": True,
-                "location": "entrada",
+                "location": self.location,
                 "device": "ultrasonic_sensor",
                 "threshold": self.distance_threshold,
                 "pins": {
@@ -162,6 +180,33 @@ class MotionSensorService:
         except Exception as e:
             logger.error(f"❌ Error enviando datos al backend: {e}")
 
+    def process_distance(self, distance, current_time):
+        """Actualizar historial, LED y estado de movimiento con una medicion"""
+        historialSensores.record(self.history_channel, distance, current_time)
+        
+        # Detectar movimiento (objeto cerca) - TRANSICIÓN DE BAJO A ALTO
+        if distance <= self.distance_threshold:
+            if not self.motion_detected:
+                logger.info(f"🎯 MOVIMIENTO DETECTADO ({self.location}) - Distancia: {distance:.1f}cm")
+                self.motion_detected = True
+                estadoPlaca.update("motion", True, key=self.state_key)
+                self.turn_led_on()
+                
+                # REGISTRAR EN BASE DE DATOS SOLO EN LA TRANSICIÓN
+                if self.async_register:
+                    threading.Thread(target=self.register_motion_detection, daemon=True).start()
+                else:
+                    self.register_motion_detection()
+            
+            self.last_motion_time = current_time
+        
+        # Verificar timeout (sin movimiento por 5 segundos)
+        elif self.motion_detected and (current_time - self.last_motion_time) >= self.motion_timeout:
+            logger.info(f"⏰ Sin movimiento por {self.motion_timeout}s ({self.location}) - Apagando LED")
+            self.motion_detected = False
+            estadoPlaca.update("motion", False, key=self.state_key)
+            self.turn_led_off()
+
     def loop(self):
         """Loop principal del sensor"""
         self._setup_gpio()
@@ -169,37 +214,24 @@ class MotionSensorService:
         logger.info(f"🎯 Iniciando detección de movimiento (umbral: {self.distance_threshold}cm)")
         logger.info(f"🌐 Backend URL: {self.backend_url}")
         
+        # Worker propio: la medicion con busy-wait no ocupa el pool compartido
+        pool = planificador.WorkerPool(1, "motion")
+        task = planificador.every("motion:{}".format(self.location), self.poll_interval,
+                                  self._tick, pool=pool)  # Leer cada 100ms por defecto
         try:
-            while not self._stop.is_set():
-                # Medir distancia
-                distance = self.measure_distance()
-                
-                if distance is not None:
-                    current_time = time.time()
-                    
-                    # Detectar movimiento (objeto cerca) - TRANSICIÓN DE BAJO A ALTO
-                    if distance <= self.distance_threshold:
-                        if not self.motion_detected:
-                            logger.info(f"🎯 MOVIMIENTO DETECTADO - Distancia: {distance:.1f}cm")
-                            self.motion_detected = True
-                            self.turn_led_on()
-                            
-                            # REGISTRAR EN BASE DE DATOS SOLO EN LA TRANSICIÓN
-                            self.register_motion_detection()
-                        
-                        self.last_motion_time = current_time
-                    
-                    # Verificar timeout (sin movimiento por 5 segundos)
-                    elif self.motion_detected and (current_time - self.last_motion_time) >= self.motion_timeout:
-                        logger.info(f"⏰ Sin movimiento por {self.motion_timeout}s - Apagando LED")
-                        self.motion_detected = False
-                        self.turn_led_off()
-                
-                time.sleep(0.1)  # Leer cada 100ms
-                
+            self._stop.wait()
         finally:
+            task.cancel()
+            pool.shutdown()
             self.cleanup()
 
+    def _tick(self):
+        # Medir distancia
+        distance = self.measure_distance()
+        
+        if distance is not None:
+            self.process_distance(distance, time.time())
+
     def start(self):
         """Iniciar servicio"""
         self._stop.clear()
@@ -234,6 +266,188 @@ class MotionSensorService:
             except:
                 pass
 
+def parse_sensors(spec):
+    """"entrada:23:24:25,garaje:5:6:13:50" -> [{name, trig, echo, led, threshold}]"""
+    sensors = []
+    for item in spec.split(","):
+        parts = item.strip().split(":")
+        if len(parts) < 4:
+            continue
+        sensors.append({
+            "name": parts[0],
+            "trig": int(parts[1]),
+            "echo": int(parts[2]),
+            "led": int(parts[3]),
+            "threshold": float(parts[4]) if len(parts) > 4 else 30,
+        })
+    return sensors
+
+
+class UltrasonicArrayService:
+    """Varios HC-SR04 atendidos por un solo hilo.
+
+    Los sensores se disparan de a uno en round-robin desde una tarea del
+    planificador, con al menos `slot` segundos entre disparos: el eco de un
+    sensor (hasta ~23 ms a 4 m) se apaga antes de disparar el siguiente, asi
+    no hay ecos cruzados. Todos los pines ECHO comparten un unico callback de
+    flanco que toma el tiempo del pulso; el worker espera el fin del eco en un
+    Event en lugar de hacer busy-wait. Sin deteccion de flancos se usa
+    measure_distance() del sensor.
+    """
+
+    def __init__(self, sensors=None, slot_ms=None, poll_interval=0.1, distance_reader=None):
+        if sensors is None:
+            sensors = parse_sensors(os.environ.get("ULTRASONIC_SENSORS", "")) or \
+                [{"name": "entrada", "trig": 23, "echo": 24, "led": 25, "threshold": 30}]
+        if slot_ms is None:
+            slot_ms = float(os.environ.get("ULTRASONIC_SLOT_MS", "40"))
+        self.slot = slot_ms / 1000.0
+        self.echo_timeout = min(self.slot, 0.03)
+        self.poll_interval = poll_interval
+        self.sensors = []
+        for cfg in sensors:
+            sensor = MotionSensorService(cfg["trig"], cfg["echo"], cfg["led"], cfg.get("threshold", 30),
+                                         distance_reader=distance_reader, location=cfg["name"],
+                                         state_key=cfg["name"])
+            sensor.history_channel = "distance." + cfg["name"]
+            sensor.async_register = True
+            historialSensores.history.add_channel(sensor.history_channel,
+                                                  historialSensores.DEFAULT_CHANNELS["distance"])
+            self.sensors.append(sensor)
+        self._by_echo = {s.echo_pin: s for s in self.sensors}
+        self.samples = {s.location: 0 for s in self.sensors}
+        self.timeouts = {s.location: 0 for s in self.sensors}
+        self._edges = False
+        self._active = None
+        self._rise = None
+        self._echo_s = None
+        self._echo_done = threading.Event()
+        self._started = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _setup_gpio(self):
+        for s in self.sensors:
+            s._setup_gpio()
+        if GPIO is None:
+            return
+        try:
+            for pin in self._by_echo:
+                GPIO.add_event_detect(pin, GPIO.BOTH, callback=self._on_echo)
+            self._edges = True
+        except Exception as e:
+            logger.warning(f"⚠️ Deteccion de flancos no disponible ({e}), usando busy-wait")
+
+    def _on_echo(self, channel):
+        """Callback compartido por todos los ECHO: solo cuenta el sensor disparado"""
+        now = time.perf_counter()
+        active = self._active
+        if active is None or channel != active.echo_pin:
+            return
+        # El callback corre en el hilo de RPi.GPIO y un eco corto (~1.75 ms a
+        # 30 cm) puede haber terminado antes: leer el pin aca daria LOW en los
+        # dos flancos. El primer flanco tras el disparo es la subida, el
+        # siguiente la bajada.
+        if self._rise is None:
+            self._rise = now
+        elif self._echo_s is None:
+            self._echo_s = now - self._rise
+            self._echo_done.set()
+
+    def measure(self, sensor):
+        if not self._edges or sensor.distance_reader is not None:
+            return sensor.measure_distance()
+        self._rise = None
+        self._echo_s = None
+        self._echo_done.clear()
+        try:
+            if GPIO.input(sensor.echo_pin):
+                # Sigue el eco de un disparo anterior: su bajada pasaria por subida
+                self.timeouts[sensor.location] += 1
+                return None
+            self._active = sensor
+            GPIO.output(sensor.trig_pin, GPIO.HIGH)
+            time.sleep(0.00001)  # 10 microsegundos
+            GPIO.output(sensor.trig_pin, GPIO.LOW)
+            if not self._echo_done.wait(self.echo_timeout):
+                self.timeouts[sensor.location] += 1
+                return None
+        except Exception as e:
+            logger.error(f"❌ Error midiendo distancia ({sensor.location}): {e}")
+            return None
+        finally:
+            self._active = None
+        distance = (self._echo_s * 34300) / 2
+        return distance if distance < 400 else None
+
+    def loop(self):
+        self._setup_gpio()
+        n = len(self.sensors)
+        # Cada sensor se lee cada `cycle` s; los disparos quedan repartidos en el ciclo
+        cycle = max(self.poll_interval, n * self.slot)
+        logger.info(f"🎯 {n} sensores ultrasonicos, ciclo {cycle * 1000:.0f} ms, "
+                    f"{'flancos' if self._edges else 'busy-wait'}")
+        self._started = time.monotonic()
+        self._next = 0
+        # Un disparo por turno, en un solo worker: nunca hay dos sensores midiendo a la vez
+        pool = planificador.WorkerPool(1, "ultrasonic")
+        task = planificador.every("ultrasonic", cycle / n, self._tick, phase=0, pool=pool)
+        try:
+            self._stop.wait()
+        finally:
+            task.cancel()
+            pool.shutdown()
+            self.cleanup()
+
+    def _tick(self):
+        sensor = self.sensors[self._next]
+        self._next = (self._next + 1) % len(self.sensors)
+        distance = self.measure(sensor)
+        self.samples[sensor.location] += 1
+        if distance is not None:
+            sensor.process_distance(distance, time.time())
+
+    def stats(self):
+        elapsed = time.monotonic() - self._started if self._started else 0.0
+        sensors = {}
+        for s in self.sensors:
+            count = self.samples[s.location]
+            sensors[s.location] = {
+                "samples": count,
+                "hz": round(count / elapsed, 2) if elapsed else 0.0,
+                "timeouts": self.timeouts[s.location],
+                "motion": s.motion_detected,
+            }
+        total = sum(self.samples.values())
+        return {
+            "sensors": sensors,
+            "aggregate_hz": round(total / elapsed, 2) if elapsed else 0.0,
+            "edge_timing": self._edges,
+        }
+
+    def start(self):
+        self._stop.clear()
+        estadoPlaca.register_metrics("ultrasonic", self.stats)
+        self._thread = threading.Thread(target=self.loop, daemon=True)
+        self._thread.start()
+        logger.info("🚀 Arreglo de sensores ultrasonicos iniciado")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def cleanup(self):
+        if GPIO and self._edges:
+            for pin in self._by_echo:
+                try:
+                    GPIO.remove_event_detect(pin)
+                except Exception:
+                    pass
+        for s in self.sensors:
+            s.cleanup()
+
+
 def main():
     import argparse
     
@@ -254,8 +468,7 @@ def main():
         logger.info("⏰ Timeout sin movimiento: 5 segundos")
         logger.info("📝 Registros se guardan en transición bajo->alto")
         
-        while True:
-            time.sleep(1)
+        service._stop.wait()
             
     except KeyboardInterrupt:
         logger.info("👋 Saliendo...")
@@ -1,6 +1,5 @@
 import os
 import time
-import json
 import threading
 import logging
 
@@ -9,7 +8,13 @@ try:
 except Exception:
     GPIO = None
 
-import paho.mqtt.client as mqtt
+import codec
+import estadoPlaca
+import planificador
+import rpc
+import topicos
+import vigilante
+from conexionMqtt import MqttConnection, COMMAND_QOS
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -28,7 +33,7 @@ class ServoService:
         self.mqtt_port = int(os.environ.get("MQTT_PORT", "8883"))
         self.mqtt_user = os.environ.get("MQTT_USERNAME", "isaac")
         self.mqtt_pass = os.environ.get("MQTT_PASSWORD", "ArquiGrupo4")
-        self.mqtt_client_id = os.environ.get("MQTT_CLIENT_ID", "raspberry-servo")
+        self.mqtt_client_id = topicos.client_id("raspberry-servo")
         
         # Estado del servo
         self.is_open = False
@@ -37,6 +42,7 @@ class ServoService:
         
         # Control de hilos
         self.client = None
+        self.conn = None
         self._stop = threading.Event()
         self._thread = None
         self.pwm = None
@@ -66,56 +72,44 @@ class ServoService:
 
     def _setup_mqtt(self):
         """Configurar cliente MQTT"""
-        try:
-            self.client = mqtt.Client(client_id=self.mqtt_client_id)
-            self.client.username_pw_set(self.mqtt_user, self.mqtt_pass)
-            self.client.tls_set()
-            
-            self.client.on_message = self._on_message
-            self.client.on_connect = self._on_connect
-            
-            logger.info("?? Conectando a MQTT...")
-            self.client.connect(self.mqtt_host, self.mqtt_port, 60)
-            self.client.loop_start()
-            
-        except Exception as e:
-            logger.error(f"? Error configurando MQTT: {e}")
-
-    def _on_connect(self, client, userdata, flags, rc):
-
-        if rc == 0:
-            logger.info("? Servo conectado a MQTT")
-        else:
-            logger.error(f"? Error conectando a MQTT - codigo: {rc}")
-            
         # SOLO suscribirse a /door
-        client.subscribe("/door")
-        logger.info(f"?? Suscrito a: /door")
+        self.conn = MqttConnection(self.mqtt_client_id, self.mqtt_host, self.mqtt_port,
+                                   self.mqtt_user, self.mqtt_pass,
+                                   subscriptions=topicos.subscriptions(["/door"], COMMAND_QOS),
+                                   on_message=self._on_message)
+        self.client = self.conn.client
+        logger.info("?? Conectando a MQTT...")
+        self.conn.start()
+
     def _on_message(self, client, userdata, msg):
         """Procesar mensajes MQTT - SOLO /door"""
+        started = time.perf_counter()
+        data = None
         try:
-            topic = msg.topic
-            payload_str = msg.payload.decode()
-            logger.info(f"?? Comando recibido en {topic}: {payload_str}")
+            topic = topicos.local(msg.topic)
+            logger.info("?? Comando recibido en %s: %s", topic, msg.payload)
             
             # SOLO procesar si es /door
             if topic != "/door":
                 return
                 
             try:
-                data = json.loads(payload_str)
-            except json.JSONDecodeError:
+                data = codec.loads(msg.payload)
+            except ValueError:
                 logger.warning("?? Payload no es JSON valido")
                 return
             
             # SOLO procesar {"action": "open"}
             if data.get("action") == "open":
                 self.open_door()
+                rpc.complete(client, data, "door.open", started, angle=self.current_angle)
             else:
                 logger.info("?? Comando ignorado - solo se acepta {'action': 'open'}")
+                rpc.complete(client, data, "door", started, error="unknown action")
                 
         except Exception as e:
             logger.error(f"? Error procesando mensaje: {e}")
+            rpc.complete(client, data, "door", started, error=e)
 
     def _angle_to_duty_cycle(self, angle):
         """Convertir angulo a duty cycle"""
@@ -123,6 +117,7 @@ class ServoService:
         duty_cycle = 2.5 + (angle / 180.0) * 10.0
         return duty_cycle
 
+    @vigilante.watched
     def _move_to_angle(self, angle):
         """Mover servo a un angulo especifico"""
         if not self.pwm:
@@ -151,14 +146,14 @@ class ServoService:
         logger.info("?? ABRIENDO puerta...")
         self._move_to_angle(self.open_angle)
         self.is_open = True
+        estadoPlaca.update("door", True)
         
         # Cancelar timer anterior si existe
         if self.close_timer:
             self.close_timer.cancel()
         
         # Programar cierre automatico en 5 segundos
-        self.close_timer = threading.Timer(self.auto_close_delay, self._auto_close)
-        self.close_timer.start()
+        self.close_timer = planificador.after("door.autoclose", self.auto_close_delay, self._auto_close)
         
         logger.info(f"? Cierre automatico en {self.auto_close_delay}s")
     def _auto_close(self):
@@ -166,6 +161,7 @@ class ServoService:
         logger.info("?? Cerrando puerta automaticamente...")
         self._move_to_angle(self.close_angle)
         self.is_open = False
+        estadoPlaca.update("door", False)
 
     def loop(self):
         """Loop principal del servicio"""
@@ -175,8 +171,7 @@ class ServoService:
         logger.info("?? Servo listo - esperando comando {'action': 'open'} en /door")
         
         try:
-            while not self._stop.is_set():
-                time.sleep(1)
+            self._stop.wait()
         finally:
             self.cleanup()
 
@@ -218,12 +213,8 @@ class ServoService:
             except:
                 pass
         
-        if self.client:
-            try:
-                self.client.loop_stop()
-                self.client.disconnect()
-            except:
-                pass
+        if self.conn:
+            self.conn.stop()
 
 def main():
     service = ServoService()
@@ -232,8 +223,7 @@ def main():
         service.start()
         logger.info("?? Servo listo para comando: {'action': 'open'} en topico /door")
         
-        while True:
-            time.sleep(1)
+        service._stop.wait()
             
     except KeyboardInterrupt:
         logger.info("?? Saliendo...")
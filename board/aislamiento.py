@@ -0,0 +1,288 @@
+"""Servicios en procesos aparte, supervisados desde main.py.
+
+Los caminos sensibles al tiempo (eco del HC-SR04, pulsos del LCD) comparten
+el GIL con TLS, JSON y logging del resto de los servicios. Un servicio
+aislado corre en su propio proceso (multiprocessing, contexto spawn), con
+afinidad de CPU y prioridad SCHED_FIFO opcionales.
+
+El worker no tiene estado propio de la placa: sus llamadas a
+estadoPlaca.update, historialSensores.record y telemetria (modo batch) viajan
+por un Pipe al proceso principal, que es el que publica /board/state,
+/history y /telemetry/batch. Cada tanto el worker manda tambien sus metricas
+(callbacks, scheduler, comandos...), que salen en /board/metrics -> "workers".
+
+El supervisor espera en los pipes (sin polling) y reinicia un worker que
+termina solo, con backoff exponencial.
+
+  python main.py --isolate motion,lcd --cpu motion=3 --rt motion=50
+"""
+import os
+import time
+import signal
+import logging
+import threading
+import multiprocessing
+from multiprocessing.connection import wait as wait_connections
+
+import estadoPlaca
+import historialSensores
+import telemetria
+
+logger = logging.getLogger(__name__)
+
+_ctx = multiprocessing.get_context("spawn")
+
+
+def parse_assignments(values):
+    """["motion=3", "lcd=2,3"] -> {"motion": "3", "lcd": "2,3"}"""
+    out = {}
+    for item in values or []:
+        for part in item.split(";"):
+            if "=" in part:
+                name, value = part.split("=", 1)
+                out[name.strip()] = value.strip()
+    return out
+
+
+def parse_cpus(value):
+    cpus = set()
+    for part in str(value).split(","):
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            cpus.update(range(int(lo), int(hi) + 1))
+        elif part.strip():
+            cpus.add(int(part))
+    return cpus
+
+
+def apply_scheduling(name, cpus=None, rt_priority=None):
+    """Afinidad y SCHED_FIFO para el proceso actual; sin permisos solo avisa"""
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except (AttributeError, OSError) as e:
+            logger.warning("%s: no se pudo fijar CPU %s (%s)", name, sorted(cpus), e)
+    if rt_priority:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(int(rt_priority)))
+        except (AttributeError, OSError) as e:
+            logger.warning("%s: sin SCHED_FIFO %s (%s); requiere CAP_SYS_NICE", name, rt_priority, e)
+
+
+class _Channel:
+    """Lado worker del Pipe: envios serializados entre hilos"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def send(self, msg):
+        with self.lock:
+            try:
+                self.conn.send(msg)
+            except (OSError, EOFError):
+                pass
+
+
+class _RemoteBoardState:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def update(self, section, value, key=None):
+        self.channel.send(("state", section, value, key))
+
+
+class _RemoteHistory:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def add_channel(self, name, capacity, rollups=None):
+        self.channel.send(("channel", name, capacity))
+
+    def record(self, channel, value, ts=None):
+        if value is not None:
+            self.channel.send(("record", channel, float(value), time.time() if ts is None else ts))
+
+
+class _RemoteBatcher:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def add(self, topic, data, ts=None):
+        self.channel.send(("telemetry", topic, data, time.time() if ts is None else ts))
+
+
+def _worker_main(name, factory, conn, cpus, rt_priority, metrics_interval):
+    apply_scheduling(name, cpus, rt_priority)
+    channel = _Channel(conn)
+    # Estado, historial y telemetria de la placa viven en el proceso principal
+    estadoPlaca.board_state = _RemoteBoardState(channel)
+    historialSensores.history = _RemoteHistory(channel)
+    if telemetria.MODE in ("batch", "both"):
+        telemetria._batcher = _RemoteBatcher(channel)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    def listen():
+        # "stop" del supervisor o pipe cerrado (murio el proceso principal)
+        try:
+            while conn.recv() != "stop":
+                pass
+        except (EOFError, OSError):
+            pass
+        stop.set()
+
+    threading.Thread(target=listen, daemon=True).start()
+    svc = factory()
+    svc.start()
+    channel.send(("ready", os.getpid()))
+    try:
+        while not stop.wait(metrics_interval):
+            channel.send(("metrics", estadoPlaca.collect_metrics()))
+    finally:
+        svc.stop()
+
+
+class Worker:
+    def __init__(self, name, factory, cpus=None, rt_priority=None):
+        self.name = name
+        self.factory = factory
+        self.cpus = cpus
+        self.rt_priority = rt_priority
+        self.process = None
+        self.conn = None
+        self.pid = None
+        self.started_at = None
+        self.restarts = 0
+        self.backoff = 1.0
+        self.restart_at = None
+        self.last_exit = None
+        self.metrics = None
+
+
+class Supervisor:
+    def __init__(self, metrics_interval=None, backoff_max=30.0, healthy_after=60.0):
+        self.metrics_interval = metrics_interval or float(os.environ.get("WORKER_METRICS_INTERVAL", "30"))
+        self.backoff_max = backoff_max
+        self.healthy_after = healthy_after
+        self.workers = {}
+        self._stop = threading.Event()
+        self._thread = None
+        # Para despertar al supervisor cuando cambia la lista de pipes
+        self._wake_r, self._wake_w = _ctx.Pipe(duplex=False)
+
+    def add(self, name, factory, cpus=None, rt_priority=None):
+        self.workers[name] = Worker(name, factory, cpus, rt_priority)
+
+    def _spawn(self, w):
+        parent, child = _ctx.Pipe()
+        w.process = _ctx.Process(target=_worker_main, name="board-" + w.name, daemon=True,
+                                 args=(w.name, w.factory, child, w.cpus, w.rt_priority, self.metrics_interval))
+        w.process.start()
+        child.close()
+        w.conn = parent
+        w.pid = w.process.pid
+        w.started_at = time.monotonic()
+        w.restart_at = None
+        logger.info("Worker %s iniciado (pid %s, cpu %s, rt %s)", w.name, w.pid,
+                    sorted(w.cpus) if w.cpus else "-", w.rt_priority or "-")
+
+    def _handle(self, w, msg):
+        kind = msg[0]
+        if kind == "state":
+            estadoPlaca.board_state.update(msg[1], msg[2], msg[3])
+        elif kind == "record":
+            historialSensores.history.record(msg[1], msg[2], msg[3])
+        elif kind == "channel":
+            historialSensores.history.add_channel(msg[1], msg[2])
+        elif kind == "telemetry":
+            batcher = telemetria._batcher
+            if batcher is not None:
+                batcher.add(msg[1], msg[2], msg[3])
+        elif kind == "metrics":
+            w.metrics = msg[1]
+        elif kind == "ready":
+            w.pid = msg[1]
+
+    def _reap(self, w):
+        try:
+            w.conn.close()
+        except Exception:
+            pass
+        w.conn = None
+        w.process.join(timeout=1)
+        w.last_exit = w.process.exitcode
+        if self._stop.is_set():
+            return
+        # Backoff: reinicio rapido si venia sano, mas lento si se cae en loop
+        if time.monotonic() - w.started_at >= self.healthy_after:
+            w.backoff = 1.0
+        w.restart_at = time.monotonic() + w.backoff
+        logger.error("Worker %s termino (exit %s), reinicio en %.0fs", w.name, w.last_exit, w.backoff)
+        w.backoff = min(w.backoff * 2, self.backoff_max)
+
+    def loop(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for w in self.workers.values():
+                if w.conn is None and w.restart_at is not None and now >= w.restart_at:
+                    w.restarts += 1
+                    self._spawn(w)
+            conns = {w.conn: w for w in self.workers.values() if w.conn is not None}
+            pending = [w.restart_at for w in self.workers.values() if w.conn is None and w.restart_at is not None]
+            timeout = max(0.0, min(pending) - now) if pending else None
+            for conn in wait_connections(list(conns) + [self._wake_r], timeout):
+                if conn is self._wake_r:
+                    conn.recv()
+                    continue
+                w = conns[conn]
+                try:
+                    while conn.poll():
+                        self._handle(w, conn.recv())
+                except (EOFError, OSError):
+                    self._reap(w)
+
+    def start(self):
+        self._stop.clear()
+        estadoPlaca.register_metrics("workers", self.stats)
+        for w in self.workers.values():
+            self._spawn(w)
+        self._thread = threading.Thread(target=self.loop, daemon=True, name="supervisor")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for w in self.workers.values():
+            if w.conn is not None:
+                try:
+                    w.conn.send("stop")
+                except (OSError, EOFError):
+                    pass
+        self._wake_w.send(None)
+        deadline = time.monotonic() + 3
+        for w in self.workers.values():
+            if w.process is None:
+                continue
+            w.process.join(timeout=max(0.0, deadline - time.monotonic()))
+            if w.process.is_alive():
+                w.process.terminate()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def stats(self):
+        out = {}
+        for name, w in self.workers.items():
+            alive = w.process is not None and w.process.is_alive()
+            out[name] = {
+                "pid": w.pid,
+                "alive": alive,
+                "restarts": w.restarts,
+                "last_exit": w.last_exit,
+                "uptime_s": round(time.monotonic() - w.started_at, 1) if alive and w.started_at else None,
+                "cpus": sorted(w.cpus) if w.cpus else None,
+                "rt_priority": w.rt_priority,
+                "metrics": w.metrics,
+            }
+        return out
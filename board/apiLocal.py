@@ -0,0 +1,466 @@
+"""API HTTP + WebSocket en la LAN, servida por la placa.
+
+Un cliente en la misma red controla los actuadores sin pasar por el backend
+ni por el broker en la nube: los comandos llaman directo a los metodos de los
+servicios de main.py y la casa sigue respondiendo sin internet.
+
+  GET  /api/state          foto de estadoPlaca
+  GET  /api/rooms          RoomLEDService.get_status()
+  GET  /api/metrics        mismas metricas que /board/metrics
+  POST /api/<dispositivo>  fan, pump, rooms, rgb, door; mismo JSON que por MQTT
+  GET  /api/ws             WebSocket: empuja {"type": "state"} en cada cambio y
+                           acepta {"device": "fan", "state": "on", "id": 1}
+
+LOCAL_API_HOST / LOCAL_API_PORT (8080). Sin LOCAL_API_TOKEN la API escucha
+solo en 127.0.0.1; con token escucha en la LAN (0.0.0.0 por defecto) y exige
+"Authorization: Bearer <token>" o ?token=<token> (el navegador no puede poner
+cabeceras en un WebSocket).
+
+Un navegador solo llega desde los origenes de LOCAL_API_ORIGINS (lista
+separada por comas, p.ej. el dashboard http://192.168.1.10:3000): CORS y el
+Origin de los POST y del WebSocket se validan contra esa lista, y los POST deben ser
+application/json para que una pagina cualquiera no pueda mandar comandos con
+un formulario. La latencia de cada comando queda en /board/metrics ->
+"commands" con prefijo "lan.".
+"""
+import os
+import hmac
+import time
+import base64
+import socket
+import struct
+import hashlib
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import codec
+import estadoPlaca
+import rpc
+
+logger = logging.getLogger(__name__)
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONT, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+MAX_MESSAGE = 64 * 1024
+PING_INTERVAL = 30.0
+SEND_TIMEOUT = 2
+
+LOOPBACK = ("127.0.0.1", "::1", "localhost")
+
+ON = ("on", "encendido", "encender", "activar", "1", "true")
+OFF = ("off", "apagado", "apagar", "desactivar", "0", "false")
+
+
+def _switch(data):
+    value = data.get("state", data.get("command"))
+    value = str(value).lower().strip() if value is not None else None
+    if value in ON:
+        return "on"
+    if value in OFF:
+        return "off"
+    raise ValueError("unknown state")
+
+
+def _fan(svc, data):
+    action = _switch(data)
+    svc.turn_on() if action == "on" else svc.turn_off()
+    return action, {"state": "on" if svc.fan_state else "off"}
+
+
+def _pump(svc, data):
+    action = _switch(data)
+    svc.turn_on() if action == "on" else svc.turn_off()
+    return action, {"state": "on" if svc.pump_state else "off"}
+
+
+def _rooms(svc, data):
+    action = _switch(data)
+    room = data.get("room")
+    if room is None:
+        svc.turn_all_on() if action == "on" else svc.turn_all_off()
+        return action, {"rooms": svc.get_status()}
+    room = str(room).lower()
+    if room not in svc.room_configs:
+        raise ValueError("unknown room {}".format(room))
+    svc.turn_on_room(room) if action == "on" else svc.turn_off_room(room)
+    return action, {"room": room, "state": "on" if svc.room_configs[room]["state"] else "off"}
+
+
+def _rgb(svc, data):
+    if "color" in data:
+        svc.set_color_from_payload(data)
+        action = "color"
+    elif "rgb" in data:
+        svc.set_rgb(data["rgb"])
+        action = "rgb"
+    elif "hex" in data:
+        svc.set_hex_color(data["hex"])
+        action = "hex"
+    else:
+        raise ValueError("unknown command")
+    return action, {"rgb": svc.current_color}
+
+
+def _door(svc, data):
+    if data.get("action") != "open":
+        raise ValueError("unknown action")
+    svc.open_door()
+    return "open", {"angle": svc.current_angle}
+
+
+# Dispositivo -> (servicio de main.py, handler)
+DEVICES = {
+    "fan": ("fan", _fan),
+    "pump": ("pump", _pump),
+    "rooms": ("rooms", _rooms),
+    "rgb": ("rgb", _rgb),
+    "door": ("servo", _door),
+}
+
+
+def _accept_key(key):
+    return base64.b64encode(hashlib.sha1(key.strip().encode() + WS_GUID).digest()).decode()
+
+
+def encode_frame(payload, opcode=OP_TEXT):
+    """Trama sin mascara (servidor -> cliente), siempre FIN"""
+    n = len(payload)
+    if n < 126:
+        header = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return header + payload
+
+
+def _unmask(payload, mask):
+    if not payload:
+        return payload
+    n = len(payload)
+    key = (mask * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(n, "big")
+
+
+def read_frame(rfile):
+    """(fin, opcode, payload) o None si el cliente cerro la conexion"""
+    head = rfile.read(2)
+    if len(head) < 2:
+        return None
+    b0, b1 = head
+    length = b1 & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", rfile.read(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", rfile.read(8))[0]
+    if length > MAX_MESSAGE:
+        raise ValueError("frame too large")
+    mask = rfile.read(4) if b1 & 0x80 else None
+    payload = rfile.read(length)
+    if len(payload) < length:
+        return None
+    if mask:
+        payload = _unmask(payload, mask)
+    return bool(b0 & 0x80), b0 & 0x0F, payload
+
+
+class _WsClient:
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, data):
+        with self.lock:
+            if self.closed:
+                return False
+            try:
+                self.sock.sendall(data)
+                return True
+            except OSError:
+                self._close()
+                return False
+
+    def _close(self):
+        self.closed = True
+        try:
+            # Desbloquea al hilo que lee del socket
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server_version = "board-api"
+
+    def log_message(self, fmt, *args):
+        logger.debug("%s - " + fmt, self.address_string(), *args)
+
+    def _cors(self):
+        origin = self.headers.get("Origin")
+        if origin and origin.rstrip("/") in self.server.api.origins:
+            self.send_header("Access-Control-Allow-Origin", origin)
+            self.send_header("Vary", "Origin")
+
+    def _origin_allowed(self):
+        """Sin Origin (cliente que no es navegador) o uno de LOCAL_API_ORIGINS; no se
+        compara con Host para que una pagina con DNS rebinding no pase como propia"""
+        origin = self.headers.get("Origin")
+        return not origin or origin.rstrip("/") in self.server.api.origins
+
+    def _send_json(self, status, obj):
+        body = codec.dumps(obj)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self._cors()
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self, query):
+        token = self.server.api.token
+        if not token:
+            return True
+        # Comparacion en tiempo constante: no filtrar el token por lo que tarda la respuesta
+        expected = token.encode()
+        header = self.headers.get("Authorization", "").encode()
+        supplied = (query.get("token", [None])[0] or "").encode()
+        return hmac.compare_digest(header, b"Bearer " + expected) or hmac.compare_digest(supplied, expected)
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self._cors()
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Authorization, Content-Type")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if not self._authorized(parse_qs(url.query)):
+            self._send_json(401, {"error": "unauthorized"})
+            return
+        api = self.server.api
+        if url.path == "/api/ws":
+            self._websocket()
+        elif url.path == "/api/state":
+            self._send_json(200, estadoPlaca.board_state.snapshot())
+        elif url.path == "/api/metrics":
+            self._send_json(200, estadoPlaca.collect_metrics())
+        elif url.path == "/api/rooms" and "rooms" in api.services:
+            self._send_json(200, api.services["rooms"].get_status())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        error = None
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if not self._authorized(parse_qs(url.query)):
+            error = (401, "unauthorized")
+        elif not url.path.startswith("/api/"):
+            error = (404, "not found")
+        elif not self._origin_allowed():
+            error = (403, "origin not allowed")
+        elif self.headers.get("Content-Type", "").split(";")[0].strip().lower() != "application/json":
+            error = (415, "content type must be application/json")
+        elif length < 0:
+            error = (400, "invalid content length")
+        elif length > MAX_MESSAGE:
+            error = (413, "body too large")
+        if error:
+            # El cuerpo queda sin leer: cerrar para no interpretarlo como otra peticion
+            self.close_connection = True
+            self._send_json(error[0], {"error": error[1]})
+            return
+        data = codec.loads_or(self.rfile.read(length)) or {}
+        status, response = self.server.api.execute(url.path[len("/api/"):], data)
+        self._send_json(status, response)
+
+    def _websocket(self):
+        key = self.headers.get("Sec-WebSocket-Key")
+        if self.headers.get("Upgrade", "").lower() != "websocket" or not key:
+            self._send_json(400, {"error": "websocket upgrade required"})
+            return
+        if not self._origin_allowed():
+            self._send_json(403, {"error": "origin not allowed"})
+            return
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", _accept_key(key))
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+
+        sock = self.connection
+        try:
+            # Un cliente que no lee no frena al resto: el envio falla a los SEND_TIMEOUT s
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, struct.pack("ll", SEND_TIMEOUT, 0))
+        except (OSError, AttributeError, struct.error):
+            pass
+        api = self.server.api
+        client = _WsClient(sock)
+        client.send(encode_frame(codec.dumps({"type": "state", "state": estadoPlaca.board_state.snapshot()})))
+        api.add_client(client)
+        try:
+            self._ws_loop(client)
+        except (OSError, ValueError, struct.error) as e:
+            logger.debug("WebSocket %s cerrado: %s", self.address_string(), e)
+        finally:
+            api.remove_client(client)
+            client.close()
+
+    def _ws_loop(self, client):
+        api = self.server.api
+        parts = []
+        while not client.closed:
+            frame = read_frame(self.rfile)
+            if frame is None:
+                return
+            fin, opcode, payload = frame
+            if opcode == OP_PING:
+                client.send(encode_frame(payload, OP_PONG))
+                continue
+            if opcode == OP_PONG:
+                continue
+            if opcode == OP_CLOSE:
+                client.send(encode_frame(payload[:2], OP_CLOSE))
+                return
+            parts.append(payload)
+            if sum(len(p) for p in parts) > MAX_MESSAGE:
+                raise ValueError("message too large")
+            if not fin:
+                continue
+            message, parts = b"".join(parts), []
+            data = codec.loads_or(message, "device")
+            if not data:
+                continue
+            status, response = api.execute(str(data.get("device", "")), data)
+            response["type"] = "result"
+            response["id"] = data.get("id")
+            client.send(encode_frame(codec.dumps(response)))
+
+
+class LocalApiService:
+    def __init__(self, services=None, host=None, port=None, token=None):
+        # Nombre en main.py -> instancia; los servicios aislados no estan aca
+        self.services = services or {}
+        self.token = token if token is not None else os.environ.get("LOCAL_API_TOKEN", "")
+        self.host = host or os.environ.get("LOCAL_API_HOST", "0.0.0.0" if self.token else "127.0.0.1")
+        if not self.token and self.host not in LOOPBACK:
+            # Sin token cualquiera en la LAN podria abrir la puerta o prender la bomba
+            logger.warning("API local: %s requiere LOCAL_API_TOKEN, escuchando solo en 127.0.0.1", self.host)
+            self.host = "127.0.0.1"
+        self.port = int(port or os.environ.get("LOCAL_API_PORT", "8080"))
+        self.origins = {o.strip().rstrip("/") for o in os.environ.get("LOCAL_API_ORIGINS", "").split(",") if o.strip()}
+        self.server = None
+        self.clients = set()
+        self.requests = 0
+        self.pushes = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def execute(self, device, data):
+        """Ejecutar un comando sobre el servicio local; devuelve (status HTTP, respuesta)"""
+        started = time.perf_counter()
+        with self._lock:
+            self.requests += 1
+        if device not in DEVICES:
+            return 404, {"ok": False, "error": "unknown device {}".format(device)}
+        name, handler = DEVICES[device]
+        svc = self.services.get(name)
+        if svc is None:
+            return 503, {"ok": False, "error": "{} not running in this process".format(name)}
+        try:
+            action, extra = handler(svc, data)
+        except ValueError as e:
+            rpc.complete(None, data, "lan." + device, started, error=e)
+            return 400, {"ok": False, "error": str(e)}
+        except Exception as e:
+            logger.error("API local: %s fallo: %s", device, e)
+            rpc.complete(None, data, "lan." + device, started, error=e)
+            return 500, {"ok": False, "error": str(e)}
+        rpc.complete(None, data, "lan.{}.{}".format(device, action), started)
+        response = {"ok": True, "command": "{}.{}".format(device, action),
+                    "duration_ms": round((time.perf_counter() - started) * 1000.0, 3)}
+        response.update(extra)
+        return 200, response
+
+    def add_client(self, client):
+        with self._lock:
+            self.clients.add(client)
+
+    def remove_client(self, client):
+        with self._lock:
+            self.clients.discard(client)
+
+    def _broadcast(self, frame):
+        with self._lock:
+            clients = list(self.clients)
+        for client in clients:
+            if not client.send(frame):
+                self.remove_client(client)
+        return len(clients)
+
+    def push_loop(self):
+        """Empujar la foto de la placa a los WebSocket en cada cambio"""
+        state = estadoPlaca.board_state
+        seen = state.version
+        next_ping = time.monotonic() + PING_INTERVAL
+        while not self._stop.is_set():
+            version = state.wait_change(seen, max(0.0, next_ping - time.monotonic()))
+            if self._stop.is_set():
+                break
+            if time.monotonic() >= next_ping:
+                self._broadcast(encode_frame(b"", OP_PING))
+                next_ping = time.monotonic() + PING_INTERVAL
+            if version == seen:
+                continue
+            seen = version
+            if self.clients:
+                frame = encode_frame(codec.dumps({"type": "state", "state": state.snapshot()}))
+                self.pushes += self._broadcast(frame)
+
+    def stats(self):
+        return {"port": self.port, "clients": len(self.clients), "requests": self.requests, "pushes": self.pushes}
+
+    def start(self):
+        self._stop.clear()
+        self.server = ThreadingHTTPServer((self.host, self.port), _Handler)
+        self.server.daemon_threads = True
+        self.server.api = self
+        estadoPlaca.register_metrics("lan_api", self.stats)
+        self._threads = [
+            threading.Thread(target=self.server.serve_forever, daemon=True, name="lan-api"),
+            threading.Thread(target=self.push_loop, daemon=True, name="lan-api-push"),
+        ]
+        for t in self._threads:
+            t.start()
+        print("API local en http://{}:{}/api/ (WebSocket /api/ws)".format(self.host, self.server.server_address[1]))
+
+    def stop(self):
+        self._stop.set()
+        estadoPlaca.board_state.wake()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        with self._lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.send(encode_frame(struct.pack("!H", 1001), OP_CLOSE))
+            client.close()
+        for t in self._threads:
+            t.join(timeout=2)
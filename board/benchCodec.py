@@ -0,0 +1,49 @@
+"""Micro-benchmark del codec: costo por mensaje de codificar estados y
+decodificar comandos, comparado con dict + json.dumps / decode + json.loads.
+
+Uso: python benchCodec.py --n 100000
+"""
+import json
+import time
+import timeit
+import argparse
+
+import codec
+
+
+def per_msg_us(fn, n):
+    return timeit.timeit(fn, number=n) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de serializacion MQTT")
+    parser.add_argument("--n", type=int, default=100000)
+    args = parser.parse_args()
+    n = args.n
+
+    template = codec.StatusTemplate({"type": "fan", "device": "cooling_fan", "pin": 22})
+
+    def encode_stdlib():
+        json.dumps({"type": "fan", "device": "cooling_fan", "state": "on", "status": True,
+                    "pin": 22, "timestamp": time.time()})
+
+    def encode_template():
+        template.encode({"state": "on", "status": True, "timestamp": time.time()})
+
+    command = b'{"state": "on", "source": "dashboard"}'
+
+    def decode_stdlib():
+        json.loads(command.decode())
+
+    def decode_codec():
+        codec.loads(command)
+
+    print("backend: {}".format(codec.BACKEND))
+    print("encode estado  stdlib   {:.2f} us/msg".format(per_msg_us(encode_stdlib, n)))
+    print("encode estado  template {:.2f} us/msg".format(per_msg_us(encode_template, n)))
+    print("decode comando stdlib   {:.2f} us/msg".format(per_msg_us(decode_stdlib, n)))
+    print("decode comando codec    {:.2f} us/msg".format(per_msg_us(decode_codec, n)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 import os
 import time
-import json
 import threading
 
 try:
@@ -8,7 +7,14 @@ try:
 except Exception:
     GPIO = None
 
-import paho.mqtt.client as mqtt
+import codec
+import estadoPlaca
+import estadoPersistente
+import planificador
+import rpc
+import topicos
+import vigilante
+from conexionMqtt import MqttConnection, COMMAND_QOS
 
 class PumpService:
     def __init__(self, pump_pin=14):
@@ -17,9 +23,14 @@ class PumpService:
         self.mqtt_port = int(os.environ.get("MQTT_PORT", "8883"))
         self.mqtt_user = os.environ.get("MQTT_USERNAME", "isaac")
         self.mqtt_pass = os.environ.get("MQTT_PASSWORD", "ArquiGrupo4")
-        self.mqtt_client_id = os.environ.get("MQTT_CLIENT_ID", "raspberry-pi-pump")
+        self.mqtt_client_id = topicos.client_id("raspberry-pi-pump")
         self.client = None
+        self.conn = None
         self.pump_state = False
+        # Tope de una bomba restaurada al arrancar: sin la nube nada la apagaria
+        self.restore_max_s = float(os.environ.get("PUMP_RESTORE_MAX_S", "60"))
+        self._restore_limit = None
+        self.status_template = codec.StatusTemplate({"type": "pump", "device": "water_pump", "pin": pump_pin})
         self._stop = threading.Event()
         self._thread = None
 
@@ -34,98 +45,109 @@ class PumpService:
             pass
 
     def _setup_mqtt(self):
-        try:
-            self.client = mqtt.Client(client_id=self.mqtt_client_id)
-            try:
-                self.client.username_pw_set(self.mqtt_user, self.mqtt_pass)
-            except Exception:
-                pass
-            try:
-                self.client.tls_set()
-            except Exception:
-                pass
-            self.client.on_connect = self._on_connect
-            self.client.on_message = self._on_message
-            self.client.connect(self.mqtt_host, self.mqtt_port, 60)
-            self.client.loop_start()
-        except Exception:
-            pass
-
-    def _on_connect(self, client, userdata, flags, rc):
-        try:
-            client.subscribe("/pump")
-            client.subscribe("/pump/status")
-        except Exception:
-            pass
+        # /pump/status es nuestra propia salida: no suscribirse para no
+        # interpretar el estado publicado como un comando nuevo
+        self.conn = MqttConnection(self.mqtt_client_id, self.mqtt_host, self.mqtt_port,
+                                   self.mqtt_user, self.mqtt_pass,
+                                   subscriptions=topicos.subscriptions(["/pump"], COMMAND_QOS),
+                                   on_message=self._on_message)
+        self.client = self.conn.client
+        self.conn.start()
 
     def _on_message(self, client, userdata, msg):
-        try:
-            payload_str = msg.payload.decode()
-        except Exception:
+        data = codec.loads_or(msg.payload)
+        if data is None:
             return
+        if topicos.local(msg.topic) != "/pump":
+            return
+        started = time.perf_counter()
         try:
-            data = json.loads(payload_str)
-        except Exception:
-            data = {"state": payload_str.strip()}
-        if msg.topic.startswith("/pump"):
-            self._handle_command(data)
+            action = self._handle_command(data)
+        except Exception as e:
+            rpc.complete(client, data, "pump", started, error=e)
+            return
+        if action is None:
+            rpc.complete(client, data, "pump", started, error="unknown command")
+        else:
+            rpc.complete(client, data, "pump." + action, started, state="on" if self.pump_state else "off")
 
     def _handle_command(self, data):
-        try:
-            value = None
-            if "state" in data:
-                value = str(data["state"]).lower().strip()
-            elif "pump" in data:
-                value = str(data["pump"]).lower().strip()
-            elif "command" in data:
-                value = str(data["command"]).lower().strip()
-            if value in ["on", "1", "true", "encendido", "activar"]:
-                self.turn_on()
-            elif value in ["off", "0", "false", "apagado", "desactivar"]:
-                self.turn_off()
-        except Exception:
-            pass
-
+        """Ejecutar el comando; devuelve "on"/"off" o None si no se reconoce"""
+        value = None
+        if "state" in data:
+            value = str(data["state"]).lower().strip()
+        elif "pump" in data:
+            value = str(data["pump"]).lower().strip()
+        elif "command" in data:
+            value = str(data["command"]).lower().strip()
+        if value in ["on", "1", "true", "encendido", "activar"]:
+            self.turn_on()
+            return "on"
+        elif value in ["off", "0", "false", "apagado", "desactivar"]:
+            self.turn_off()
+            return "off"
+        return None
+
+    def _cancel_restore_limit(self):
+        # Un comando explicito reemplaza al tope de la restauracion
+        if self._restore_limit is not None:
+            self._restore_limit.cancel()
+            self._restore_limit = None
+
+    @vigilante.watched
     def turn_on(self):
+        self._cancel_restore_limit()
+        changed = not self.pump_state
         if GPIO is not None:
-            try:
-                GPIO.output(self.pump_pin, GPIO.HIGH)
-            except Exception:
-                pass
+            # Si el GPIO falla se propaga: el estado no cambia y rpc.complete reporta el error
+            GPIO.output(self.pump_pin, GPIO.HIGH)
         self.pump_state = True
-        self.publish_status()
+        estadoPersistente.save("pump", 1)
+        if changed:
+            self.publish_status()
 
+    @vigilante.watched
     def turn_off(self):
+        self._cancel_restore_limit()
+        changed = self.pump_state
         if GPIO is not None:
-            try:
-                GPIO.output(self.pump_pin, GPIO.LOW)
-            except Exception:
-                pass
+            GPIO.output(self.pump_pin, GPIO.LOW)
         self.pump_state = False
-        self.publish_status()
+        estadoPersistente.save("pump", 0)
+        if changed:
+            self.publish_status()
 
     def publish_status(self):
+        estadoPlaca.update("pump", self.pump_state)
         if not self.client:
             return
-        status = {
-            "type": "pump",
-            "device": "water_pump",
+        payload = self.status_template.encode({
             "state": "on" if self.pump_state else "off",
             "status": self.pump_state,
-            "pin": self.pump_pin,
             "timestamp": time.time()
-        }
+        })
         try:
-            self.client.publish("/pump/status", json.dumps(status))
+            self.client.publish(topicos.topic("/pump/status"), payload, qos=1, retain=True)
         except Exception:
             pass
 
+    def _restore(self):
+        # Volver al ultimo estado comandado antes de conectarse al broker
+        if estadoPersistente.restoring("pump") and estadoPersistente.load("pump"):
+            try:
+                self.turn_on()
+            except Exception as e:
+                print(f"Error restaurando bomba: {e}")
+                return
+            self._restore_limit = planificador.after("pump.restore_limit", self.restore_max_s, self.turn_off)
+
     def loop(self):
         self._setup_gpio()
+        self._restore()
         self._setup_mqtt()
+        self.publish_status()
         try:
-            while not self._stop.is_set():
-                time.sleep(1)
+            self._stop.wait()
         finally:
             self.cleanup()
 
@@ -150,12 +172,8 @@ class PumpService:
                 GPIO.cleanup()
             except Exception:
                 pass
-        if self.client:
-            try:
-                self.client.loop_stop()
-                self.client.disconnect()
-            except Exception:
-                pass
+        if self.conn:
+            self.conn.stop()
 
 def main():
     import argparse
@@ -175,8 +193,7 @@ def main():
         return
     try:
         svc.start()
-        while True:
-            time.sleep(1)
+        svc._stop.wait()
     except KeyboardInterrupt:
         pass
     finally:
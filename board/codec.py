@@ -0,0 +1,76 @@
+import json
+
+# Backend JSON mas rapido si esta instalado; si no, la libreria estandar
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+try:
+    import ujson
+except Exception:
+    ujson = None
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+
+    def loads(payload):
+        return orjson.loads(payload)
+elif ujson is not None:
+    BACKEND = "ujson"
+
+    def dumps(obj):
+        return ujson.dumps(obj, ensure_ascii=False).encode()
+
+    def loads(payload):
+        return ujson.loads(payload)
+else:
+    BACKEND = "json"
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+    def loads(payload):
+        # json.loads acepta bytes directamente, sin decode() previo
+        return json.loads(payload)
+
+
+def loads_or(payload, key="state"):
+    """Parsear el payload; si no es JSON devolver {key: texto} como los handlers"""
+    try:
+        data = loads(payload)
+    except Exception:
+        data = None
+    if isinstance(data, dict):
+        return data
+    try:
+        text = payload.decode() if isinstance(payload, (bytes, bytearray)) else str(payload)
+    except Exception:
+        return None
+    return {key: text.strip()}
+
+
+class StatusTemplate:
+    """Campos constantes de un mensaje de estado serializados una sola vez.
+
+    encode() solo serializa los campos que cambian y los concatena al prefijo.
+    """
+
+    def __init__(self, constant):
+        self.constant = dict(constant)
+        self._full = dumps(self.constant)
+        # b'{"type":"fan",...' sin la llave de cierre
+        self._prefix = self._full[:-1] + (b"," if self.constant else b"")
+
+    def encode(self, fields):
+        if not fields:
+            return self._full
+        return self._prefix + dumps(fields)[1:]
+
+    def as_dict(self, fields):
+        merged = dict(self.constant)
+        merged.update(fields)
+        return merged
@@ -0,0 +1,153 @@
+import os
+import ssl
+import time
+import random
+import logging
+import threading
+from collections import deque
+
+import paho.mqtt.client as mqtt
+
+import memoria
+import vigilante
+
+logger = logging.getLogger(__name__)
+
+# QoS de los topicos de comandos: con sesion persistente el broker guarda
+# los comandos QoS 1 que lleguen mientras la placa esta desconectada
+COMMAND_QOS = 1
+
+# Conexiones creadas en el proceso, para reportar metricas
+connections = []
+
+_tls_context = None
+
+
+def shared_tls_context():
+    """Un solo SSLContext (CAs del sistema cargadas una vez) para todos los clientes"""
+    global _tls_context
+    if _tls_context is None:
+        _tls_context = ssl.create_default_context()
+    return _tls_context
+
+
+class MqttConnection:
+    """Cliente MQTT con conexion inicial con backoff, sesion persistente,
+    re-suscripcion automatica y metricas de tiempo de recuperacion"""
+
+    def __init__(self, client_id, host, port, user=None, password=None,
+                 subscriptions=None, on_message=None, clean_session=False,
+                 tls=None, keepalive=60, backoff_min=1.0, backoff_max=30.0):
+        self.client_id = client_id
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.subscriptions = list(subscriptions or [])
+        if tls is None:
+            tls = os.environ.get("MQTT_TLS", "1").lower() not in ("0", "false", "no")
+
+        self.client = mqtt.Client(client_id=client_id, clean_session=clean_session)
+        if user:
+            self.client.username_pw_set(user, password)
+        if tls:
+            self.client.tls_set_context(shared_tls_context())
+        # Colas acotadas del cliente (LOW_MEMORY / MQTT_MAX_QUEUED)
+        self.client.max_queued_messages_set(memoria.MQTT_MAX_QUEUED)
+        self.client.max_inflight_messages_set(memoria.MQTT_MAX_INFLIGHT)
+        self.client.reconnect_delay_set(min_delay=int(backoff_min), max_delay=int(backoff_max))
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        if on_message is not None:
+            # Todos los handlers se miden contra el presupuesto del watchdog
+            self.client.on_message = vigilante.watchdog.wrap_on_message(on_message)
+
+        self.connected = threading.Event()
+        self.connect_attempts = 0
+        self.disconnects = 0
+        self.initial_connect_s = None
+        self.recoveries = deque(maxlen=50)
+        self._started_at = None
+        self._lost_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        connections.append(self)
+
+    def start(self):
+        """Conectar en segundo plano; no bloquea si el broker no responde"""
+        self._stop.clear()
+        self._started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._connect_loop, daemon=True)
+        self._thread.start()
+
+    def _connect_loop(self):
+        delay = self.backoff_min
+        while not self._stop.is_set():
+            self.connect_attempts += 1
+            try:
+                self.client.connect(self.host, self.port, self.keepalive)
+                self.client.loop_start()
+                return
+            except Exception as e:
+                # Jitter para que varios servicios no reintenten a la vez
+                wait = delay * random.uniform(0.5, 1.5)
+                logger.warning("MQTT %s: conexion fallida (%s), reintento en %.1fs", self.client_id, e, wait)
+                self._stop.wait(wait)
+                delay = min(delay * 2, self.backoff_max)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            logger.error("MQTT %s: conexion rechazada - codigo %s", self.client_id, rc)
+            return
+        now = time.monotonic()
+        if self.initial_connect_s is None:
+            self.initial_connect_s = now - self._started_at
+        if self._lost_at is not None:
+            self.recoveries.append(now - self._lost_at)
+            logger.info("MQTT %s: reconectado en %.2fs", self.client_id, now - self._lost_at)
+            self._lost_at = None
+        for topic, qos in self.subscriptions:
+            client.subscribe(topic, qos)
+        self.connected.set()
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.connected.clear()
+        if rc != 0 and self._lost_at is None:
+            self.disconnects += 1
+            self._lost_at = time.monotonic()
+            logger.warning("MQTT %s: conexion perdida (rc=%s)", self.client_id, rc)
+
+    def subscribe(self, topic, qos=COMMAND_QOS):
+        self.subscriptions.append((topic, qos))
+        if self.connected.is_set():
+            self.client.subscribe(topic, qos)
+
+    def stats(self):
+        rec = list(self.recoveries)
+        return {
+            "connected": self.connected.is_set(),
+            "connect_attempts": self.connect_attempts,
+            "initial_connect_s": self.initial_connect_s,
+            "disconnects": self.disconnects,
+            "recoveries": len(rec),
+            "last_recovery_s": rec[-1] if rec else None,
+            "max_recovery_s": max(rec) if rec else None,
+            "mean_recovery_s": sum(rec) / len(rec) if rec else None,
+        }
+
+    def stop(self):
+        if self in connections:
+            connections.remove(self)
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+        try:
+            self.client.loop_stop()
+            self.client.disconnect()
+        except Exception:
+            pass
+
+
+def all_stats():
+    return {conn.client_id: conn.stats() for conn in list(connections)}
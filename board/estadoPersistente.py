@@ -0,0 +1,172 @@
+"""Ultimo estado comandado de los actuadores, en un archivo mapeado en memoria.
+
+Cada cambio (luces, RGB, ventilador, bomba) se escribe en su casillero del
+archivo; al arrancar, cada servicio lo lee despues de configurar el GPIO y
+vuelve al estado anterior sin esperar comandos del backend.
+
+Formato: cabecera (magic, cantidad de casilleros) y casilleros fijos de
+(clave 16 bytes, valor int32). Un valor se escribe en su lugar; solo la
+creacion de un casillero nuevo toma un flock, asi que varios procesos
+(--isolate) pueden compartir el archivo.
+
+Un cambio no hace msync: el kernel baja las paginas a la SD por su cuenta y,
+tras una rafaga de cambios (p.ej. arrastrar el slider RGB), se fuerza una
+sola escritura a los ACTUATOR_FLUSH_S s (5) y otra en close().
+
+  ACTUATOR_STATE_FILE  ruta del archivo (~/.board_actuators)
+  ACTUATOR_RESTORE     que restaurar al arrancar: "rgb,rooms,fan" (por
+                       defecto), "none" para arrancar todo apagado. La bomba
+                       solo con "pump" explicito, y aun asi se apaga sola a
+                       los PUMP_RESTORE_MAX_S s salvo que llegue un comando
+"""
+import os
+import mmap
+import struct
+import logging
+import threading
+
+import planificador
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"BAS1"
+HEADER = struct.Struct("<4sI")
+SLOT = struct.Struct("<16si")
+SLOTS = 32
+SIZE = HEADER.size + SLOTS * SLOT.size
+
+PATH = os.environ.get("ACTUATOR_STATE_FILE", os.path.expanduser("~/.board_actuators"))
+FLUSH_S = float(os.environ.get("ACTUATOR_FLUSH_S", "5"))
+RESTORE = {x.strip() for x in os.environ.get("ACTUATOR_RESTORE", "rgb,rooms,fan").lower().split(",") if x.strip()}
+
+
+class ActuatorState:
+    def __init__(self, path=PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = None
+        self._map = None
+        self._index = {}
+        self._failed = False
+        self._flush_task = None
+
+    def _open(self):
+        if self._map is not None or self._failed:
+            return self._map
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if os.fstat(fd).st_size < SIZE:
+                os.ftruncate(fd, SIZE)
+            self._map = mmap.mmap(fd, SIZE)
+            self._fd = fd
+            if HEADER.unpack_from(self._map, 0) != (MAGIC, SLOTS):
+                # Archivo nuevo o de otro formato: empezar vacio
+                self._map[:] = bytes(SIZE)
+                HEADER.pack_into(self._map, 0, MAGIC, SLOTS)
+        except (OSError, ValueError) as e:
+            logger.warning("Estado de actuadores no persistente (%s): %s", self.path, e)
+            self._failed = True
+        return self._map
+
+    def _find(self, key):
+        """Casillero de `key` (o None); refresca el indice si otro proceso agrego claves"""
+        slot = self._index.get(key)
+        if slot is not None:
+            return slot
+        for i in range(SLOTS):
+            name = SLOT.unpack_from(self._map, HEADER.size + i * SLOT.size)[0].rstrip(b"\0")
+            if name:
+                self._index[name.decode()] = i
+        return self._index.get(key)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if self._open() is None:
+                return default
+            slot = self._find(key)
+            if slot is None:
+                return default
+            return SLOT.unpack_from(self._map, HEADER.size + slot * SLOT.size)[1]
+
+    def set(self, key, value):
+        value = int(value)
+        with self._lock:
+            if self._open() is None:
+                return
+            slot = self._find(key)
+            if slot is None:
+                slot = self._allocate(key)
+                if slot is None:
+                    return
+            offset = HEADER.size + slot * SLOT.size
+            if SLOT.unpack_from(self._map, offset)[1] == value:
+                return
+            struct.pack_into("<i", self._map, offset + 16, value)
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        # Una escritura por rafaga de cambios, no una por cambio
+        if self._flush_task is None:
+            self._flush_task = planificador.after("actuators.flush", FLUSH_S, self.flush)
+
+    def flush(self):
+        with self._lock:
+            self._flush_task = None
+            if self._map is not None:
+                self._map.flush()
+
+    def _allocate(self, key):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            slot = self._find(key)
+            if slot is not None:
+                return slot
+            if len(key.encode()) > 16:
+                logger.warning("Clave de actuador demasiado larga, no se guarda: %s", key)
+                return None
+            used = set(self._index.values())
+            free = next((i for i in range(SLOTS) if i not in used), None)
+            if free is None:
+                logger.warning("Estado de actuadores lleno, no se guarda %s", key)
+                return None
+            offset = HEADER.size + free * SLOT.size
+            SLOT.pack_into(self._map, offset, key.encode(), 0)
+            self._index[key] = free
+            return free
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        with self._lock:
+            if self._flush_task is not None:
+                self._flush_task.cancel()
+                self._flush_task = None
+            if self._map is not None:
+                self._map.flush()
+                self._map.close()
+                os.close(self._fd)
+                self._map = None
+
+
+# Compartido por todos los servicios del proceso
+state = ActuatorState()
+
+
+def load(key, default=None):
+    return state.get(key, default)
+
+
+def save(key, value):
+    state.set(key, value)
+
+
+def restoring(kind):
+    """True si `kind` ("rgb", "rooms", "fan", "pump") se restaura al arrancar"""
+    return kind in RESTORE
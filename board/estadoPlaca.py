@@ -0,0 +1,157 @@
+import os
+import time
+import threading
+
+import codec
+import topicos
+import conexionMqtt
+import vigilante
+from conexionMqtt import MqttConnection
+
+
+class BoardState:
+    """Foto consolidada de actuadores y ultimas lecturas de la placa"""
+
+    def __init__(self):
+        self.state = {}
+        self.version = 0
+        self.changed_at = 0.0
+        self._cond = threading.Condition()
+
+    def update(self, section, value, key=None):
+        with self._cond:
+            if key is None:
+                if self.state.get(section) == value:
+                    return
+                self.state[section] = value
+            else:
+                group = self.state.get(section)
+                if not isinstance(group, dict):
+                    group = self.state[section] = {}
+                if group.get(key) == value:
+                    return
+                group[key] = value
+            self.version += 1
+            self.changed_at = time.time()
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            snap = {k: dict(v) if isinstance(v, dict) else v for k, v in self.state.items()}
+            snap["ts"] = self.changed_at
+            return snap
+
+    def wait_change(self, version, timeout=None):
+        """Esperar hasta que la version sea distinta de `version`"""
+        with self._cond:
+            if self.version == version:
+                self._cond.wait(timeout)
+            return self.version
+
+    def wake(self):
+        """Despertar a quien espera en wait_change (p. ej. al detener un servicio)"""
+        with self._cond:
+            self._cond.notify_all()
+
+
+# Estado compartido por todos los servicios del proceso
+board_state = BoardState()
+
+# Nombre -> funcion que devuelve un dict de metricas para /board/metrics
+metrics_sources = {}
+
+
+def update(section, value, key=None):
+    board_state.update(section, value, key)
+
+
+def register_metrics(name, fn):
+    metrics_sources[name] = fn
+
+
+register_metrics("mqtt", conexionMqtt.all_stats)
+register_metrics("callbacks", vigilante.snapshot)
+
+
+def collect_metrics():
+    out = {"ts": time.time()}
+    for name, fn in list(metrics_sources.items()):
+        try:
+            out[name] = fn()
+        except Exception as e:
+            out[name] = {"error": str(e)}
+    return out
+
+
+class BoardStateService:
+    """Publica la foto de la placa en /board/state (retenido) con tasa acotada
+    y las metricas registradas en /board/metrics cada `metrics_interval`"""
+
+    def __init__(self, state=None, min_interval=None, metrics_interval=None):
+        self.board_state = state or board_state
+        self.min_interval = float(min_interval or os.environ.get("BOARD_STATE_INTERVAL", "1.0"))
+        self.metrics_interval = float(metrics_interval or os.environ.get("BOARD_METRICS_INTERVAL", "60"))
+        self.mqtt_host = os.environ.get("MQTT_HOST", "9a9751de0a5f4cf48ef00e50f9450e27.s1.eu.hivemq.cloud")
+        self.mqtt_port = int(os.environ.get("MQTT_PORT", "8883"))
+        self.mqtt_user = os.environ.get("MQTT_USERNAME", "isaac")
+        self.mqtt_pass = os.environ.get("MQTT_PASSWORD", "ArquiGrupo4")
+        self.mqtt_client_id = topicos.client_id("raspberry-pi-board-state")
+        self.topic = topicos.topic("/board/state")
+        self.metrics_topic = topicos.topic("/board/metrics")
+        self.client = None
+        self.published = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def publish(self):
+        if not self.client:
+            return
+        try:
+            self.client.publish(self.topic, codec.dumps(self.board_state.snapshot()), qos=1, retain=True)
+            self.published += 1
+        except Exception as e:
+            print("Error publicando estado de la placa: {}".format(e))
+
+    def publish_metrics(self):
+        if not self.client:
+            return
+        try:
+            self.client.publish(self.metrics_topic, codec.dumps(collect_metrics()))
+        except Exception as e:
+            print("Error publicando metricas de la placa: {}".format(e))
+
+    def loop(self):
+        conn = MqttConnection(self.mqtt_client_id, self.mqtt_host, self.mqtt_port,
+                              self.mqtt_user, self.mqtt_pass)
+        conn.start()
+        self.client = conn.client
+        seen = -1
+        next_metrics = time.monotonic() + self.metrics_interval
+        try:
+            while not self._stop.is_set():
+                version = self.board_state.wait_change(seen, max(0.0, next_metrics - time.monotonic()))
+                if self._stop.is_set():
+                    break
+                if time.monotonic() >= next_metrics:
+                    self.publish_metrics()
+                    next_metrics = time.monotonic() + self.metrics_interval
+                if version == seen:
+                    continue
+                seen = version
+                self.publish()
+                # Acotar la tasa: los cambios en esta ventana salen en la siguiente foto
+                self._stop.wait(self.min_interval)
+        finally:
+            conn.stop()
+
+    def start(self):
+        self._stop.clear()
+        t = threading.Thread(target=self.loop, daemon=True)
+        t.start()
+        self._thread = t
+
+    def stop(self):
+        self._stop.set()
+        self.board_state.wake()
+        if self._thread:
+            self._thread.join(timeout=2)
@@ -0,0 +1,186 @@
+"""Generador de carga: una flota simulada de placas en un solo proceso.
+
+Cada placa simulada corre instancias reales de DHTPublisher, SoilPublisher y
+MotionSensorService con su propio client ID, sus propios topicos
+(/devices/<placa>/...) y senales sinteticas. Al terminar reporta la tasa de
+publicacion lograda, la latencia de publicacion y el CPU / memoria del
+proceso por placa.
+
+  python generadorCarga.py --boards 200 --rate 1 --seconds 60 --host 127.0.0.1 --port 1883
+"""
+import os
+import math
+import time
+import random
+import logging
+import argparse
+import threading
+
+import lecturaTemperatura
+import lecturaHumedadSuelo
+import memoria
+import SensorMovimiento
+import topicos
+
+
+class PublishTracker:
+    """Mide la latencia publish -> on_publish (PUBACK con QoS 1) de cada cliente"""
+
+    def __init__(self, qos):
+        self.qos = qos
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.latencies = []
+        self.published = 0
+        self.failed = 0
+
+    def attach(self, client):
+        original = client.publish
+
+        def publish(topic, payload=None, qos=0, retain=False, *args, **kwargs):
+            t0 = time.perf_counter()
+            info = original(topic, payload, self.qos, retain, *args, **kwargs)
+            with self.lock:
+                if info.rc == 0:
+                    self.pending[(id(client), info.mid)] = t0
+                    self.published += 1
+                else:
+                    self.failed += 1
+            return info
+
+        def on_publish(c, userdata, mid, *args):
+            t1 = time.perf_counter()
+            with self.lock:
+                t0 = self.pending.pop((id(client), mid), None)
+                if t0 is not None:
+                    self.latencies.append(t1 - t0)
+
+        client.publish = publish
+        client.on_publish = on_publish
+
+    def summary(self):
+        with self.lock:
+            lat = sorted(self.latencies)
+        if not lat:
+            return {"acked": 0}
+
+        def pct(p):
+            return round(lat[min(len(lat) - 1, int(len(lat) * p / 100.0))] * 1000, 2)
+        return {"acked": len(lat), "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99),
+                "max_ms": round(lat[-1] * 1000, 2)}
+
+
+def make_fleet(n, rate, tracker, motion=True):
+    period = 1.0 / rate
+
+    class SimDHT(lecturaTemperatura.DHTPublisher):
+        def _make_connection(self):
+            conn = super()._make_connection()
+            tracker.attach(conn.client)
+            return conn
+
+    class SimSoil(lecturaHumedadSuelo.SoilPublisher):
+        def _make_connection(self):
+            conn = super()._make_connection()
+            tracker.attach(conn.client)
+            return conn
+
+    class SimMotion(SensorMovimiento.MotionSensorService):
+        def register_motion_detection(self):
+            t0 = time.perf_counter()
+            super().register_motion_detection()
+            with tracker.lock:
+                tracker.http_latencies.append(time.perf_counter() - t0)
+
+    tracker.http_latencies = []
+    services = []
+    for i in range(n):
+        board = "board{:04d}".format(i)
+        phase = random.uniform(0, 2 * math.pi)
+
+        def dht_signal(phase=phase):
+            t = time.time() / 60.0 + phase
+            return 22 + 3 * math.sin(t) + random.gauss(0, 0.2), 55 + 10 * math.cos(t) + random.gauss(0, 0.5)
+
+        def soil_signal(phase=phase):
+            return 1 if math.sin(time.time() / 30.0 + phase) > 0 else 0
+
+        def distance_signal(phase=phase):
+            # Alguien pasa frente al sensor unos segundos de cada minuto
+            return 15.0 if math.sin(time.time() / 10.0 + phase) > 0.95 else 120.0
+
+        services.append(SimDHT(period=period, reader=dht_signal, client_id=board + "-dht",
+                               topic_prefix=topicos.prefix(board), verbose=False))
+        services.append(SimSoil(period=period, reader=soil_signal, client_id=board + "-soil",
+                                topic_prefix=topicos.prefix(board), verbose=False))
+        if motion:
+            # La placa va en la ubicacion: el backend no tiene otro campo para distinguirlas
+            services.append(SimMotion(distance_reader=distance_signal, poll_interval=0.1,
+                                      location="{}/entrada".format(board)))
+    return services
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flota simulada de placas contra un broker local")
+    parser.add_argument("--boards", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=1.0, help="lecturas por segundo por sensor")
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--tls", action="store_true")
+    parser.add_argument("--qos", type=int, default=1, choices=[0, 1])
+    parser.add_argument("--no-motion", action="store_true", help="no simular sensores de movimiento (HTTP al backend)")
+    args = parser.parse_args()
+
+    os.environ["MQTT_HOST"] = args.host
+    os.environ["MQTT_PORT"] = str(args.port)
+    os.environ["MQTT_TLS"] = "1" if args.tls else "0"
+    # Sin hardware real: todos los servicios en modo simulacion
+    lecturaHumedadSuelo.GPIO = None
+    SensorMovimiento.GPIO = None
+    logging.getLogger().setLevel(logging.WARNING)
+
+    tracker = PublishTracker(args.qos)
+    rss0 = memoria.rss_kb()
+    services = make_fleet(args.boards, args.rate, tracker, motion=not args.no_motion)
+    for s in services:
+        s.start()
+    rss_started = memoria.rss_kb()
+    print("{} placas, {} servicios, {} hilos".format(args.boards, len(services), threading.active_count()))
+
+    cpu0 = time.process_time()
+    t0 = time.monotonic()
+    pub0 = tracker.published
+    try:
+        time.sleep(args.seconds)
+    except KeyboardInterrupt:
+        pass
+    elapsed = time.monotonic() - t0
+    cpu = time.process_time() - cpu0
+    published = tracker.published - pub0
+    rss_end = memoria.rss_kb()
+
+    # Senalar a todos antes de esperar a cada hilo
+    for s in services:
+        s._stop.set()
+    for s in services:
+        s.stop()
+
+    target = args.boards * 3 * args.rate  # DHT publica 2 mensajes, suelo 1
+    print("Publicados:   {} en {:.1f}s = {:.0f} msg/s (objetivo {:.0f} msg/s), fallidos {}".format(
+        published, elapsed, published / elapsed, target, tracker.failed))
+    print("Latencia publicacion (QoS {}): {}".format(args.qos, tracker.summary()))
+    http = sorted(tracker.http_latencies)
+    if http:
+        print("Movimiento -> backend: {} POST, p50 {:.1f} ms, max {:.1f} ms".format(
+            len(http), http[len(http) // 2] * 1000, http[-1] * 1000))
+    print("CPU cliente:  {:.1f}% total, {:.3f}% por placa".format(100 * cpu / elapsed, 100 * cpu / elapsed / args.boards))
+    if None in (rss0, rss_end):
+        print("Memoria RSS:  sin /proc, no disponible")
+    else:
+        print("Memoria RSS:  {} KB al arrancar, {} KB al final, {:.1f} KB por placa".format(
+            rss_started, rss_end, (rss_end - rss0) / float(args.boards)))
+
+
+if __name__ == "__main__":
+    main()
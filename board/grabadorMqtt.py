@@ -0,0 +1,222 @@
+"""Grabacion y reproduccion acelerada de trafico MQTT.
+
+  python grabadorMqtt.py record trafico.mqtr --seconds 600
+  python grabadorMqtt.py replay trafico.mqtr --host 127.0.0.1 --port 1883 --speed 10
+
+record se suscribe a '#' en el broker configurado (MQTT_HOST...) y guarda
+cada mensaje con su marca de tiempo. replay levanta los servicios reales con
+GPIO simulado contra un broker local, publica el archivo a 1x, 10x o lo mas
+rapido posible (--speed 0) y reporta throughput, mensajes perdidos y el
+estado final de los dispositivos.
+"""
+import os
+import sys
+import time
+import struct
+import argparse
+import threading
+
+MAGIC = b"MQTR1\n"
+# offset en ms desde el inicio, largo del topico, largo del payload
+RECORD = struct.Struct("<IHI")
+
+
+def write_record(fh, offset_ms, topic, payload):
+    t = topic.encode()
+    fh.write(RECORD.pack(offset_ms, len(t), len(payload)))
+    fh.write(t)
+    fh.write(payload)
+
+
+def read_records(path):
+    with open(path, "rb") as fh:
+        if fh.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} no es una grabacion MQTT".format(path))
+        while True:
+            head = fh.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            offset_ms, tlen, plen = RECORD.unpack(head)
+            topic = fh.read(tlen).decode()
+            payload = fh.read(plen)
+            yield offset_ms, topic, payload
+
+
+def record(args):
+    import topicos
+    from conexionMqtt import MqttConnection
+    lock = threading.Lock()
+    count = [0]
+    fh = open(args.file, "wb")
+    fh.write(MAGIC)
+    t0 = time.monotonic()
+    # Con --shared-group varios grabadores se reparten los mensajes
+    topic_filter = topicos.fleet_filter(args.fleet) if args.fleet else args.topic
+    topic_filter = topicos.shared(args.shared_group, topic_filter) if args.shared_group else topic_filter
+
+    def on_message(client, userdata, msg):
+        with lock:
+            write_record(fh, int((time.monotonic() - t0) * 1000), msg.topic, msg.payload)
+            count[0] += 1
+
+    conn = MqttConnection("mqtt-recorder-{}".format(os.getpid()),
+                          os.environ.get("MQTT_HOST", "9a9751de0a5f4cf48ef00e50f9450e27.s1.eu.hivemq.cloud"),
+                          int(os.environ.get("MQTT_PORT", "8883")),
+                          os.environ.get("MQTT_USERNAME", "isaac"), os.environ.get("MQTT_PASSWORD", "ArquiGrupo4"),
+                          subscriptions=[(topic_filter, 0)], on_message=on_message, clean_session=True)
+    conn.start()
+    print("Grabando {} en {} (Ctrl+C para terminar)".format(topic_filter, args.file))
+    try:
+        deadline = time.monotonic() + args.seconds if args.seconds else None
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.stop()
+        with lock:
+            fh.close()
+    print("{} mensajes grabados".format(count[0]))
+
+
+def _count_replayed(client, name, remaining, got, lock):
+    """Envolver on_message para contar solo entregas de mensajes reproducidos.
+
+    Los servicios tambien reciben lo que publican otros servicios de la placa
+    (las lecturas de /temperatura le llegan a la pantalla LCD);
+    esas entregas no estan en `remaining` y no cuentan como procesadas.
+    """
+    handler = client.on_message
+
+    def on_message(c, userdata, msg):
+        try:
+            handler(c, userdata, msg)
+        finally:
+            key = (msg.topic, msg.payload)
+            with lock:
+                left = remaining[name].get(key, 0)
+                if left:
+                    remaining[name][key] = left - 1
+                    got[name] += 1
+
+    client.on_message = on_message
+
+
+def replay(args):
+    # Los servicios leen la configuracion MQTT del entorno al construirse
+    os.environ["MQTT_HOST"] = args.host
+    os.environ["MQTT_PORT"] = str(args.port)
+    os.environ["MQTT_TLS"] = "1" if args.tls else "0"
+    os.environ.pop("MQTT_CLIENT_ID", None)
+
+    from collections import Counter
+    import paho.mqtt.client as mqtt
+    import vigilante
+    import estadoPlaca
+    import ventilador
+    import bombaRiego
+    import LedRGB
+    import LedsPorHabitacion
+    import ServoControl
+    from conexionMqtt import MqttConnection
+
+    modules = [ventilador, bombaRiego, LedRGB, LedsPorHabitacion, ServoControl]
+    for m in modules:
+        # GPIO simulado: todos los servicios tienen modo simulacion con GPIO = None
+        m.GPIO = None
+    services = [ventilador.FanService(), bombaRiego.PumpService(), LedRGB.RGBLEDService(),
+                LedsPorHabitacion.RoomLEDService(), ServoControl.ServoService()]
+    for s in services:
+        s.start()
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline and not all(s.conn and s.conn.connected.is_set() for s in services):
+        time.sleep(0.05)
+
+    records = list(read_records(args.file))
+    subs = [(type(s).__name__, topic) for s in services for topic, _ in s.conn.subscriptions]
+    matched = []
+    expected = {}
+    # servicio -> Counter((topico, payload)) de entregas reproducidas pendientes
+    remaining = {type(s).__name__: Counter() for s in services}
+    for offset_ms, topic, payload in records:
+        targets = {name for name, sub in subs if mqtt.topic_matches_sub(sub, topic)}
+        if targets:
+            matched.append((offset_ms, topic, payload))
+            for name in targets:
+                expected[name] = expected.get(name, 0) + 1
+                remaining[name][(topic, payload)] += 1
+    got = {name: 0 for name in remaining}
+    lock = threading.Lock()
+    for s in services:
+        _count_replayed(s.conn.client, type(s).__name__, remaining, got, lock)
+    print("{} mensajes en el archivo, {} van a servicios de la placa".format(len(records), len(matched)))
+
+    sender = MqttConnection("mqtt-replayer-{}".format(os.getpid()), args.host, args.port,
+                            tls=args.tls, clean_session=True)
+    sender.start()
+    sender.connected.wait(15)
+
+    start = time.monotonic()
+    for offset_ms, topic, payload in matched:
+        if args.speed > 0:
+            wait = start + offset_ms / 1000.0 / args.speed - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        sender.client.publish(topic, payload, qos=args.qos)
+    sent_done = time.monotonic()
+
+    # Esperar a que los servicios terminen de procesar
+    total_expected = sum(expected.values())
+    last_total, last_change = -1, time.monotonic()
+    while time.monotonic() - last_change < args.drain:
+        with lock:
+            total = sum(got.values())
+        if total != last_total:
+            last_total, last_change = total, time.monotonic()
+        if total >= total_expected:
+            break
+        time.sleep(0.05)
+    elapsed = last_change - start
+
+    print("\nPublicacion: {:.2f}s ({:.0f} msg/s)".format(sent_done - start, len(matched) / max(sent_done - start, 1e-9)))
+    print("Procesado:   {} de {} entregas esperadas en {:.2f}s ({:.0f} msg/s)".format(
+        last_total, total_expected, elapsed, last_total / max(elapsed, 1e-9)))
+    for name in sorted(expected):
+        print("  {:16s} esperados {:6d} procesados {:6d} perdidos {:6d}".format(
+            name, expected[name], got[name], expected[name] - got[name]))
+    print("\nEstado final: {}".format(estadoPlaca.board_state.snapshot()))
+    worst = {svc: data["worst_ms"] for svc, data in vigilante.snapshot()["services"].items()}
+    print("Peor handler (ms): {}".format(worst))
+
+    sender.stop()
+    for s in services:
+        s.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grabar y reproducir trafico MQTT")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("record")
+    r.add_argument("file")
+    r.add_argument("--topic", default="#")
+    r.add_argument("--fleet", help="grabar un topico de todas las placas, ej: /temperatura -> /devices/+/temperatura")
+    r.add_argument("--seconds", type=float, default=0, help="0 = hasta Ctrl+C")
+    r.add_argument("--shared-group", help="suscripcion compartida $share/<grupo>/<topico>")
+    p = sub.add_parser("replay")
+    p.add_argument("file")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=1883)
+    p.add_argument("--tls", action="store_true")
+    p.add_argument("--speed", type=float, default=1.0, help="1 = tiempo real, 10 = 10x, 0 = lo mas rapido posible")
+    p.add_argument("--qos", type=int, default=1, choices=[0, 1])
+    p.add_argument("--drain", type=float, default=3.0, help="segundos sin progreso para dar por terminado")
+    args = parser.parse_args()
+    if args.cmd == "record":
+        record(args)
+    else:
+        replay(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+import os
+import time
+import threading
+from array import array
+
+import memoria
+
+np = None
+if not memoria.LOW_MEMORY:
+    try:
+        import numpy as np
+    except Exception:
+        np = None
+
+import codec
+import topicos
+from conexionMqtt import MqttConnection
+
+# Resoluciones de los rollups (segundos, cantidad de buckets que se guardan)
+DEFAULT_ROLLUPS = [(60, 1440), (600, 1008), (3600, 720)]
+
+# Canal -> muestras crudas que se guardan
+DEFAULT_CHANNELS = {
+    "temperature": 720,
+    "humidity": 720,
+    "soil": 720,
+    "distance": 3000,
+}
+
+
+def _zeros(n):
+    if np is not None:
+        return np.zeros(n, dtype=np.float64)
+    return array("d", bytes(8 * n))
+
+
+class Level:
+    """Buffer circular de tamano fijo con columnas ts/min/max/sum/count"""
+
+    def __init__(self, capacity, resolution=0):
+        self.capacity = capacity
+        self.resolution = resolution
+        self.ts = _zeros(capacity)
+        self.vmin = _zeros(capacity)
+        self.vmax = _zeros(capacity)
+        self.vsum = _zeros(capacity)
+        self.n = _zeros(capacity)
+        self.head = 0
+        self.count = 0
+        # Registros agregados desde que empezo el bucket abierto del nivel superior
+        self.pending = 0
+
+    def nbytes(self):
+        return 5 * 8 * self.capacity
+
+    def append(self, ts, vmin, vmax, vsum, n):
+        i = self.head
+        self.ts[i] = ts
+        self.vmin[i] = vmin
+        self.vmax[i] = vmax
+        self.vsum[i] = vsum
+        self.n[i] = n
+        self.head = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+        self.pending = min(self.pending + 1, self.count)
+
+    def _indices(self, k):
+        """Indices de los ultimos k registros en orden cronologico"""
+        k = min(k, self.count)
+        start = (self.head - k) % self.capacity
+        if np is not None:
+            return (start + np.arange(k)) % self.capacity
+        return [(start + j) % self.capacity for j in range(k)]
+
+    def reduce_pending(self):
+        """Agregar los registros pendientes (min, max, sum, count)"""
+        idx = self._indices(self.pending)
+        if np is not None:
+            return (float(self.vmin[idx].min()), float(self.vmax[idx].max()),
+                    float(self.vsum[idx].sum()), float(self.n[idx].sum()))
+        return (min(self.vmin[i] for i in idx), max(self.vmax[i] for i in idx),
+                sum(self.vsum[i] for i in idx), sum(self.n[i] for i in idx))
+
+    def last(self, limit, since=None):
+        idx = self._indices(limit if limit else self.count)
+        if np is not None:
+            ts = self.ts[idx]
+            if since is not None:
+                idx = idx[ts >= since]
+                ts = self.ts[idx]
+            n = self.n[idx]
+            mean = np.divide(self.vsum[idx], n, out=np.zeros(len(idx)), where=n > 0)
+            return {"t": ts.tolist(), "min": self.vmin[idx].tolist(),
+                    "max": self.vmax[idx].tolist(), "mean": mean.tolist()}
+        if since is not None:
+            idx = [i for i in idx if self.ts[i] >= since]
+        return {"t": [self.ts[i] for i in idx],
+                "min": [self.vmin[i] for i in idx],
+                "max": [self.vmax[i] for i in idx],
+                "mean": [self.vsum[i] / self.n[i] if self.n[i] else 0.0 for i in idx]}
+
+
+class SensorChannel:
+    def __init__(self, name, raw_capacity, rollups=None):
+        self.name = name
+        self.raw = Level(raw_capacity)
+        self.levels = [self.raw] + [Level(cap, res) for res, cap in (rollups or DEFAULT_ROLLUPS)]
+        # Inicio del bucket abierto de cada rollup
+        self.bucket_start = [None] * len(self.levels)
+        self.lock = threading.Lock()
+
+    def nbytes(self):
+        return sum(level.nbytes() for level in self.levels)
+
+    def record(self, value, ts=None):
+        ts = time.time() if ts is None else ts
+        value = float(value)
+        with self.lock:
+            for i in range(1, len(self.levels)):
+                self._roll(i, ts)
+            self.raw.append(ts, value, value, value, 1)
+
+    def _roll(self, i, ts):
+        """Cerrar el bucket del nivel i si ts ya cae en uno nuevo"""
+        level = self.levels[i]
+        start = ts - (ts % level.resolution)
+        current = self.bucket_start[i]
+        if current is None:
+            self.bucket_start[i] = start
+            return
+        if start == current:
+            return
+        child = self.levels[i - 1]
+        if child.pending:
+            vmin, vmax, vsum, n = child.reduce_pending()
+            level.append(current, vmin, vmax, vsum, n)
+            child.pending = 0
+        self.bucket_start[i] = start
+
+    def query(self, resolution=0, limit=60, since=None):
+        with self.lock:
+            for level in self.levels:
+                if level.resolution == resolution:
+                    return level.last(limit, since)
+        return None
+
+
+class SensorHistory:
+    def __init__(self, channels=None, rollups=None):
+        self.rollups = rollups
+        self.channels = {}
+        for name, cap in (channels or DEFAULT_CHANNELS).items():
+            self.channels[name] = SensorChannel(name, max(1, int(cap * memoria.HISTORY_SCALE)), rollups)
+
+    def add_channel(self, name, capacity, rollups=None):
+        if name not in self.channels:
+            self.channels[name] = SensorChannel(name, max(1, int(capacity * memoria.HISTORY_SCALE)),
+                                                rollups or self.rollups)
+        return self.channels[name]
+
+    def record(self, channel, value, ts=None):
+        ch = self.channels.get(channel)
+        if ch is not None and value is not None:
+            ch.record(value, ts)
+
+    def query(self, channel, resolution=0, limit=60, since=None):
+        ch = self.channels.get(channel)
+        if ch is None:
+            return None
+        return ch.query(resolution, limit, since)
+
+    def resolutions(self):
+        for ch in self.channels.values():
+            return [level.resolution for level in ch.levels]
+        return []
+
+    def nbytes(self):
+        return sum(ch.nbytes() for ch in self.channels.values())
+
+
+# Historial compartido por todos los servicios del proceso
+history = SensorHistory()
+
+
+def record(channel, value, ts=None):
+    history.record(channel, value, ts)
+
+
+class HistoryService:
+    """Responde consultas de historial por MQTT (/history/request -> /history/response)"""
+
+    def __init__(self, store=None):
+        self.store = store or history
+        self.mqtt_host = os.environ.get("MQTT_HOST", "9a9751de0a5f4cf48ef00e50f9450e27.s1.eu.hivemq.cloud")
+        self.mqtt_port = int(os.environ.get("MQTT_PORT", "8883"))
+        self.mqtt_user = os.environ.get("MQTT_USERNAME", "isaac")
+        self.mqtt_pass = os.environ.get("MQTT_PASSWORD", "ArquiGrupo4")
+        self.mqtt_client_id = topicos.client_id("raspberry-pi-history")
+        self.request_topic = topicos.topic("/history/request")
+        self.response_topic = topicos.topic("/history/response")
+        self.client = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _on_message(self, client, userdata, msg):
+        try:
+            req = codec.loads(msg.payload)
+        except Exception:
+            return
+        if not isinstance(req, dict):
+            return
+        client.publish(req.get("reply_to") or self.response_topic, codec.dumps(self.handle_request(req)))
+
+    def handle_request(self, req):
+        channel = req.get("channel")
+        try:
+            resolution = int(req.get("resolution", 0))
+            limit = int(req.get("limit", 60))
+            since = req.get("since")
+            since = float(since) if since is not None else None
+        except (TypeError, ValueError):
+            return {"ok": False, "error": "bad request", "correlation_id": req.get("correlation_id")}
+        t0 = time.perf_counter()
+        data = self.store.query(channel, resolution, limit, since)
+        elapsed_us = (time.perf_counter() - t0) * 1e6
+        if data is None:
+            return {"ok": False, "error": "unknown channel or resolution", "channel": channel,
+                    "resolutions": self.store.resolutions(), "correlation_id": req.get("correlation_id")}
+        return {"ok": True, "channel": channel, "resolution": resolution, "data": data,
+                "query_us": round(elapsed_us, 1), "correlation_id": req.get("correlation_id")}
+
+    def loop(self):
+        conn = MqttConnection(self.mqtt_client_id, self.mqtt_host, self.mqtt_port,
+                              self.mqtt_user, self.mqtt_pass,
+                              subscriptions=[(self.request_topic, 0)], on_message=self._on_message)
+        conn.start()
+        self.client = conn.client
+        print("Sensor history: {} KB reservados".format(self.store.nbytes() // 1024))
+        try:
+            self._stop.wait()
+        finally:
+            conn.stop()
+
+    def start(self):
+        self._stop.clear()
+        t = threading.Thread(target=self.loop, daemon=True)
+        t.start()
+        self._thread = t
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
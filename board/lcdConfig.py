@@ -1,8 +1,7 @@
 import os
 import time
-import json
+import itertools
 import threading
-import queue
 
 try:
     from LCD import LCD as RawLCD
@@ -14,7 +13,94 @@ try:
 except Exception:
     CharLCD = None
 
-import paho.mqtt.client as mqtt
+import codec
+import topicos
+from conexionMqtt import MqttConnection
+
+# Prioridad (menor = mas urgente) y vigencia en segundos por tipo de evento
+PRIORITY_ALERT = 0
+PRIORITY_ROUTINE = 1
+EVENT_TTL = {"/alerts": 60.0}
+DEFAULT_TTL = 15.0
+
+# Marquesina para textos de mas de 16 caracteres
+LCD_COLS = 16
+MARQUEE_STEP = 0.3  # segundos por columna
+MARQUEE_MIN = 6.0   # tiempo minimo en pantalla de un evento
+
+
+class DisplayQueue:
+    """Cola de eventos para la pantalla: un solo evento pendiente por clave
+    (el mas nuevo reemplaza al anterior), las alertas salen primero y los
+    eventos vencidos se descartan antes de mostrarse. La memoria queda
+    acotada por `maxsize` claves distintas."""
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        # Sube con cada evento o aviso; la pantalla duerme hasta que cambie
+        self.version = 0
+        self._pending = {}
+        self._seq = itertools.count()
+        self.coalesced = 0
+        self.expired = 0
+        self.dropped = 0
+
+    def put(self, key, text, priority=PRIORITY_ROUTINE, ttl=DEFAULT_TTL):
+        now = time.monotonic()
+        with self._lock:
+            if key in self._pending:
+                self.coalesced += 1
+            elif len(self._pending) >= self.maxsize:
+                self._purge(now)
+                if len(self._pending) >= self.maxsize:
+                    # Sacar el evento menos urgente y mas viejo
+                    victim = max(self._pending.items(), key=lambda kv: (kv[1][0], -kv[1][1]))[0]
+                    if self._pending[victim][0] < priority:
+                        self.dropped += 1
+                        return False
+                    del self._pending[victim]
+                    self.dropped += 1
+            self._pending[key] = (priority, next(self._seq), text, now + ttl)
+            self.version += 1
+            self._cond.notify_all()
+        return True
+
+    def wake(self):
+        """Despertar a la pantalla sin encolar nada (cambio de estado o stop)"""
+        with self._lock:
+            self.version += 1
+            self._cond.notify_all()
+
+    def wait(self, version, timeout=None):
+        """Bloquear hasta que `version` cambie o pase `timeout`"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.version != version, timeout)
+
+    def _purge(self, now):
+        for key in [k for k, e in self._pending.items() if e[3] <= now]:
+            del self._pending[key]
+            self.expired += 1
+
+    def get_nowait(self):
+        """(prioridad, texto) del evento mas urgente y mas antiguo, o None"""
+        with self._lock:
+            self._purge(time.monotonic())
+            if not self._pending:
+                return None
+            key, (priority, _, text, _) = min(self._pending.items(), key=lambda kv: kv[1][:2])
+            del self._pending[key]
+            return priority, text
+
+    def peek_priority(self):
+        with self._lock:
+            self._purge(time.monotonic())
+            return min((e[0] for e in self._pending.values()), default=None)
+
+    def __len__(self):
+        return len(self._pending)
+
 
 class LCDService:
     def __init__(self):
@@ -22,24 +108,25 @@ class LCDService:
         self.mqtt_port = int(os.environ.get("MQTT_PORT", "8883"))
         self.mqtt_user = os.environ.get("MQTT_USERNAME", "isaac")
         self.mqtt_pass = os.environ.get("MQTT_PASSWORD", "ArquiGrupo4")
-        self.mqtt_client_id = os.environ.get("MQTT_CLIENT_ID", "raspberry-lcd")
-        self.topics = [
-            ("/temperatura", 0),
-            ("/humedad_aire", 0),
-            ("/humedad_suelo", 0),
-            ("/ilumination", 0),
-            ("/pump", 0),
-            ("/entrance", 0),
-            ("/alerts", 0),
-            ("/fan", 0),
-        ]
+        self.mqtt_client_id = topicos.client_id("raspberry-lcd")
+        self.topics = topicos.subscriptions([
+            "/temperatura",
+            "/humedad_aire",
+            "/humedad_suelo",
+            "/ilumination",
+            "/pump",
+            "/entrance",
+            "/alerts",
+            "/fan",
+        ], 0)
         self.state = {"temp": None, "hum": None}
-        self.event_q = queue.Queue(maxsize=10)
+        self.event_q = DisplayQueue()
         self.lcd = None
         self.lcd_type = None
         self._make_lcd()
         self._stop = threading.Event()
         self._threads = []
+        self._marquee = None
 
     def _make_lcd(self):
         if RawLCD is not None:
@@ -90,9 +177,53 @@ class LCDService:
             except Exception:
                 pass
 
-    def on_connect(self, client, userdata, flags, rc, properties=None):
-        for t, q in self.topics:
-            client.subscribe(t, qos=q)
+    def marquee_start(self, line1, text):
+        """Mostrar `text` desplazandose en la linea 2; devuelve segundos por vuelta.
+
+        En el LCD propio el texto se carga en la DDRAM de 40 columnas en tramos
+        de 24 caracteres seguidos de 16 espacios y se desplaza con el comando
+        display shift (un byte por paso). El tramo siguiente se carga cuando la
+        ventana visible esta sobre los espacios, asi el cambio no se ve. El
+        shift mueve las dos lineas, por eso la linea 1 se repite cada 20
+        columnas. Con RPLCD se reescribe la ventana de 16 en cada paso."""
+        gap = " " * LCD_COLS
+        if self.lcd_type == "raw" and hasattr(self.lcd, "shift"):
+            chunk = self.lcd.LCD_DDRAM_WIDTH - LCD_COLS
+            pages = [text[i:i + chunk] for i in range(0, len(text), chunk)]
+            try:
+                self.lcd.clear()
+                self.lcd.load(line1[:LCD_COLS].ljust(20) * 2, 1)
+                self.lcd.load(pages[0].ljust(chunk) + gap, 2)
+            except Exception:
+                return MARQUEE_MIN
+            self._marquee = {"pages": pages, "page": 0, "pos": 0, "chunk": chunk}
+            return self.lcd.LCD_DDRAM_WIDTH * len(pages) * MARQUEE_STEP
+        if self.lcd is None:
+            print("LCD | " + line1[:LCD_COLS].ljust(LCD_COLS) + " | " + text)
+            return MARQUEE_MIN
+        self._marquee = {"text": text + gap, "pos": 0, "line1": line1}
+        self.write(line1, text)
+        return len(text + gap) * MARQUEE_STEP
+
+    def marquee_step(self):
+        m = self._marquee
+        if m is None:
+            return
+        m["pos"] += 1
+        if "pages" in m:
+            try:
+                self.lcd.shift()
+                if m["pos"] == m["chunk"] and len(m["pages"]) > 1:
+                    # Ventana sobre los espacios: cargar el tramo siguiente
+                    m["page"] = (m["page"] + 1) % len(m["pages"])
+                    self.lcd.load(m["pages"][m["page"]].ljust(m["chunk"]) + " " * LCD_COLS, 2)
+                m["pos"] %= self.lcd.LCD_DDRAM_WIDTH
+            except Exception:
+                pass
+            return
+        text = m["text"]
+        pos = m["pos"] % len(text)
+        self.write(m["line1"], (text[pos:] + text[:pos])[:LCD_COLS])
 
     def handle_event(self, topic, payload):
         if topic == "/temperatura":
@@ -125,55 +256,76 @@ class LCDService:
             return "Entrada " + str(a).upper()
         if topic == "/alerts":
             m = payload.get("message") or payload.get("type") or "ALERTA"
-            return str(m)[:16]
+            return str(m)
         return None
 
     def on_message(self, client, userdata, msg):
         try:
-            payload = json.loads(msg.payload.decode())
+            payload = codec.loads(msg.payload)
         except Exception:
             payload = {}
-        evt = self.handle_event(msg.topic, payload)
+        topic = topicos.local(msg.topic)
+        evt = self.handle_event(topic, payload)
         if evt:
-            try:
-                self.event_q.put_nowait(evt)
-            except queue.Full:
-                pass
+            key = topic
+            if topic == "/ilumination":
+                key += "/" + str(payload.get("room") or payload.get("location") or "")
+            priority = PRIORITY_ALERT if topic == "/alerts" else PRIORITY_ROUTINE
+            self.event_q.put(key, evt, priority, EVENT_TTL.get(topic, DEFAULT_TTL))
+        else:
+            # Temperatura / humedad cambian la primera linea
+            self.event_q.wake()
 
     def mqtt_loop(self):
-        client = mqtt.Client(client_id=self.mqtt_client_id)
-        client.username_pw_set(self.mqtt_user, self.mqtt_pass)
-        client.tls_set()
-        client.on_connect = self.on_connect
-        client.on_message = self.on_message
-        client.connect(self.mqtt_host, self.mqtt_port, keepalive=60)
-        client.loop_start()
-        while not self._stop.is_set():
-            time.sleep(0.5)
-        client.loop_stop()
-        try:
-            client.disconnect()
-        except Exception:
-            pass
+        conn = MqttConnection(self.mqtt_client_id, self.mqtt_host, self.mqtt_port,
+                              self.mqtt_user, self.mqtt_pass,
+                              subscriptions=self.topics, on_message=self.on_message)
+        conn.start()
+        self._stop.wait()
+        conn.stop()
 
     def display_loop(self):
         last = None
+        last_priority = None
         until = 0.0
+        shown = None
+        next_step = None
         while not self._stop.is_set():
-            now = time.time()
-            if last and now < until:
-                line1 = "{}C {}%".format(self.state["temp"] if self.state["temp"] is not None else "--", self.state["hum"] if self.state["hum"] is not None else "--")
-                self.write(line1, last)
-            else:
-                try:
-                    last = self.event_q.get_nowait()
-                    until = time.time() + 6.0
-                except queue.Empty:
-                    line1 = "{}C {}%".format(self.state["temp"] if self.state["temp"] is not None else "--", self.state["hum"] if self.state["hum"] is not None else "--")
-                    self.write(line1, "Estado")
-                    time.sleep(1.0)
-                    continue
-            time.sleep(0.5)
+            version = self.event_q.version
+            now = time.monotonic()
+            # Una alerta pendiente interrumpe al evento rutinario en pantalla
+            pending = self.event_q.peek_priority()
+            if last and (now >= until or (pending is not None and pending < last_priority)):
+                last = None
+            if last is None:
+                evt = self.event_q.get_nowait()
+                if evt is not None:
+                    last_priority, last = evt
+                    until = now + MARQUEE_MIN
+            line1 = "{}C {}%".format(self.state["temp"] if self.state["temp"] is not None else "--", self.state["hum"] if self.state["hum"] is not None else "--")
+            screen = (line1, last or "Estado")
+            if next_step is not None and shown[1] == screen[1]:
+                # Marquesina en curso: la linea 1 se actualiza al terminar
+                if now >= next_step:
+                    self.marquee_step()
+                    next_step += MARQUEE_STEP
+            elif screen != shown:
+                self._marquee = None
+                next_step = None
+                if len(screen[1]) > LCD_COLS:
+                    until = now + max(MARQUEE_MIN, self.marquee_start(*screen))
+                    if self._marquee is not None:
+                        next_step = now + MARQUEE_STEP
+                else:
+                    self.write(*screen)
+                shown = screen
+            # Dormir hasta un evento nuevo, un cambio de estado, el proximo paso
+            # de la marquesina, el fin del evento en pantalla o stop
+            timeout = until - now if last else None
+            if next_step is not None:
+                step = max(0.0, next_step - now)
+                timeout = step if timeout is None else min(timeout, step)
+            self.event_q.wait(version, timeout)
 
     def start(self):
         self._stop.clear()
@@ -185,6 +337,7 @@ class LCDService:
 
     def stop(self):
         self._stop.set()
+        self.event_q.wake()
         for t in self._threads:
             t.join(timeout=2)
         try:
@@ -197,8 +350,7 @@ def main():
     svc = LCDService()
     try:
         svc.start()
-        while True:
-            time.sleep(2.0)
+        svc._stop.wait()
     except KeyboardInterrupt:
         pass
     finally:
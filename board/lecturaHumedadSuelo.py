@@ -1,6 +1,5 @@
 import os
 import time
-import json
 import threading
 
 try:
@@ -8,57 +7,277 @@ try:
 except Exception:
     GPIO = None
 
-import paho.mqtt.client as mqtt
+try:
+    import spidev
+except Exception:
+    spidev = None
+
+import memoria
+
+np = None
+if not memoria.LOW_MEMORY:
+    try:
+        import numpy as np
+    except Exception:
+        np = None
+
+from conexionMqtt import MqttConnection
+
+import codec
+import estadoPlaca
+import historialSensores
+import planificador
+import telemetria
+import topicos
+
+class MCP3008:
+    """ADC MCP3008 por SPI (10 bits, 8 canales)"""
+
+    def __init__(self, channel=0, bus=0, device=0, speed_hz=1000000):
+        self.channel = channel
+        self.spi = spidev.SpiDev()
+        self.spi.open(bus, device)
+        self.spi.max_speed_hz = speed_hz
+        self.spi.mode = 0
+        # Start bit, single-ended + canal, relleno para el resultado
+        self._cmd = [0x01, (0x08 | channel) << 4, 0x00]
+
+    def read_burst(self, n):
+        """n conversiones seguidas -> lista de respuestas de 3 bytes.
+
+        El MCP3008 necesita que CS suba entre conversiones, asi que cada
+        muestra es su propio xfer2 de 3 bytes; la rafaga corre sin pausas y el
+        decodificado se hace despues, de una vez, en raw_counts()."""
+        xfer = self.spi.xfer2
+        cmd = self._cmd
+        return [xfer(list(cmd)) for _ in range(n)]
+
+    def close(self):
+        try:
+            self.spi.close()
+        except Exception:
+            pass
+
+
+def raw_counts(frames):
+    """Respuestas de 3 bytes -> cuentas de 10 bits"""
+    if np is not None:
+        a = np.asarray(frames, dtype=np.uint16).reshape(-1, 3)
+        return ((a[:, 1] & 0x03) << 8) | a[:, 2]
+    return [((f[1] & 0x03) << 8) | f[2] for f in frames]
+
+
+def robust_mean(samples):
+    """Media del 50% central de las muestras (descarta picos de ruido)"""
+    if np is not None:
+        a = np.sort(np.asarray(samples, dtype=np.float64))
+    else:
+        a = sorted(float(x) for x in samples)
+    n = len(a)
+    if n == 0:
+        return None
+    lo, hi = n // 4, n - n // 4
+    mid = a[lo:hi] if hi > lo else a
+    if np is not None:
+        return float(mid.mean())
+    return sum(mid) / len(mid)
+
+
+def to_percent(raw, dry, wet):
+    """Cuentas del ADC -> % de humedad segun la calibracion seco/mojado"""
+    if dry == wet:
+        return None
+    pct = 100.0 * (dry - raw) / (dry - wet)
+    return round(min(100.0, max(0.0, pct)), 1)
+
 
 class SoilPublisher:
-    def __init__(self, period=5.0, pin=26):
+    def __init__(self, period=5.0, pin=26, mode=None, debounce_ms=50, heartbeat=60.0,
+                 reader=None, client_id=None, topic_prefix=None, verbose=True,
+                 adc_channel=None, oversample=None, dry_raw=None, wet_raw=None):
         self.period = period
         self.pin = pin
+        # reader() -> 0/1; por defecto GPIO.input(pin)
+        self.reader = reader
+        # Prefijo de placa (/devices/<BOARD_ID>) salvo que se indique otro
+        self.topic_prefix = topicos.prefix() if topic_prefix is None else topic_prefix
+        self.verbose = verbose
+        # "poll" lee el pin cada `period`; "edge" usa interrupciones del GPIO;
+        # "analog" lee la sonda por un MCP3008 y publica un porcentaje
+        self.mode = (mode or os.environ.get("SOIL_MODE", "poll")).lower()
+        self.adc_channel = int(os.environ.get("SOIL_ADC_CHANNEL", "0")) if adc_channel is None else adc_channel
+        self.oversample = int(os.environ.get("SOIL_OVERSAMPLE", "64")) if oversample is None else oversample
+        # Calibracion: cuentas con la sonda al aire (seco) y en agua (mojado)
+        self.dry_raw = float(os.environ.get("SOIL_ADC_DRY", "800")) if dry_raw is None else dry_raw
+        self.wet_raw = float(os.environ.get("SOIL_ADC_WET", "350")) if wet_raw is None else wet_raw
+        # Por debajo de este % se reporta "seco" (mismo default que PUMP_DRY_THRESHOLD)
+        self.dry_percent = float(os.environ.get("SOIL_DRY_PERCENT", "30"))
+        self.debounce = debounce_ms / 1000.0
+        self.heartbeat = heartbeat
         self.mqtt_host = os.environ.get("MQTT_HOST", "9a9751de0a5f4cf48ef00e50f9450e27.s1.eu.hivemq.cloud")
         self.mqtt_port = int(os.environ.get("MQTT_PORT", "8883"))
         self.mqtt_user = os.environ.get("MQTT_USERNAME", "isaac")
         self.mqtt_pass = os.environ.get("MQTT_PASSWORD", "ArquiGrupo4")
-        self.mqtt_client_id = os.environ.get("MQTT_CLIENT_ID", "raspberry-pi-soil-sensor")
+        self.mqtt_client_id = client_id or topicos.client_id("raspberry-pi-soil-sensor")
+        self.status_template = codec.StatusTemplate({"pin": "GPIO{}".format(pin)})
+        self.analog_template = codec.StatusTemplate({"pin": "CH{}".format(self.adc_channel), "device": "MCP3008"})
         self._stop = threading.Event()
+        self._edge = threading.Event()
         self._thread = None
 
-    def loop(self):
-        if GPIO is None:
-            print("GPIO not available")
+    def _publish(self, client, v):
+        historialSensores.record("soil", int(v))
+        state = "seco" if int(v) == 1 else "humedo"
+        estadoPlaca.update("soil", state)
+        try:
+            telemetria.emit(client, self.topic_prefix + "/humedad_suelo", {"soil_moisture_digital": int(v), "state": state}, template=self.status_template)
+            if self.verbose:
+                print("Soil {} ({})".format(int(v), state))
+        except Exception:
+            pass
+
+    def _publish_percent(self, client, percent, raw):
+        historialSensores.record("soil", percent)
+        state = "seco" if percent < self.dry_percent else "humedo"
+        estadoPlaca.update("soil", {"state": state, "percent": percent})
+        try:
+            telemetria.emit(client, self.topic_prefix + "/humedad_suelo",
+                            {"percent": percent, "raw": round(raw, 1), "state": state},
+                            template=self.analog_template)
+            if self.verbose:
+                print("Soil {:.1f}% (raw {:.1f}, {})".format(percent, raw, state))
+        except Exception:
+            pass
+
+    def _make_adc(self):
+        if spidev is None:
+            return None
+        try:
+            return MCP3008(self.adc_channel)
+        except Exception as e:
+            print("MCP3008 not available: {}".format(e))
+            return None
+
+    def _analog_tick(self, client, adc):
+        try:
+            if self.reader is not None:
+                samples = self.reader()
+                if not isinstance(samples, (list, tuple)):
+                    samples = [samples]
+            else:
+                samples = raw_counts(adc.read_burst(self.oversample))
+            raw = robust_mean(samples)
+        except Exception:
+            return
+        if raw is not None:
+            percent = to_percent(raw, self.dry_raw, self.wet_raw)
+            if percent is not None:
+                self._publish_percent(client, percent, raw)
+
+    def _on_edge(self, channel):
+        # Se ejecuta en el hilo de interrupciones de RPi.GPIO: solo despertar al loop
+        self._edge.set()
+
+    def _read_stable(self):
+        """Leer el pin hasta que se mantenga igual durante la ventana de debounce"""
+        v = GPIO.input(self.pin)
+        while not self._stop.is_set():
+            self._edge.clear()
+            if self._edge.wait(self.debounce):
+                v = GPIO.input(self.pin)
+                continue
+            nv = GPIO.input(self.pin)
+            if nv == v:
+                return v
+            v = nv
+        return v
+
+    def _poll_tick(self, client):
+        try:
+            v = self._read()
+        except Exception:
+            return
+        self._publish(client, v)
+
+    def _periodic(self, fn):
+        """Correr fn() en el planificador cada `period` hasta stop"""
+        task = planificador.every("soil:" + self.mqtt_client_id, self.period, fn)
+        try:
+            self._stop.wait()
+        finally:
+            task.cancel()
+
+    def _edge_loop(self, client):
+        try:
+            GPIO.add_event_detect(self.pin, GPIO.BOTH, callback=self._on_edge)
+        except Exception as e:
+            print("Edge detection not available ({}), using poll".format(e))
+            self._periodic(lambda: self._poll_tick(client))
             return
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.pin, GPIO.IN)
-        client = mqtt.Client(client_id=self.mqtt_client_id)
-        client.username_pw_set(self.mqtt_user, self.mqtt_pass)
-        client.tls_set()
-        client.connect(self.mqtt_host, self.mqtt_port, 60)
-        client.loop_start()
+        last = None
+        last_pub = 0.0
         try:
             while not self._stop.is_set():
                 try:
-                    v = GPIO.input(self.pin)
+                    v = self._read_stable()
                 except Exception:
-                    time.sleep(self.period)
+                    self._stop.wait(self.period)
                     continue
-                state = "seco" if int(v) == 1 else "humedo"
-                data = {"soil_moisture_digital": int(v), "state": state, "pin": "GPIO{}".format(self.pin)}
-                try:
-                    client.publish("/humedad_suelo", json.dumps(data))
-                    print("Soil {} ({})".format(int(v), state))
-                except Exception:
-                    pass
-                time.sleep(self.period)
+                now = time.time()
+                if v != last or now - last_pub >= self.heartbeat:
+                    self._publish(client, v)
+                    last = v
+                    last_pub = now
+                self._edge.wait(max(0.0, self.heartbeat - (time.time() - last_pub)))
         finally:
             try:
-                GPIO.cleanup()
-            except Exception:
-                pass
-            try:
-                client.loop_stop()
-                client.disconnect()
+                GPIO.remove_event_detect(self.pin)
             except Exception:
                 pass
 
+    def _read(self):
+        if self.reader is not None:
+            return self.reader()
+        return GPIO.input(self.pin)
+
+    def _make_connection(self):
+        return MqttConnection(self.mqtt_client_id, self.mqtt_host, self.mqtt_port,
+                              self.mqtt_user, self.mqtt_pass)
+
+    def loop(self):
+        adc = None
+        if self.mode == "analog":
+            if self.reader is None:
+                adc = self._make_adc()
+                if adc is None:
+                    print("SPI ADC not available")
+                    return
+        elif self.reader is None:
+            if GPIO is None:
+                print("GPIO not available")
+                return
+            GPIO.setmode(GPIO.BCM)
+            GPIO.setup(self.pin, GPIO.IN)
+        conn = self._make_connection()
+        conn.start()
+        client = conn.client
+        try:
+            if self.mode == "analog":
+                self._periodic(lambda: self._analog_tick(client, adc))
+            elif self.mode == "edge" and self.reader is None:
+                self._edge_loop(client)
+            else:
+                self._periodic(lambda: self._poll_tick(client))
+        finally:
+            if adc is not None:
+                adc.close()
+            elif self.reader is None:
+                try:
+                    GPIO.cleanup()
+                except Exception:
+                    pass
+            conn.stop()
+
     def start(self):
         self._stop.clear()
         t = threading.Thread(target=self.loop, daemon=True)
@@ -67,6 +286,7 @@ class SoilPublisher:
 
     def stop(self):
         self._stop.set()
+        self._edge.set()
         if self._thread:
             self._thread.join(timeout=2)
 
@@ -74,8 +294,7 @@ def main():
     svc = SoilPublisher()
     try:
         svc.start()
-        while True:
-            time.sleep(2.0)
+        svc._stop.wait()
     except KeyboardInterrupt:
         pass
     finally:
@@ -1,6 +1,5 @@
 import os
 import time
-import json
 import threading
 from datetime import datetime
 
@@ -11,56 +10,80 @@ except Exception:
     board = None
     adafruit_dht = None
 
-import paho.mqtt.client as mqtt
+from conexionMqtt import MqttConnection
+
+import codec
+import estadoPlaca
+import historialSensores
+import planificador
+import telemetria
+import topicos
 
 class DHTPublisher:
-    def __init__(self, period=5.0):
+    def __init__(self, period=5.0, reader=None, client_id=None, topic_prefix=None, verbose=True):
         self.period = period
+        # reader() -> (temperatura, humedad); por defecto el DHT11 en D27
+        self.reader = reader
+        # Prefijo de placa (/devices/<BOARD_ID>) salvo que se indique otro
+        self.topic_prefix = topicos.prefix() if topic_prefix is None else topic_prefix
+        self.verbose = verbose
         self.mqtt_host = os.environ.get("MQTT_HOST", "9a9751de0a5f4cf48ef00e50f9450e27.s1.eu.hivemq.cloud")
         self.mqtt_port = int(os.environ.get("MQTT_PORT", "8883"))
         self.mqtt_user = os.environ.get("MQTT_USERNAME", "isaac")
         self.mqtt_pass = os.environ.get("MQTT_PASSWORD", "ArquiGrupo4")
-        self.mqtt_client_id = os.environ.get("MQTT_CLIENT_ID", "raspberry-pi-sensor")
+        self.mqtt_client_id = client_id or topicos.client_id("raspberry-pi-sensor")
+        self.temp_template = codec.StatusTemplate({"location": "interior", "device": "DHT11", "pin": "D27", "connected": True})
+        self.hum_template = codec.StatusTemplate({"location": "interior", "device": "DHT11", "pin": "27", "connected": True})
         self.client = None
         self._stop = threading.Event()
         self._thread = None
 
-    def loop(self):
+    def _make_reader(self):
+        if self.reader is not None:
+            return self.reader
         if board is None or adafruit_dht is None:
+            return None
+        dht = adafruit_dht.DHT11(board.D27)
+        return lambda: (dht.temperature, dht.humidity)
+
+    def _make_connection(self):
+        return MqttConnection(self.mqtt_client_id, self.mqtt_host, self.mqtt_port,
+                              self.mqtt_user, self.mqtt_pass)
+
+    def loop(self):
+        read = self._make_reader()
+        if read is None:
             print("DHT libs not available")
             return
-        dht = adafruit_dht.DHT11(board.D27)
-        client = mqtt.Client(client_id=self.mqtt_client_id)
-        client.username_pw_set(self.mqtt_user, self.mqtt_pass)
-        client.tls_set()
-        client.connect(self.mqtt_host, self.mqtt_port, 60)
-        client.loop_start()
-        self.client = client
+        conn = self._make_connection()
+        conn.start()
+        self.client = conn.client
+        task = planificador.every("dht:" + self.mqtt_client_id, self.period, lambda: self._tick(read))
         try:
-            while not self._stop.is_set():
-                try:
-                    t = dht.temperature
-                    h = dht.humidity
-                except Exception as e:
-                    time.sleep(self.period)
-                    continue
-                if t is not None and h is not None:
-                    ts = datetime.now().isoformat()
-                    temp_data = {"temperature": float(t), "location": "interior", "timestamp": ts, "device": "DHT11", "pin": "D27", "connected": True}
-                    hum_data = {"humidity": float(h), "location": "interior", "timestamp": ts, "device": "DHT11", "pin": "27", "connected": True}
-                    try:
-                        client.publish("/temperatura", json.dumps(temp_data))
-                        client.publish("/humedad_aire", json.dumps(hum_data))
-                        print("Temp {:.1f}C Hum {:.1f}%".format(t, h))
-                    except Exception:
-                        pass
-                time.sleep(self.period)
+            self._stop.wait()
         finally:
-            try:
-                client.loop_stop()
-                client.disconnect()
-            except Exception:
-                pass
+            task.cancel()
+            conn.stop()
+
+    def _tick(self, read):
+        try:
+            t, h = read()
+        except Exception:
+            return
+        if t is None or h is None:
+            return
+        historialSensores.record("temperature", t)
+        historialSensores.record("humidity", h)
+        estadoPlaca.update("temperature", float(t))
+        estadoPlaca.update("humidity", float(h))
+        ts = datetime.now().isoformat()
+        try:
+            telemetria.emit(self.client, self.topic_prefix + "/temperatura", {"temperature": float(t), "timestamp": ts}, template=self.temp_template)
+            telemetria.emit(self.client, self.topic_prefix + "/humedad_aire", {"humidity": float(h), "timestamp": ts}, template=self.hum_template)
+            if self.verbose:
+                print("Temp {:.1f}C Hum {:.1f}%".format(t, h))
+        except Exception:
+            pass
 
     def start(self):
         self._stop.clear()
@@ -73,12 +96,147 @@ class DHTPublisher:
         if self._thread:
             self._thread.join(timeout=2)
 
+def parse_sensors(spec):
+    """"interior:D27:DHT11,cocina:D17:DHT22" -> [{location, pin, model}]"""
+    sensors = []
+    for item in spec.split(","):
+        parts = item.strip().split(":")
+        if len(parts) < 2 or not parts[0]:
+            continue
+        sensors.append({"location": parts[0], "pin": parts[1], "model": parts[2] if len(parts) > 2 else "DHT11"})
+    return sensors
+
+
+class MultiDHTPublisher(DHTPublisher):
+    """Varios DHT con una sola conexion MQTT.
+
+    Cada sensor es una tarea del planificador con su propio periodo; las
+    lecturas corren en un pool chico de workers propio, asi una lectura lenta
+    no demora a las demas tareas de la placa. Cada sensor tiene como mucho una
+    lectura en curso y un plazo (`read_timeout`): si no termina a tiempo se
+    cuenta como vencida y el resultado tardio se descarta. Un sensor colgado
+    ocupa a lo sumo un worker."""
+
+    def __init__(self, sensors=None, period=5.0, workers=None, read_timeout=None, **kwargs):
+        super().__init__(period=period, **kwargs)
+        if sensors is None:
+            sensors = parse_sensors(os.environ.get("DHT_SENSORS", "")) or \
+                [{"location": "interior", "pin": "D27", "model": "DHT11"}]
+        self.sensors = []
+        for cfg in sensors:
+            loc = cfg["location"]
+            pin = str(cfg.get("pin", ""))
+            model = cfg.get("model", "DHT11")
+            self.sensors.append({
+                "location": loc,
+                "pin": pin,
+                "model": model,
+                "period": float(cfg.get("period", period)),
+                "reader": cfg.get("reader"),
+                "temp_template": codec.StatusTemplate({"location": loc, "device": model, "pin": pin, "connected": True}),
+                "hum_template": codec.StatusTemplate({"location": loc, "device": model, "pin": pin.lstrip("D"), "connected": True}),
+                "reads": 0,
+                "failures": 0,
+                "timeouts": 0,
+                "last_ms": None,
+            })
+            for channel in ("temperature", "humidity"):
+                historialSensores.history.add_channel("{}.{}".format(channel, loc),
+                                                      historialSensores.DEFAULT_CHANNELS[channel])
+        self.workers = workers or int(os.environ.get("DHT_WORKERS", "0")) or min(4, len(self.sensors))
+        self.read_timeout = read_timeout or float(os.environ.get("DHT_READ_TIMEOUT", "3.0"))
+        self._lock = threading.Lock()
+
+    def _make_sensor_reader(self, sensor):
+        if sensor["reader"] is not None:
+            return sensor["reader"]
+        if board is None or adafruit_dht is None:
+            return None
+        cls = getattr(adafruit_dht, sensor["model"].upper(), None)
+        pin = getattr(board, sensor["pin"], None)
+        if cls is None or pin is None:
+            print("DHT {}: modelo {} / pin {} no soportado".format(sensor["location"], sensor["model"], sensor["pin"]))
+            return None
+        dht = cls(pin)
+        return lambda: (dht.temperature, dht.humidity)
+
+    def _read(self, sensor, read):
+        started = time.monotonic()
+        try:
+            t, h = read()
+        except Exception:
+            t, h = None, None
+        elapsed = time.monotonic() - started
+        with self._lock:
+            sensor["last_ms"] = round(elapsed * 1000, 1)
+            if elapsed > self.read_timeout:
+                # Lectura vencida: descartar el dato viejo
+                sensor["timeouts"] += 1
+                print("DHT {}: lectura vencida ({:.1f}s)".format(sensor["location"], elapsed))
+                return
+            if t is None or h is None:
+                sensor["failures"] += 1
+                return
+            sensor["reads"] += 1
+        self._publish(sensor, float(t), float(h))
+
+    def _publish(self, sensor, t, h):
+        loc = sensor["location"]
+        historialSensores.record("temperature." + loc, t)
+        historialSensores.record("humidity." + loc, h)
+        estadoPlaca.update("temperature", t, key=loc)
+        estadoPlaca.update("humidity", h, key=loc)
+        ts = datetime.now().isoformat()
+        try:
+            telemetria.emit(self.client, self.topic_prefix + "/temperatura", {"temperature": t, "timestamp": ts}, template=sensor["temp_template"])
+            telemetria.emit(self.client, self.topic_prefix + "/humedad_aire", {"humidity": h, "timestamp": ts}, template=sensor["hum_template"])
+            if self.verbose:
+                print("{}: Temp {:.1f}C Hum {:.1f}%".format(loc, t, h))
+        except Exception:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {s["location"]: {"reads": s["reads"], "failures": s["failures"], "timeouts": s["timeouts"],
+                                    "last_ms": s["last_ms"]}
+                    for s in self.sensors}
+
+    def loop(self):
+        readers = {}
+        for sensor in self.sensors:
+            read = self._make_sensor_reader(sensor)
+            if read is not None:
+                readers[sensor["location"]] = read
+        if not readers:
+            print("DHT libs not available")
+            return
+        conn = self._make_connection()
+        conn.start()
+        self.client = conn.client
+        estadoPlaca.register_metrics("dht", self.stats)
+        pool = planificador.WorkerPool(self.workers, "dht")
+        tasks = []
+        for sensor in self.sensors:
+            read = readers.get(sensor["location"])
+            if read is not None:
+                tasks.append(planificador.every("dht:" + sensor["location"], sensor["period"],
+                                                lambda sensor=sensor, read=read: self._read(sensor, read),
+                                                deadline=self.read_timeout, pool=pool))
+        try:
+            self._stop.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            # No esperar lecturas colgadas
+            pool.shutdown()
+            conn.stop()
+
+
 def main():
     svc = DHTPublisher()
     try:
         svc.start()
-        while True:
-            time.sleep(2.0)
+        svc._stop.wait()
     except KeyboardInterrupt:
         pass
     finally:
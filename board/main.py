@@ -1,9 +1,21 @@
+import os
 import argparse
-import time
+import functools
+import signal
+import threading
 
 from lcdConfig import LCDService
-from lecturaTemperatura import DHTPublisher
+from lecturaTemperatura import DHTPublisher, MultiDHTPublisher
 from lecturaHumedadSuelo import SoilPublisher
+from historialSensores import HistoryService
+import telemetria
+from estadoPlaca import BoardStateService
+import perfilador
+import apiLocal
+import puenteMqtt
+import aislamiento
+import estadoPersistente
+import memoria
 import LedRGB
 import LedsPorHabitacion
 import SensorMovimiento
@@ -21,7 +33,7 @@ def pick_class(module, candidates):
 
 RGBClass = pick_class(LedRGB, ["RGBLEDService", "LedRGBService", "RGBService"])
 RoomsClass = pick_class(LedsPorHabitacion, ["RoomLEDService", "LedsPorHabitacionService", "LedsPorHabitacion"])
-MotionClass = pick_class(SensorMovimiento, ["MotionPublisher", "MotionSensor", "SensorMovimiento"])
+MotionClass = pick_class(SensorMovimiento, ["MotionSensorService", "MotionPublisher", "MotionSensor"])
 ServoClass = pick_class(ServoControl, ["ServoService"])
 FanClass = pick_class(ventilador, ["FanService"])
 
@@ -36,36 +48,110 @@ def parse_args():
     p.add_argument("--motion", action="store_true")
     p.add_argument("--servo", action="store_true")
     p.add_argument("--fan", action="store_true")
+    p.add_argument("--history", action="store_true")
+    p.add_argument("--state", action="store_true")
+    p.add_argument("--profiler", action="store_true", help="Escuchar /admin/profile para perfilar en caliente")
+    p.add_argument("--profile-seconds", type=float, default=10.0, help="Duracion del perfil al recibir SIGUSR1")
+    p.add_argument("--api", action="store_true", default=os.environ.get("LOCAL_API", "0") == "1",
+                   help="API HTTP/WebSocket en la LAN que controla los servicios de este proceso")
+    p.add_argument("--local-broker", action="store_true", default=os.environ.get("LOCAL_BROKER", "0") == "1",
+                   help="Servicios contra un mosquitto local; solo el puente habla con la nube")
+    p.add_argument("--soil-mode", choices=["poll", "edge", "analog"], default=None)
+    p.add_argument("--isolate", default=os.environ.get("ISOLATE", ""),
+                   help="Servicios en procesos aparte, ej: motion,lcd")
+    p.add_argument("--cpu", action="append", default=[], help="Afinidad de un servicio aislado, ej: motion=3 o lcd=2,3")
+    p.add_argument("--rt", action="append", default=[], help="Prioridad SCHED_FIFO de un servicio aislado, ej: motion=50")
     return p.parse_args()
 
 
 def main():
     args = parse_args()
-    run_all = not (args.lcd or args.temp or args.soil or args.rgb or args.rooms or args.motion or args.servo or args.fan)
+    run_all = not (args.lcd or args.temp or args.soil or args.rgb or args.rooms or args.motion or args.servo or args.fan or args.history or args.state or args.profiler)
 
-    services = []
+    # (nombre, fabrica): las fabricas se pueden mandar a un proceso aparte (--isolate)
+    factories = []
+    broker = None
+    if args.local_broker:
+        broker = puenteMqtt.LocalBroker()
+        if broker.start():
+            # Antes de crear cualquier servicio: todos leen MQTT_HOST en su constructor
+            upstream = puenteMqtt.use_local_broker(broker.port)
+            factories.append(("bridge", functools.partial(puenteMqtt.MqttBridge, upstream)))
+        else:
+            print("Sin broker local: los servicios siguen conectados a la nube")
+            broker = None
+    if telemetria.MODE != "legacy":
+        factories.append(("telemetry", telemetria.TelemetryBatcher))
     if run_all or args.lcd:
-        services.append(LCDService())
+        factories.append(("lcd", LCDService))
     if run_all or args.temp:
-        services.append(DHTPublisher())
+        # DHT_SENSORS="interior:D27:DHT11,cocina:D17:DHT22" -> un publicador para todos
+        if os.environ.get("DHT_SENSORS"):
+            factories.append(("temp", MultiDHTPublisher))
+        else:
+            factories.append(("temp", DHTPublisher))
     if run_all or args.soil:
-        services.append(SoilPublisher())
+        factories.append(("soil", functools.partial(SoilPublisher, mode=args.soil_mode)))
     if (run_all or args.rgb) and RGBClass:
-        services.append(RGBClass())
+        factories.append(("rgb", RGBClass))
     if (run_all or args.rooms) and RoomsClass:
-        services.append(RoomsClass())
-    if (run_all or args.motion) and MotionClass:
-        services.append(MotionClass())
+        factories.append(("rooms", RoomsClass))
+    if run_all or args.motion:
+        # ULTRASONIC_SENSORS="entrada:23:24:25,garaje:5:6:13" -> un solo servicio para todos
+        if os.environ.get("ULTRASONIC_SENSORS"):
+            factories.append(("motion", SensorMovimiento.UltrasonicArrayService))
+        elif MotionClass:
+            factories.append(("motion", MotionClass))
     if (run_all or args.servo) and ServoClass:
-        services.append(ServoClass())
+        factories.append(("servo", ServoClass))
     if (run_all or args.fan) and FanClass:
-        services.append(FanClass())
+        factories.append(("fan", FanClass))
+    if run_all or args.history:
+        factories.append(("history", HistoryService))
+    if run_all or args.state:
+        factories.append(("state", BoardStateService))
+    if run_all or args.profiler:
+        factories.append(("profiler", perfilador.ProfilerService))
+    perfilador.install_signal(args.profile_seconds)
+
+    isolate = {name.strip() for name in args.isolate.split(",") if name.strip()}
+    cpus = aislamiento.parse_assignments(args.cpu)
+    rt = aislamiento.parse_assignments(args.rt)
+    services = []
+    names = []
+    supervisor = None
+    memory = memoria.MemoryReport()
+    for name, factory in factories:
+        if name in isolate:
+            if supervisor is None:
+                supervisor = aislamiento.Supervisor()
+            supervisor.add(name, factory, aislamiento.parse_cpus(cpus[name]) if name in cpus else None,
+                           int(rt[name]) if name in rt else None)
+        else:
+            services.append(memory.track(name, factory))
+            names.append(name)
+    if supervisor is not None:
+        # Despues del batcher: las lecturas de los workers entran a sus tramas
+        at = names.index("telemetry") + 1 if "telemetry" in names else 0
+        services.insert(at, supervisor)
+        names.insert(at, "workers")
+        memory.supervisor = supervisor
+    if args.api:
+        # Llama directo a los metodos de los servicios; los aislados responden 503
+        api = apiLocal.LocalApiService(dict(zip(names, services)))
+        services.append(api)
+        names.append("api")
 
+    # El hilo principal duerme hasta SIGINT / SIGTERM
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
     try:
-        for s in services:
-            s.start()
-        while True:
-            time.sleep(2.0)
+        for name, s in zip(names, services):
+            memory.track(name + ".start", s.start)
+        # RSS al arrancar y de nuevo pasada una hora (MEMORY_REPORT_AFTER)
+        services.append(memory)
+        memory.start()
+        stop.wait()
     except KeyboardInterrupt:
         pass
     finally:
@@ -74,6 +160,10 @@ def main():
                 s.stop()
             except Exception:
                 pass
+        if broker is not None:
+            broker.stop()
+        # Bajar a la SD el ultimo estado de los actuadores
+        estadoPersistente.state.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+"""Modo de memoria reducida (Pi Zero) y reporte de RSS.
+
+LOW_MEMORY=1 antes de arrancar main.py:
+- no se importa numpy (historial y ADC usan array / listas),
+- el historial guarda un cuarto de las muestras crudas,
+- cada cliente MQTT acota su cola de salida (MQTT_MAX_QUEUED) y los
+  mensajes QoS>0 en vuelo (MQTT_MAX_INFLIGHT).
+
+Todas las conexiones TLS comparten un solo SSLContext (con y sin este modo).
+
+MemoryReport imprime el RSS al arrancar (total y lo que sumo cada servicio al
+crearse e iniciarse) y de nuevo pasada una hora, con el RSS de cada worker
+aislado; el ultimo reporte sale en /board/metrics -> "memory".
+"""
+import os
+import time
+import threading
+
+LOW_MEMORY = os.environ.get("LOW_MEMORY", "0").lower() in ("1", "true", "yes")
+
+# 0 = sin limite (por defecto de paho)
+MQTT_MAX_QUEUED = int(os.environ.get("MQTT_MAX_QUEUED", "100" if LOW_MEMORY else "0"))
+MQTT_MAX_INFLIGHT = int(os.environ.get("MQTT_MAX_INFLIGHT", "5" if LOW_MEMORY else "20"))
+
+# Fraccion de la capacidad por defecto del historial crudo
+HISTORY_SCALE = 0.25 if LOW_MEMORY else 1.0
+
+
+def rss_kb(pid="self"):
+    """RSS actual en KB, o None sin /proc (ru_maxrss es el pico, no el actual)"""
+    try:
+        with open("/proc/{}/statm".format(pid)) as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except Exception:
+        return None
+
+
+class MemoryReport:
+    def __init__(self, after=None, supervisor=None):
+        self.after = after if after is not None else float(os.environ.get("MEMORY_REPORT_AFTER", "3600"))
+        self.supervisor = supervisor
+        self.baseline_kb = rss_kb()
+        self.services = []
+        self.last = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def track(self, name, fn):
+        """fn() crea o inicia un servicio; se anota cuanto crecio el RSS"""
+        before = rss_kb()
+        result = fn()
+        after = rss_kb()
+        self.services.append((name, after - before if None not in (before, after) else None))
+        return result
+
+    def report(self, label):
+        workers = {}
+        if self.supervisor is not None:
+            for name, w in self.supervisor.workers.items():
+                if w.pid:
+                    workers[name] = rss_kb(w.pid)
+        self.last = {
+            "label": label,
+            "ts": time.time(),
+            "low_memory": LOW_MEMORY,
+            "rss_kb": rss_kb(),
+            "baseline_kb": self.baseline_kb,
+            "services_kb": dict(self.services),
+            "workers_kb": workers,
+        }
+        print("Memoria ({}): RSS {} KB (imports {} KB){}".format(
+            label, self.last["rss_kb"], self.baseline_kb, " [LOW_MEMORY]" if LOW_MEMORY else ""))
+        for name, kb in self.services:
+            if kb is not None:
+                print("  {:14s} +{} KB".format(name, kb))
+        for name, kb in workers.items():
+            print("  {:14s} {} KB (proceso aparte)".format(name, kb))
+        return self.last
+
+    def loop(self):
+        self.report("arranque")
+        if not self._stop.wait(self.after):
+            self.report("{:.0f} min".format(self.after / 60.0))
+
+    def start(self):
+        import estadoPlaca
+        estadoPlaca.register_metrics("memory", lambda: self.last)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
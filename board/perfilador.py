@@ -0,0 +1,180 @@
+"""Perfilador por muestreo que se activa en caliente sobre el proceso de main.py.
+
+Apagado no cuesta nada: no hay hilos ni hooks instalados. Al activarlo
+(senal SIGUSR1 o mensaje en /admin/profile) un hilo toma muestras de las
+pilas de todos los hilos durante N segundos y escribe un archivo de pilas
+colapsadas (formato flamegraph) mas un resumen por servicio y categoria.
+"""
+import os
+import sys
+import time
+import signal
+import threading
+from collections import Counter
+
+import codec
+import topicos
+from conexionMqtt import MqttConnection
+
+# (fragmento del archivo, funcion o None) -> categoria
+CATEGORIES = [
+    ("LCD.py", None, "lcd_bitbang"),
+    ("lcdConfig.py", "write", "lcd_bitbang"),
+    ("SensorMovimiento.py", "measure_distance", "ultrasonic_busywait"),
+    ("ServoControl.py", "_move_to_angle", "pwm"),
+    ("LedRGB.py", "set_rgb", "pwm"),
+    ("codec.py", None, "json"),
+    ("json", None, "json"),
+    ("ssl.py", None, "tls"),
+    ("logging", None, "logging"),
+    ("paho", None, "mqtt"),
+]
+
+
+def _categorize(stack):
+    """Categoria del frame mas interno que coincida"""
+    for filename, func in reversed(stack):
+        for frag, fn, cat in CATEGORIES:
+            if frag in filename and (fn is None or fn == func):
+                return cat
+    return "other"
+
+
+def _service_of(frame):
+    """Servicio dueno del hilo: clase del `self` mas externo de la pila"""
+    owner = None
+    while frame is not None:
+        obj = frame.f_locals.get("self") if "self" in frame.f_code.co_varnames else None
+        if obj is not None:
+            name = type(obj).__name__
+            if name == "Client":
+                client_id = getattr(obj, "_client_id", b"")
+                if isinstance(client_id, bytes):
+                    client_id = client_id.decode(errors="replace")
+                owner = "mqtt:" + str(client_id)
+            elif not name.startswith("_") and name not in ("Thread", "Timer", "Condition", "Event"):
+                owner = name
+        frame = frame.f_back
+    return owner or "main"
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005, out_dir=None):
+        self.interval = interval
+        self.out_dir = out_dir or os.environ.get("PROFILE_DIR", "/tmp")
+        self._lock = threading.Lock()
+        self._running = False
+        self.last_result = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self, seconds, on_done=None):
+        """Perfilar en segundo plano; False si ya hay una corrida activa"""
+        with self._lock:
+            if self._running:
+                return False
+            self._running = True
+        t = threading.Thread(target=self._run, args=(seconds, on_done), daemon=True, name="profiler")
+        t.start()
+        return True
+
+    def _run(self, seconds, on_done):
+        try:
+            result = self.sample(seconds)
+            self.last_result = result
+            print("Perfil escrito en {}".format(result["file"]))
+            if on_done:
+                on_done(result)
+        finally:
+            self._running = False
+
+    def sample(self, seconds):
+        own = threading.get_ident()
+        stacks = Counter()
+        services = Counter()
+        categories = Counter()
+        samples = 0
+        started = time.monotonic()
+        cpu0 = time.process_time()
+        deadline = started + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                f = frame
+                while f is not None:
+                    stack.append((f.f_code.co_filename, f.f_code.co_name))
+                    f = f.f_back
+                stack.reverse()
+                service = _service_of(frame)
+                folded = ";".join("{}:{}".format(os.path.basename(fn), name) for fn, name in stack)
+                stacks[service + ";" + folded] += 1
+                services[service] += 1
+                categories[_categorize(stack)] += 1
+                samples += 1
+            time.sleep(self.interval)
+        elapsed = time.monotonic() - started
+        path = os.path.join(self.out_dir, "board-profile-{}.folded".format(time.strftime("%Y%m%d-%H%M%S")))
+        with open(path, "w") as fh:
+            for stack, count in stacks.most_common():
+                fh.write("{} {}\n".format(stack, count))
+        return {
+            "file": path,
+            "seconds": round(elapsed, 3),
+            "samples": samples,
+            "cpu_percent": round(100.0 * (time.process_time() - cpu0) / elapsed, 1) if elapsed else None,
+            "services": {k: round(100.0 * v / samples, 1) for k, v in services.most_common()} if samples else {},
+            "categories": {k: round(100.0 * v / samples, 1) for k, v in categories.most_common()} if samples else {},
+        }
+
+
+profiler = SamplingProfiler()
+
+
+def install_signal(seconds=10.0, signum=None):
+    """SIGUSR1 -> perfilar `seconds` segundos (solo desde el hilo principal)"""
+    signum = signum or getattr(signal, "SIGUSR1", None)
+    if signum is None:
+        return False
+    signal.signal(signum, lambda s, f: profiler.start(seconds))
+    return True
+
+
+class ProfilerService:
+    """Activa el perfilador con /admin/profile {"seconds": N}; el resumen sale en /admin/profile/result"""
+
+    def __init__(self):
+        self.mqtt_host = os.environ.get("MQTT_HOST", "9a9751de0a5f4cf48ef00e50f9450e27.s1.eu.hivemq.cloud")
+        self.mqtt_port = int(os.environ.get("MQTT_PORT", "8883"))
+        self.mqtt_user = os.environ.get("MQTT_USERNAME", "isaac")
+        self.mqtt_pass = os.environ.get("MQTT_PASSWORD", "ArquiGrupo4")
+        self.mqtt_client_id = topicos.client_id("raspberry-pi-profiler")
+        self.result_topic = topicos.topic("/admin/profile/result")
+        self.conn = None
+
+    def _on_message(self, client, userdata, msg):
+        req = codec.loads_or(msg.payload, "seconds") or {}
+        try:
+            seconds = min(float(req.get("seconds", 10)), 300.0)
+        except (TypeError, ValueError):
+            seconds = 10.0
+        reply_to = req.get("reply_to") or self.result_topic
+
+        def done(result):
+            client.publish(reply_to, codec.dumps(result))
+
+        if not profiler.start(seconds, on_done=done):
+            client.publish(reply_to, codec.dumps({"error": "profiler already running"}))
+
+    def start(self):
+        self.conn = MqttConnection(self.mqtt_client_id, self.mqtt_host, self.mqtt_port,
+                                   self.mqtt_user, self.mqtt_pass,
+                                   subscriptions=topicos.subscriptions(["/admin/profile"], 1), on_message=self._on_message)
+        self.conn.start()
+
+    def stop(self):
+        if self.conn:
+            self.conn.stop()
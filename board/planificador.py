@@ -0,0 +1,224 @@
+"""Planificador unico de tareas periodicas y diferidas de la placa.
+
+En lugar de un hilo con sleep(period) por servicio, las lecturas y timers se
+registran aca: un hilo despachador mantiene un heap ordenado por hora de
+ejecucion y pasa cada tarea a un pool chico de workers.
+
+- Periodos sin deriva: la proxima ejecucion es `anterior + periodo`, no
+  `fin + periodo`.
+- Fases repartidas: las tareas nuevas arrancan desfasadas dentro de su
+  periodo (proporcion aurea) para que no coincidan todas en el mismo instante.
+- Una tarea nunca se solapa consigo misma: si la ejecucion anterior sigue en
+  curso, el turno se salta y cuenta como deadline perdido.
+- Por tarea se miden ejecuciones, jitter de arranque, duracion y deadlines
+  perdidos (/board/metrics -> "scheduler").
+"""
+import os
+import time
+import heapq
+import queue
+import logging
+import itertools
+import threading
+from collections import deque
+
+import estadoPlaca
+
+logger = logging.getLogger(__name__)
+
+# Fraccion aurea: fases sucesivas quedan bien repartidas en el periodo
+_GOLDEN = 0.6180339887498949
+
+
+class WorkerPool:
+    """Pool de hilos daemon alimentado por una cola"""
+
+    def __init__(self, workers=3, name="sched"):
+        self.name = name
+        self._jobs = queue.Queue()
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._run, daemon=True, name="{}-{}".format(name, i))
+            t.start()
+            self._threads.append(t)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            try:
+                job()
+            except Exception as e:
+                logger.error("%s: tarea fallida: %s", self.name, e)
+
+    def submit(self, fn):
+        self._jobs.put(fn)
+
+    def pending(self):
+        return self._jobs.qsize()
+
+    def shutdown(self):
+        # No se espera a los workers: una tarea colgada no frena el cierre
+        for _ in self._threads:
+            self._jobs.put(None)
+
+
+class Task:
+    def __init__(self, scheduler, name, fn, period, deadline, pool):
+        self.scheduler = scheduler
+        self.name = name
+        self.fn = fn
+        self.period = period
+        self.deadline = deadline if deadline is not None else period
+        self.pool = pool
+        self.cancelled = False
+        self.running = False
+        self.runs = 0
+        self.errors = 0
+        self.misses = 0
+        self.skipped = 0
+        self.max_ms = 0.0
+        self.last_ms = None
+        self.jitter_ms = deque(maxlen=100)
+
+    def cancel(self):
+        self.cancelled = True
+        self.scheduler.wake()
+
+    def _run(self, due):
+        if self.cancelled:
+            # Cancelada despues de pasar al pool: no ejecutar
+            self.running = False
+            return
+        started = time.monotonic()
+        self.jitter_ms.append((started - due) * 1000.0)
+        try:
+            self.fn()
+        except Exception as e:
+            self.errors += 1
+            logger.error("Tarea %s fallida: %s", self.name, e)
+        finally:
+            elapsed = time.monotonic() - started
+            self.runs += 1
+            self.last_ms = elapsed * 1000.0
+            self.max_ms = max(self.max_ms, self.last_ms)
+            if self.deadline and started + elapsed > due + self.deadline:
+                self.misses += 1
+            self.running = False
+
+    def stats(self):
+        jitter = sorted(self.jitter_ms)
+        return {
+            "period_s": self.period,
+            "runs": self.runs,
+            "errors": self.errors,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "last_ms": round(self.last_ms, 2) if self.last_ms is not None else None,
+            "max_ms": round(self.max_ms, 2),
+            "jitter_p50_ms": round(jitter[len(jitter) // 2], 2) if jitter else None,
+            "jitter_max_ms": round(jitter[-1], 2) if jitter else None,
+        }
+
+
+class Scheduler:
+    def __init__(self, workers=None):
+        self.workers = workers or int(os.environ.get("SCHEDULER_WORKERS", "3"))
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._phase = itertools.count(1)
+        self.tasks = {}
+        self.pool = None
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self.pool = WorkerPool(self.workers)
+            self._thread = threading.Thread(target=self._dispatch, daemon=True, name="scheduler")
+            self._thread.start()
+
+    def _push(self, when, task):
+        heapq.heappush(self._heap, (when, next(self._seq), task))
+        self._cond.notify()
+
+    def every(self, name, period, fn, phase=None, deadline=None, pool=None):
+        """Ejecutar fn() cada `period` s; phase None = desfase automatico"""
+        with self._cond:
+            self._ensure_started()
+            if phase is None:
+                phase = (next(self._phase) * _GOLDEN) % 1.0 * period
+            task = Task(self, name, fn, period, deadline, pool)
+            self.tasks[name] = task
+            self._push(time.monotonic() + phase, task)
+            return task
+
+    def after(self, name, delay, fn, pool=None):
+        """Ejecutar fn() una vez dentro de `delay` s; devuelve la tarea (cancel())"""
+        with self._cond:
+            self._ensure_started()
+            task = Task(self, name, fn, None, None, pool)
+            self.tasks[name] = task
+            self._push(time.monotonic() + delay, task)
+            return task
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify()
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while True:
+                    # Descartar tareas canceladas sin esperar a su turno
+                    while self._heap and self._heap[0][2].cancelled:
+                        task = heapq.heappop(self._heap)[2]
+                        if self.tasks.get(task.name) is task:
+                            del self.tasks[task.name]
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        due, _, task = heapq.heappop(self._heap)
+                        break
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+                if task.period:
+                    # Proximo turno fijo; si estamos atrasados mas de un periodo, saltar turnos
+                    nxt = due + task.period
+                    if nxt <= now:
+                        lost = int((now - due) // task.period)
+                        task.skipped += lost
+                        task.misses += lost
+                        nxt = due + (lost + 1) * task.period
+                    self._push(nxt, task)
+                elif self.tasks.get(task.name) is task:
+                    del self.tasks[task.name]
+            if task.running:
+                # La ejecucion anterior sigue en curso: no solapar
+                task.skipped += 1
+                task.misses += 1
+                continue
+            task.running = True
+            (task.pool or self.pool).submit(lambda task=task, due=due: task._run(due))
+
+    def stats(self):
+        with self._cond:
+            tasks = list(self.tasks.values())
+        return {
+            "workers": self.workers,
+            "queued": self.pool.pending() if self.pool else 0,
+            "tasks": {t.name: t.stats() for t in tasks},
+        }
+
+
+# Planificador compartido por todos los servicios del proceso
+scheduler = Scheduler()
+
+estadoPlaca.register_metrics("scheduler", scheduler.stats)
+
+
+def every(name, period, fn, phase=None, deadline=None, pool=None):
+    return scheduler.every(name, period, fn, phase, deadline, pool)
+
+
+def after(name, delay, fn, pool=None):
+    return scheduler.after(name, delay, fn, pool)
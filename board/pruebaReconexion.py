@@ -0,0 +1,78 @@
+"""Prueba de reconexion: levanta un mosquitto local, lo mata y mide
+cuanto tarda FanService en volver a recibir comandos.
+
+Uso: python pruebaReconexion.py --port 18830 --downtime 3 --rounds 3
+"""
+import os
+import time
+import json
+import shutil
+import argparse
+import subprocess
+
+
+def start_broker(port):
+    return subprocess.Popen(["mosquitto", "-p", str(port)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide el tiempo de recuperacion MQTT matando el broker local")
+    parser.add_argument("--port", type=int, default=18830)
+    parser.add_argument("--downtime", type=float, default=3.0)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    if shutil.which("mosquitto") is None:
+        print("mosquitto no esta instalado")
+        return 1
+
+    os.environ["MQTT_HOST"] = "127.0.0.1"
+    os.environ["MQTT_PORT"] = str(args.port)
+    os.environ["MQTT_TLS"] = "0"
+    os.environ["MQTT_CLIENT_ID"] = "prueba-reconexion-fan"
+
+    # Importar despues de configurar el entorno
+    from ventilador import FanService
+    from conexionMqtt import MqttConnection
+    import topicos
+
+    broker = start_broker(args.port)
+    time.sleep(0.5)
+    fan = FanService()
+    fan.start()
+    sender = MqttConnection("prueba-reconexion-sender", "127.0.0.1", args.port, tls=False, clean_session=True)
+    sender.start()
+    failures = 0
+    try:
+        for i in range(args.rounds):
+            if not fan.conn or not fan.conn.connected.wait(30):
+                print("Ronda {}: el servicio no se conecto".format(i + 1))
+                failures += 1
+                break
+            broker.kill()
+            broker.wait()
+            time.sleep(args.downtime)
+            broker = start_broker(args.port)
+            t0 = time.monotonic()
+            fan.conn.connected.wait(60)
+            sender.connected.wait(60)
+            # Confirmar que la suscripcion se restablecio
+            want = i % 2 == 0
+            sender.client.publish(topicos.topic("/fan"), json.dumps({"state": "on" if want else "off"}), qos=1)
+            deadline = time.monotonic() + 10
+            while fan.fan_state != want and time.monotonic() < deadline:
+                time.sleep(0.01)
+            ok = fan.fan_state == want
+            failures += 0 if ok else 1
+            print("Ronda {}: reconexion {:.2f}s, comando {} tras {:.2f}s desde el reinicio del broker".format(
+                i + 1, fan.conn.stats()["last_recovery_s"] or 0.0, "OK" if ok else "PERDIDO", time.monotonic() - t0))
+        print(json.dumps(fan.conn.stats(), indent=2))
+    finally:
+        sender.stop()
+        fan.stop()
+        broker.kill()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
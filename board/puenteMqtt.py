@@ -0,0 +1,381 @@
+"""Broker MQTT local en la placa y puente filtrado hacia la nube.
+
+Con --local-broker (o LOCAL_BROKER=1) main.py levanta un mosquitto local y
+apunta todos los servicios a el (127.0.0.1, sin TLS ni credenciales): el LCD
+recibe /temperatura del DHT sin ida y vuelta a internet. MqttBridge es el
+unico cliente conectado al broker de la nube:
+
+- Sube solo los topicos de BRIDGE_UP. Cada topico sale como mucho una vez cada
+  BRIDGE_MIN_INTERVAL s con su ultimo valor (los retenidos, que ya salen solo
+  en cambios, no esperan). Los de BRIDGE_QUEUED (tramas de telemetria,
+  respuestas) no se pisan: van en una cola FIFO y salen todos, en orden.
+  Lo pendiente se manda en tandas cada BRIDGE_FLUSH_INTERVAL s, con un tope
+  de BRIDGE_MAX_RATE mensajes/s. Sin internet queda el ultimo valor de cada
+  topico (y hasta BRIDGE_QUEUE_MAX mensajes en cola) y sale al reconectar.
+- Baja los comandos de BRIDGE_DOWN (de esta placa y de la flota). Si un comando
+  trae reply_to, la respuesta local se sube al instante.
+- Un topico que este en las dos listas no rebota: el puente descarta el eco
+  de lo que el mismo publico.
+
+LOCAL_BROKER_PORT (1883) y LOCAL_BROKER_BIND (127.0.0.1; 0.0.0.0 para
+consumidores en la LAN). Si ya hay un broker escuchando en ese puerto (p.ej.
+el mosquitto del sistema) se usa ese.
+"""
+import os
+import time
+import socket
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict, deque
+
+import paho.mqtt.client as mqtt
+
+import codec
+import estadoPlaca
+import topicos
+from conexionMqtt import MqttConnection, COMMAND_QOS
+
+logger = logging.getLogger(__name__)
+
+LOCAL_PORT = int(os.environ.get("LOCAL_BROKER_PORT", "1883"))
+LOCAL_BIND = os.environ.get("LOCAL_BROKER_BIND", "127.0.0.1")
+
+UP_DEFAULT = ("/fan/status,/pump/status,/ilumination/rgb/status,/room/+/status,"
+              "/board/state,/board/metrics,/temperatura,/humedad_aire,/humedad_suelo,"
+              "/telemetry/batch,/history/response,/admin/profile/result")
+DOWN_DEFAULT = ("/fan,/ventilador,/actuators/fan,/pump,/door,/ilumination,/light,/actuators/light,"
+                "/room/+/light,/ilumination/control,/ilumination/room/+/control,/history/request,"
+                "/admin/profile,/alerts,/entrance")
+# Topicos de BRIDGE_UP que no se resumen al ultimo valor
+QUEUED_DEFAULT = "/telemetry/batch,/history/response,/admin/profile/result"
+
+# Respuestas reply_to que se siguen escuchando a la vez
+MAX_REPLY_TOPICS = 64
+
+
+def _paths(value):
+    return [p.strip() for p in value.split(",") if p.strip()]
+
+
+def upstream_settings():
+    """Broker de la nube segun el entorno actual"""
+    return {
+        "host": os.environ.get("MQTT_HOST", "9a9751de0a5f4cf48ef00e50f9450e27.s1.eu.hivemq.cloud"),
+        "port": int(os.environ.get("MQTT_PORT", "8883")),
+        "user": os.environ.get("MQTT_USERNAME", "isaac"),
+        "password": os.environ.get("MQTT_PASSWORD", "ArquiGrupo4"),
+        "tls": os.environ.get("MQTT_TLS", "1").lower() not in ("0", "false", "no"),
+    }
+
+
+def use_local_broker(port=None):
+    """Apuntar al broker local los servicios que se creen despues (y los workers
+    aislados, que heredan el entorno); devuelve la config de la nube para el puente.
+    Llamar solo despues de que LocalBroker.start() confirmo que hay broker."""
+    upstream = upstream_settings()
+    os.environ["MQTT_HOST"] = "127.0.0.1"
+    os.environ["MQTT_PORT"] = str(port or LOCAL_PORT)
+    os.environ["MQTT_TLS"] = "0"
+    # Las credenciales de la nube no viajan al broker local
+    os.environ["MQTT_USERNAME"] = ""
+    os.environ["MQTT_PASSWORD"] = ""
+    return upstream
+
+
+def _listening(host, port):
+    try:
+        socket.create_connection((host, port), timeout=0.5).close()
+        return True
+    except OSError:
+        return False
+
+
+class LocalBroker:
+    """mosquitto como proceso hijo, reiniciado si se cae"""
+
+    def __init__(self, port=None, bind=None, binary=None):
+        self.port = port or LOCAL_PORT
+        self.bind = bind or LOCAL_BIND
+        self.binary = binary or shutil.which("mosquitto")
+        self.process = None
+        self.external = False
+        self.restarts = 0
+        self._conf = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _write_conf(self):
+        fd, path = tempfile.mkstemp(prefix="board-mosquitto-", suffix=".conf")
+        with os.fdopen(fd, "w") as fh:
+            fh.write("listener {} {}\n".format(self.port, self.bind))
+            fh.write("allow_anonymous true\n")
+            fh.write("persistence false\n")
+            fh.write("max_queued_messages 1000\n")
+            fh.write("log_dest stderr\n")
+            fh.write("log_type error\n")
+            fh.write("log_type warning\n")
+        return path
+
+    def _spawn(self):
+        self.process = subprocess.Popen([self.binary, "-c", self._conf])
+
+    def _wait_ready(self, timeout=3.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and not self._stop.is_set():
+            if _listening("127.0.0.1", self.port):
+                return True
+            if self.process is not None and self.process.poll() is not None:
+                return False
+            self._stop.wait(0.05)
+        return False
+
+    def loop(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            code = self.process.wait()
+            if self._stop.is_set():
+                return
+            logger.error("mosquitto termino (exit %s), reinicio en %.0fs", code, backoff)
+            if self._stop.wait(backoff):
+                return
+            backoff = min(backoff * 2, 30.0)
+            self.restarts += 1
+            self._spawn()
+            if self._wait_ready():
+                backoff = 1.0
+
+    def stats(self):
+        return {
+            "port": self.port,
+            "external": self.external,
+            "pid": self.process.pid if self.process else None,
+            "restarts": self.restarts,
+        }
+
+    def start(self):
+        """True si hay un broker local escuchando; si no, los servicios deben seguir con la nube"""
+        self._stop.clear()
+        if _listening("127.0.0.1", self.port):
+            self.external = True
+            print("Broker local: usando el que ya escucha en el puerto {}".format(self.port))
+            estadoPlaca.register_metrics("broker", self.stats)
+            return True
+        if not self.binary:
+            logger.error("Broker local: mosquitto no esta instalado (apt install mosquitto)")
+            return False
+        self._conf = self._write_conf()
+        self._spawn()
+        if not self._wait_ready():
+            logger.error("Broker local: mosquitto no responde en el puerto %s", self.port)
+            self.stop()
+            return False
+        print("Broker local en {}:{} (pid {})".format(self.bind, self.port, self.process.pid))
+        estadoPlaca.register_metrics("broker", self.stats)
+        self._thread = threading.Thread(target=self.loop, daemon=True, name="broker")
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=3)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self._thread:
+            self._thread.join(timeout=2)
+        if self._conf:
+            try:
+                os.unlink(self._conf)
+            except OSError:
+                pass
+
+
+class MqttBridge:
+    def __init__(self, upstream=None, up=None, down=None, min_interval=None, flush_interval=None, max_rate=None):
+        self.upstream = upstream or upstream_settings()
+        self.up_paths = up if up is not None else _paths(os.environ.get("BRIDGE_UP", UP_DEFAULT))
+        self.down_paths = down if down is not None else _paths(os.environ.get("BRIDGE_DOWN", DOWN_DEFAULT))
+        self.queued = [topicos.topic(p) for p in _paths(os.environ.get("BRIDGE_QUEUED", QUEUED_DEFAULT))]
+        self.min_interval = float(min_interval or os.environ.get("BRIDGE_MIN_INTERVAL", "10"))
+        self.flush_interval = float(flush_interval or os.environ.get("BRIDGE_FLUSH_INTERVAL", "1.0"))
+        self.max_rate = float(max_rate or os.environ.get("BRIDGE_MAX_RATE", "5"))
+        # Se conecta al broker local con el entorno ya redirigido por use_local_broker()
+        self.local_host = os.environ.get("MQTT_HOST", "127.0.0.1")
+        self.local_port = int(os.environ.get("MQTT_PORT", str(LOCAL_PORT)))
+        self.client_id = topicos.client_id("raspberry-pi-bridge")
+        self.local = None
+        self.cloud = None
+        # topico -> (payload, qos, retain); solo el ultimo valor de cada uno
+        self._pending = OrderedDict()
+        self._last_up = {}
+        # (topico, payload, qos, retain) en orden de llegada, sin resumir
+        self._queue = deque(maxlen=int(os.environ.get("BRIDGE_QUEUE_MAX", "500")))
+        self._tokens = self.max_rate
+        self._refill_at = time.monotonic()
+        # Ultimo payload que el puente publico en cada lado, para descartar ecos
+        self._sent_up = {}
+        self._sent_down = {}
+        self._replies = OrderedDict()
+        self._lock = threading.Lock()
+        self.forwarded_up = 0
+        self.forwarded_down = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.deferred = 0
+        self.echoes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _on_local(self, client, userdata, msg):
+        with self._lock:
+            if self._sent_down.get(msg.topic) == msg.payload:
+                del self._sent_down[msg.topic]
+                self.echoes += 1
+                return
+            reply = msg.topic in self._replies
+            if not reply and any(mqtt.topic_matches_sub(f, msg.topic) for f in self.queued):
+                if len(self._queue) == self._queue.maxlen:
+                    self.dropped += 1
+                self._queue.append((msg.topic, msg.payload, msg.qos, msg.retain))
+            elif not reply:
+                if msg.topic in self._pending:
+                    self.coalesced += 1
+                    del self._pending[msg.topic]
+                self._pending[msg.topic] = (msg.payload, msg.qos, msg.retain)
+        if reply:
+            # Respuesta a un comando de la nube: sin esperar la tanda
+            self._publish_up(msg.topic, msg.payload, COMMAND_QOS, False)
+
+    def _on_cloud(self, client, userdata, msg):
+        if msg.retain:
+            # Retenido viejo entregado al suscribirse, no es un comando nuevo
+            return
+        with self._lock:
+            if self._sent_up.get(msg.topic) == msg.payload:
+                del self._sent_up[msg.topic]
+                self.echoes += 1
+                return
+            self._sent_down[msg.topic] = msg.payload
+            self.forwarded_down += 1
+        data = codec.loads_or(msg.payload)
+        reply_to = data.get("reply_to") if isinstance(data, dict) else None
+        if isinstance(reply_to, str) and reply_to and "+" not in reply_to and "#" not in reply_to:
+            self._watch_reply(reply_to)
+        try:
+            self.local.client.publish(msg.topic, msg.payload, qos=msg.qos)
+        except Exception as e:
+            logger.error("Puente: no se pudo bajar %s: %s", msg.topic, e)
+
+    def _watch_reply(self, topic):
+        with self._lock:
+            if topic in self._replies:
+                self._replies.move_to_end(topic)
+                return
+            self._replies[topic] = True
+            old = self._replies.popitem(last=False)[0] if len(self._replies) > MAX_REPLY_TOPICS else None
+        if old is not None:
+            self.local.subscriptions = [s for s in self.local.subscriptions if s[0] != old]
+            self.local.client.unsubscribe(old)
+        # Suscribirse antes de bajar el comando: la respuesta no se pierde
+        self.local.subscribe(topic, COMMAND_QOS)
+
+    def _publish_up(self, topic, payload, qos, retain):
+        with self._lock:
+            self._sent_up[topic] = payload
+        try:
+            self.cloud.client.publish(topic, payload, qos=qos, retain=retain)
+            self.forwarded_up += 1
+        except Exception as e:
+            logger.error("Puente: no se pudo subir %s: %s", topic, e)
+
+    def _take_token(self):
+        if self._tokens < 1.0:
+            self.deferred += 1
+            return False
+        self._tokens -= 1.0
+        return True
+
+    def flush(self):
+        """Subir lo pendiente que ya cumplio su intervalo, dentro del tope de tasa"""
+        if not self.cloud.connected.is_set():
+            return 0
+        now = time.monotonic()
+        batch = []
+        with self._lock:
+            self._tokens = min(self.max_rate, self._tokens + (now - self._refill_at) * self.max_rate)
+            self._refill_at = now
+            # Retenidos (estados) primero, despues la cola FIFO y al final las
+            # lecturas resumidas, en orden de llegada
+            retained = [(t, v) for t, v in self._pending.items() if v[2]]
+            readings = [(t, v) for t, v in self._pending.items() if not v[2]]
+            for topic, (payload, qos, retain) in retained:
+                if not self._take_token():
+                    break
+                del self._pending[topic]
+                batch.append((topic, payload, qos, retain))
+            while self._queue and self._take_token():
+                batch.append(self._queue.popleft())
+            for topic, (payload, qos, retain) in readings:
+                if now - self._last_up.get(topic, 0.0) < self.min_interval:
+                    continue
+                if not self._take_token():
+                    break
+                del self._pending[topic]
+                self._last_up[topic] = now
+                batch.append((topic, payload, qos, retain))
+        for topic, payload, qos, retain in batch:
+            self._publish_up(topic, payload, qos, retain)
+        return len(batch)
+
+    def loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+            queued = len(self._queue)
+            replies = len(self._replies)
+        return {
+            "upstream": "{}:{}".format(self.upstream["host"], self.upstream["port"]),
+            "forwarded_up": self.forwarded_up,
+            "forwarded_down": self.forwarded_down,
+            "coalesced": self.coalesced,
+            "deferred": self.deferred,
+            "echoes": self.echoes,
+            "pending": pending,
+            "queued": queued,
+            "dropped": self.dropped,
+            "reply_topics": replies,
+        }
+
+    def start(self):
+        self._stop.clear()
+        self.cloud = MqttConnection(self.client_id, self.upstream["host"], self.upstream["port"],
+                                    self.upstream["user"], self.upstream["password"],
+                                    subscriptions=topicos.subscriptions(self.down_paths, COMMAND_QOS),
+                                    on_message=self._on_cloud, tls=self.upstream["tls"])
+        self.local = MqttConnection(self.client_id + "-local", self.local_host, self.local_port,
+                                    subscriptions=[(topicos.topic(p), 1) for p in self.up_paths],
+                                    on_message=self._on_local, tls=False)
+        estadoPlaca.register_metrics("bridge", self.stats)
+        self.local.start()
+        self.cloud.start()
+        self._thread = threading.Thread(target=self.loop, daemon=True, name="bridge")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+        # Ultima tanda antes de cortar
+        if self.cloud is not None:
+            self.flush()
+            self.cloud.stop()
+        if self.local is not None:
+            self.local.stop()
@@ -0,0 +1,102 @@
+import time
+import threading
+
+import codec
+import estadoPlaca
+
+# Limites superiores de los buckets en milisegundos (el ultimo es +inf)
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms, ok=True):
+        i = 0
+        while i < len(BUCKETS_MS) and ms > BUCKETS_MS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+        if not ok:
+            self.errors += 1
+
+    def percentile(self, p):
+        """Limite superior del bucket que contiene el percentil p (0-100)"""
+        if not self.count:
+            return None
+        target = self.count * p / 100.0
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= target:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else None,
+            "max_ms": round(self.max_ms, 3),
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "buckets_ms": BUCKETS_MS,
+            "counts": list(self.counts),
+        }
+
+
+_lock = threading.Lock()
+histograms = {}
+
+
+def observe(command, ms, ok=True):
+    with _lock:
+        h = histograms.get(command)
+        if h is None:
+            h = histograms[command] = LatencyHistogram()
+        h.observe(ms, ok)
+
+
+def snapshot():
+    with _lock:
+        return {command: h.to_dict() for command, h in histograms.items()}
+
+
+def complete(client, request, command, started, error=None, **extra):
+    """Registrar la latencia de un comando y responder si trae reply_to.
+
+    `started` es time.perf_counter() al recibir el mensaje; la respuesta se
+    envia cuando la accion sobre el GPIO ya termino.
+    """
+    ms = (time.perf_counter() - started) * 1000.0
+    ok = error is None
+    observe(command, ms, ok)
+    reply_to = request.get("reply_to") if isinstance(request, dict) else None
+    if not reply_to or client is None:
+        return
+    response = {
+        "correlation_id": request.get("correlation_id"),
+        "command": command,
+        "ok": ok,
+        "duration_ms": round(ms, 3),
+        "ts": time.time(),
+    }
+    if error is not None:
+        response["error"] = str(error)
+    response.update(extra)
+    try:
+        client.publish(reply_to, codec.dumps(response), qos=1)
+    except Exception:
+        pass
+
+
+estadoPlaca.register_metrics("commands", snapshot)
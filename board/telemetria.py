@@ -0,0 +1,121 @@
+import os
+import time
+import threading
+
+import codec
+import topicos
+from conexionMqtt import MqttConnection
+
+# legacy: un mensaje por topico (como antes)
+# batch:  solo tramas en /telemetry/batch
+# both:   tramas y mensajes por topico (para migrar consumidores)
+MODE = os.environ.get("TELEMETRY_MODE", "legacy").lower()
+
+
+class TelemetryBatcher:
+    """Junta lecturas de todos los sensores en una sola trama MQTT"""
+
+    def __init__(self, max_readings=20, max_age=10.0, topic=None):
+        self.max_readings = max_readings
+        self.max_age = max_age
+        self.topic = topic or topicos.topic("/telemetry/batch")
+        self.mqtt_host = os.environ.get("MQTT_HOST", "9a9751de0a5f4cf48ef00e50f9450e27.s1.eu.hivemq.cloud")
+        self.mqtt_port = int(os.environ.get("MQTT_PORT", "8883"))
+        self.mqtt_user = os.environ.get("MQTT_USERNAME", "isaac")
+        self.mqtt_pass = os.environ.get("MQTT_PASSWORD", "ArquiGrupo4")
+        self.mqtt_client_id = topicos.client_id("raspberry-pi-telemetry")
+        self.client = None
+        self.readings = []
+        self.first_ts = None
+        self.frames_sent = 0
+        self.readings_sent = 0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, topic, data, ts=None):
+        with self._cond:
+            ts = time.time() if ts is None else ts
+            if self.first_ts is None:
+                self.first_ts = ts
+            self.readings.append({"topic": topic, "ts": ts, "data": data})
+            if len(self.readings) >= self.max_readings:
+                self._cond.notify()
+
+    def _take(self):
+        frame = self.readings[:self.max_readings]
+        self.readings = self.readings[self.max_readings:]
+        self.first_ts = self.readings[0]["ts"] if self.readings else None
+        return frame
+
+    def flush(self):
+        # Sin cliente las lecturas quedan en el buffer para la proxima trama
+        if not self.client:
+            return
+        with self._cond:
+            readings = self._take()
+        if not readings:
+            return
+        frame = {"board": topicos.BOARD_ID or self.mqtt_client_id, "sent": time.time(), "readings": readings}
+        try:
+            self.client.publish(self.topic, codec.dumps(frame))
+            self.frames_sent += 1
+            self.readings_sent += len(readings)
+        except Exception as e:
+            print("Error publicando trama de telemetria: {}".format(e))
+
+    def loop(self):
+        conn = MqttConnection(self.mqtt_client_id, self.mqtt_host, self.mqtt_port,
+                              self.mqtt_user, self.mqtt_pass)
+        conn.start()
+        self.client = conn.client
+        try:
+            while not self._stop.is_set():
+                with self._cond:
+                    if self.first_ts is None:
+                        timeout = self.max_age
+                    else:
+                        timeout = self.first_ts + self.max_age - time.time()
+                    if timeout > 0 and len(self.readings) < self.max_readings:
+                        self._cond.wait(timeout)
+                    due = self.readings and (len(self.readings) >= self.max_readings
+                                             or time.time() - self.first_ts >= self.max_age)
+                if due:
+                    self.flush()
+        finally:
+            while self.readings:
+                self.flush()
+            conn.stop()
+
+    def start(self):
+        global _batcher
+        self._stop.clear()
+        _batcher = self
+        t = threading.Thread(target=self.loop, daemon=True)
+        t.start()
+        self._thread = t
+
+    def stop(self):
+        global _batcher
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=2)
+        if _batcher is self:
+            _batcher = None
+
+
+_batcher = None
+
+
+def emit(client, topic, data, ts=None, template=None):
+    """Publicar una lectura de sensor segun TELEMETRY_MODE.
+
+    Con `template` (codec.StatusTemplate), `data` lleva solo los campos que cambian.
+    """
+    batched = MODE in ("batch", "both") and _batcher is not None
+    if batched:
+        _batcher.add(topic, template.as_dict(data) if template else data, ts)
+    if not batched or MODE == "both":
+        client.publish(topic, template.encode(data) if template else codec.dumps(data))
@@ -0,0 +1,72 @@
+"""Espacio de nombres de topicos por placa.
+
+Sin BOARD_ID los topicos quedan como siempre (/fan, /temperatura, ...).
+Con BOARD_ID=pi1 cada placa usa su propio prefijo:
+
+  /devices/pi1/fan            comandos solo para esta placa
+  /devices/all/fan            comandos para toda la flota
+  /devices/pi1/temperatura    lecturas de esta placa
+  /devices/+/temperatura      (consumidor) lecturas de todas las placas
+
+Los topicos de estado de los actuadores (/fan/status, /pump/status,
+/ilumination/rgb/status, /room/<room>/status) se publican con
+retain=True, QoS 1, al arrancar y despues solo cuando el estado cambia: un
+suscriptor nuevo recibe el estado actual al conectarse, sin sondear.
+
+client_id() da a cada servicio un ID MQTT propio de la placa (pi1-raspberry-pi-fan).
+
+shared() arma suscripciones compartidas MQTT ($share/<grupo>/<filtro>) para
+consumidores tipo worker: el broker reparte los mensajes entre los miembros
+del grupo en lugar de entregarlos a todos.
+"""
+import os
+
+BOARD_ID = os.environ.get("BOARD_ID", "").strip("/")
+ROOT = os.environ.get("BOARD_TOPIC_ROOT", "/devices").rstrip("/")
+FLEET = "all"
+
+
+def prefix(board_id=None):
+    board_id = BOARD_ID if board_id is None else board_id
+    return "{}/{}".format(ROOT, board_id) if board_id else ""
+
+
+def topic(path, board_id=None):
+    """Topico propio de la placa para publicar"""
+    return prefix(board_id) + path
+
+
+def subscriptions(paths, qos=0, fleet=True):
+    """(topico, qos) para escuchar `paths` en esta placa y, si aplica, en toda la flota"""
+    subs = [(topic(p), qos) for p in paths]
+    if BOARD_ID and fleet:
+        subs += [(topic(p, FLEET), qos) for p in paths]
+    return subs
+
+
+def local(full_topic):
+    """Quitar el prefijo de placa o de flota: /devices/pi1/room/sala/light -> /room/sala/light"""
+    if not BOARD_ID:
+        return full_topic
+    for p in (prefix(), prefix(FLEET)):
+        if full_topic.startswith(p + "/"):
+            return full_topic[len(p):]
+    return full_topic
+
+
+def client_id(default):
+    """ID MQTT de un servicio: MQTT_CLIENT_ID si se fijo a mano; si no `default`
+    con BOARD_ID delante, para que dos placas no se quiten la sesion persistente"""
+    explicit = os.environ.get("MQTT_CLIENT_ID")
+    if explicit:
+        return explicit
+    return "{}-{}".format(BOARD_ID, default) if BOARD_ID else default
+
+
+def fleet_filter(path):
+    """Filtro con comodin para consumir `path` de todas las placas"""
+    return "{}/+{}".format(ROOT, path)
+
+
+def shared(group, topic_filter):
+    return "$share/{}/{}".format(group, topic_filter)
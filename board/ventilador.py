@@ -1,6 +1,5 @@
 import os
 import time
-import json
 import threading
 
 try:
@@ -8,7 +7,13 @@ try:
 except Exception:
     GPIO = None
 
-import paho.mqtt.client as mqtt
+import codec
+import estadoPlaca
+import estadoPersistente
+import rpc
+import topicos
+import vigilante
+from conexionMqtt import MqttConnection, COMMAND_QOS
 
 class FanService:
     def __init__(self, fan_pin=22):
@@ -17,9 +22,11 @@ class FanService:
         self.mqtt_port = int(os.environ.get("MQTT_PORT", "8883"))
         self.mqtt_user = os.environ.get("MQTT_USERNAME", "isaac")
         self.mqtt_pass = os.environ.get("MQTT_PASSWORD", "ArquiGrupo4")
-        self.mqtt_client_id = os.environ.get("MQTT_CLIENT_ID", "raspberry-pi-fan")
+        self.mqtt_client_id = topicos.client_id("raspberry-pi-fan")
         self.fan_state = False
+        self.status_template = codec.StatusTemplate({"type": "fan", "device": "cooling_fan", "pin": fan_pin})
         self.client = None
+        self.conn = None
         self._stop = threading.Event()
         self._thread = None
 
@@ -34,99 +41,99 @@ class FanService:
             pass
 
     def _setup_mqtt(self):
-        try:
-            self.client = mqtt.Client(client_id=self.mqtt_client_id)
-            try:
-                self.client.username_pw_set(self.mqtt_user, self.mqtt_pass)
-            except Exception:
-                pass
-            try:
-                self.client.tls_set()
-            except Exception:
-                pass
-            self.client.on_message = self._on_message
-            self.client.on_connect = self._on_connect
-            self.client.connect(self.mqtt_host, self.mqtt_port, 60)
-            self.client.loop_start()
-        except Exception:
-            pass
-
-    def _on_connect(self, client, userdata, flags, rc):
         topics = ["/fan", "/ventilador", "/actuators/fan"]
-        for topic in topics:
-            try:
-                client.subscribe(topic)
-            except Exception:
-                pass
+        self.conn = MqttConnection(self.mqtt_client_id, self.mqtt_host, self.mqtt_port,
+                                   self.mqtt_user, self.mqtt_pass,
+                                   subscriptions=topicos.subscriptions(topics, COMMAND_QOS),
+                                   on_message=self._on_message)
+        self.client = self.conn.client
+        self.conn.start()
 
     def _on_message(self, client, userdata, msg):
-        try:
-            payload_str = msg.payload.decode()
-        except Exception:
+        data = codec.loads_or(msg.payload)
+        if data is None:
             return
+        started = time.perf_counter()
         try:
-            data = json.loads(payload_str)
-        except Exception:
-            data = {"state": payload_str.strip()}
-        self._handle_fan_command(data)
+            action = self._handle_fan_command(data)
+        except Exception as e:
+            rpc.complete(client, data, "fan", started, error=e)
+            return
+        if action is None:
+            rpc.complete(client, data, "fan", started, error="unknown command")
+        else:
+            rpc.complete(client, data, "fan." + action, started, state="on" if self.fan_state else "off")
 
     def _handle_fan_command(self, data):
-        try:
-            if "state" in data:
-                state = str(data["state"]).lower().strip()
-                if state in ["on", "encendido", "1", "true"]:
-                    self.turn_on()
-                elif state in ["off", "apagado", "0", "false"]:
-                    self.turn_off()
-            elif "command" in data:
-                cmd = str(data["command"]).lower().strip()
-                if cmd in ["on", "encender"]:
-                    self.turn_on()
-                elif cmd in ["off", "apagar"]:
-                    self.turn_off()
-        except Exception:
-            pass
-
+        """Ejecutar el comando; devuelve "on"/"off" o None si no se reconoce"""
+        if "state" in data:
+            state = str(data["state"]).lower().strip()
+            if state in ["on", "encendido", "1", "true"]:
+                self.turn_on()
+                return "on"
+            elif state in ["off", "apagado", "0", "false"]:
+                self.turn_off()
+                return "off"
+        elif "command" in data:
+            cmd = str(data["command"]).lower().strip()
+            if cmd in ["on", "encender"]:
+                self.turn_on()
+                return "on"
+            elif cmd in ["off", "apagar"]:
+                self.turn_off()
+                return "off"
+        return None
+
+    @vigilante.watched
     def turn_on(self):
+        changed = not self.fan_state
         if GPIO is not None:
-            try:
-                GPIO.output(self.fan_pin, GPIO.HIGH)
-            except Exception:
-                pass
+            # Si el GPIO falla se propaga: el estado no cambia y rpc.complete reporta el error
+            GPIO.output(self.fan_pin, GPIO.HIGH)
         self.fan_state = True
-        self.publish_status()
+        estadoPersistente.save("fan", 1)
+        if changed:
+            self.publish_status()
 
+    @vigilante.watched
     def turn_off(self):
+        changed = self.fan_state
         if GPIO is not None:
-            try:
-                GPIO.output(self.fan_pin, GPIO.LOW)
-            except Exception:
-                pass
+            GPIO.output(self.fan_pin, GPIO.LOW)
         self.fan_state = False
-        self.publish_status()
+        estadoPersistente.save("fan", 0)
+        if changed:
+            self.publish_status()
 
     def publish_status(self):
+        estadoPlaca.update("fan", self.fan_state)
         if not self.client:
             return
-        status_data = {
-            "type": "fan",
-            "device": "cooling_fan",
+        payload = self.status_template.encode({
             "state": "on" if self.fan_state else "off",
             "status": self.fan_state,
-            "pin": self.fan_pin,
             "timestamp": time.time()
-        }
+        })
         try:
-            self.client.publish("/fan/status", json.dumps(status_data))
+            self.client.publish(topicos.topic("/fan/status"), payload, qos=1, retain=True)
         except Exception:
             pass
 
+    def _restore(self):
+        # Volver al ultimo estado comandado antes de conectarse al broker
+        if estadoPersistente.restoring("fan") and estadoPersistente.load("fan"):
+            try:
+                self.turn_on()
+            except Exception as e:
+                print(f"Error restaurando ventilador: {e}")
+
     def loop(self):
         self._setup_gpio()
+        self._restore()
         self._setup_mqtt()
+        self.publish_status()
         try:
-            while not self._stop.is_set():
-                time.sleep(1)
+            self._stop.wait()
         finally:
             self.cleanup()
 
@@ -151,12 +158,8 @@ class FanService:
                 GPIO.cleanup()
             except Exception:
                 pass
-        if self.client:
-            try:
-                self.client.loop_stop()
-                self.client.disconnect()
-            except Exception:
-                pass
+        if self.conn:
+            self.conn.stop()
 
 def main():
     import argparse
@@ -176,8 +179,7 @@ def main():
         return
     try:
         service.start()
-        while True:
-            time.sleep(1)
+        service._stop.wait()
     except KeyboardInterrupt:
         pass
     finally:
@@ -0,0 +1,115 @@
+"""Watchdog de presupuesto de tiempo para handlers MQTT y llamadas al hardware.
+
+Paho ejecuta todos los on_message de un cliente en su unico hilo de red:
+un handler lento retrasa la entrega de mensajes y los keepalive. Cada
+handler y cada llamada marcada con @watched se mide contra CALLBACK_BUDGET_MS;
+los excesos se registran con el topico y handler responsables.
+"""
+import os
+import time
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+BUDGET_MS = float(os.environ.get("CALLBACK_BUDGET_MS", "50"))
+
+
+class HandlerStats:
+    def __init__(self):
+        self.calls = 0
+        self.overruns = 0
+        self.total_ms = 0.0
+        self.worst_ms = 0.0
+        self.worst_topic = None
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "overruns": self.overruns,
+            "mean_ms": round(self.total_ms / self.calls, 3) if self.calls else None,
+            "worst_ms": round(self.worst_ms, 3),
+            "worst_topic": self.worst_topic,
+        }
+
+
+class CallbackWatchdog:
+    def __init__(self, budget_ms=None):
+        self.budget_ms = BUDGET_MS if budget_ms is None else budget_ms
+        self.stats = {}
+        self._lock = threading.Lock()
+        # Topico que se esta procesando en este hilo, para atribuir el hardware
+        self._local = threading.local()
+
+    def record(self, service, handler, ms, topic=None):
+        topic = topic or getattr(self._local, "topic", None)
+        with self._lock:
+            key = (service, handler)
+            st = self.stats.get(key)
+            if st is None:
+                st = self.stats[key] = HandlerStats()
+            st.calls += 1
+            st.total_ms += ms
+            if ms > st.worst_ms:
+                st.worst_ms = ms
+                st.worst_topic = topic
+            over = ms > self.budget_ms
+            if over:
+                st.overruns += 1
+        if over:
+            logger.warning("Presupuesto excedido: %s.%s tardo %.1f ms (limite %.0f ms) topico=%s",
+                           service, handler, ms, self.budget_ms, topic)
+
+    @contextmanager
+    def timed(self, service, handler, topic=None):
+        prev = getattr(self._local, "topic", None)
+        if topic is not None:
+            self._local.topic = topic
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(service, handler, (time.perf_counter() - t0) * 1000.0, topic)
+            self._local.topic = prev
+
+    def wrap_on_message(self, fn, service=None):
+        """Envolver un on_message de paho para medir cada mensaje"""
+        service = service or type(getattr(fn, "__self__", fn)).__name__
+        handler = getattr(fn, "__name__", "on_message")
+
+        @functools.wraps(fn)
+        def wrapper(client, userdata, msg):
+            with self.timed(service, handler, msg.topic):
+                return fn(client, userdata, msg)
+        return wrapper
+
+    def snapshot(self):
+        """Por servicio: peor tiempo, total de excesos y detalle por handler"""
+        with self._lock:
+            out = {}
+            for (service, handler), st in self.stats.items():
+                svc = out.setdefault(service, {"worst_ms": 0.0, "worst_handler": None, "overruns": 0, "handlers": {}})
+                svc["handlers"][handler] = st.to_dict()
+                svc["overruns"] += st.overruns
+                if st.worst_ms > svc["worst_ms"]:
+                    svc["worst_ms"] = round(st.worst_ms, 3)
+                    svc["worst_handler"] = handler
+            return {"budget_ms": self.budget_ms, "services": out}
+
+
+watchdog = CallbackWatchdog()
+
+
+def watched(fn):
+    """Decorador para metodos que tocan hardware: mide contra el presupuesto"""
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        with watchdog.timed(type(self).__name__, fn.__name__):
+            return fn(self, *args, **kwargs)
+    return wrapper
+
+
+def snapshot():
+    return watchdog.snapshot()